@@ -29,124 +29,7 @@ from PyQt4.QtGui import (QWidget, QDialog, QListWidget, QListWidgetItem, QVBoxLa
                          QGroupBox, QComboBox, QDateEdit, QFileDialog, QIcon, QLineEdit,
                          QRadioButton, QButtonGroup)
 from PyQt4.QtCore import Qt, QSize, SIGNAL, SLOT, QVariant, QDate
-from ConfigParser import RawConfigParser
-from datetime import datetime
-VERSION = "0.1.3"
-
-class NoDefault:
-    pass
-
-
-DEFAULTS = [
-            ('simulation', 
-             {
-              'datesim': '2010-01-01',
-              'nmen': 101,
-              'xaxis':  'sal',
-              'maxrev': 50000,
-              }),
-            ('paths',
-             {'data_dir': 'data',
-              'cas_type_dir': 'castypes',
-              'reformes_dir': 'reformes',
-              'calib_dir'   :  'calibrations',
-              'survey_data/file':'data/final.csv',
-              'survey_data/bareme_only': False,
-              'survey_data/survey_enabled': True,
-              'output_dir' : os.path.expanduser('~'),
-
-              }),
-            ('calibration', 
-             {'inputs_filename': 'calage_men.csv',
-              'pfam_filename': 'calage_pfam.csv',
-              'method': 'logit',
-              'up': 3.0,
-              'invlo': 3.0,
-              })
-            
-            ]
-
-class UserConfigParser(RawConfigParser):
-    def __init__(self, defaults, filename):
-        RawConfigParser.__init__(self)
-        self.defaults = defaults
-
-        try:
-            open(filename)
-            self.read(filename)
-        except:
-            for section in DEFAULTS:
-                self.add_section(section[0])
-                for key, val in section[1].iteritems():
-                    self.set(section[0], key, val)
-
-    def get(self, section, option):
-#    def get(self, section, option, default=NoDefault):
-        """
-        Get an option
-        section=None: attribute a default section name
-        default: default value (if not specified, an exception
-        will be raised if option doesn't exist)
-        """
-#        section = self.__check_section_option(section, option)
-#
-#        if not self.has_section(section):
-#            if default is NoDefault:
-#                raise NoSectionError(section)
-#            else:
-#                self.add_section(section)
-#        
-#        if not self.has_option(section, option):
-#            if default is NoDefault:
-#                raise NoOptionError(option, section)
-#            else:
-#                self.set(section, option, default)
-#                return default
-            
-#        value = ConfigParser.get(self, section, option, self.raw)
-        value = RawConfigParser.get(self, section, option)
-        default_value = self.get_default(section, option)
-        if isinstance(default_value, bool):
-            if not isinstance(value, bool):
-                value = eval(value)
-        elif isinstance(default_value, float):
-            value = float(value)
-        elif isinstance(default_value, int):
-            value = int(value)
-        else:
-            try:
-                value = datetime.strptime(value ,"%Y-%m-%d").date()
-            except:
-                pass
-                
-#        else:
-#            if isinstance(default_value, basestring):
-#                try:
-#                    value = value.decode('utf-8')
-#                except (UnicodeEncodeError, UnicodeDecodeError):
-#                    pass
-#            try:
-#                # lists, tuples, ...
-#                value = eval(value)
-#                print value
-#            except:
-#                pass
-        return value
-
-    def get_default(self, section, option):
-        """
-        Get Default value for a given (section, option)
-        -> useful for type checking in 'get' method
-        """
-#        section = self.__check_section_option(section, option)
-        for sec, options in self.defaults:
-            if sec == section:
-                if option in options:
-                    return options[ option ]
-#        else:
-#            return NoDefault
-
-CONF = UserConfigParser(DEFAULTS, 'main.cfg')
+from core.settings import VERSION, NoDefault, DEFAULTS, UserConfigParser, CONF
 
 def get_icon(iconFile):
     return QIcon()
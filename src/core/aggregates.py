@@ -0,0 +1,195 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from __future__ import division
+import numpy as np
+from pandas import DataFrame, isnull
+
+# number of variables weighted at once when the cube is built
+BLOCK_SIZE = 32
+
+def get_matrix(data, varnames):
+    '''
+    Returns the float array (observations x varnames) of the columns varnames of 
+    the DataFrame data
+    '''
+    return np.column_stack([np.asarray(data[var].values, dtype = float) for var in varnames])
+
+def finite_values(values):
+    '''
+    Returns values with its non finite values (NaN, inf) replaced by 0
+    '''
+    finite = np.isfinite(values)
+    if finite.all():
+        return values
+    return np.where(finite, values, 0)
+
+def weighted_sums(values, weights):
+    '''
+    Returns the weighted sum of values, or of each column of values (observations 
+    x variables) in one matrix product. Non finite values are left out.
+    '''
+    return np.dot(weights, finite_values(values))
+
+def weighted_counts(values, weights):
+    '''
+    Returns the weighted number of non zero finite values, of each column of 
+    values if it is two dimensional
+    '''
+    return np.dot(weights, finite_values(values) != 0)
+
+def weighted_means(values, weights):
+    '''
+    Returns the weighted mean of values, of each column of values if it is two 
+    dimensional
+    '''
+    return np.dot(weights, values)/np.sum(weights)
+
+def group_sums(codes, values, weights, ngroups = 0):
+    '''
+    Returns the weighted sums of values by group, codes being the group (from 0 
+    to ngroups - 1) of each observation
+    '''
+    return np.bincount(codes, weights = values*weights, minlength = ngroups)
+
+def _sort(values, weights):
+    order = np.argsort(values, kind = 'mergesort')
+    return np.asarray(values, dtype = float)[order], np.asarray(weights, dtype = float)[order]
+
+def weighted_quantiles(values, weights, q):
+    '''
+    Returns the weighted quantiles of values at q (a scalar or an array of 
+    probabilities between 0 and 1)
+    '''
+    values, weights = _sort(values, weights)
+    cumulated = np.cumsum(weights)
+    positions = np.searchsorted(cumulated, np.asarray(q)*cumulated[-1], 'left')
+    return values[np.minimum(positions, len(values) - 1)]
+
+def gini(values, weights):
+    '''
+    Returns the Gini coefficient of values, computed on the Lorenz curve of the 
+    weighted observations. When the total of values is zero, it is 0 if every 
+    weighted value is zero, NaN otherwise (or without population).
+    '''
+    values, weights = _sort(values, weights)
+    lorenz = np.concatenate(([0], np.cumsum(values*weights)))
+    if lorenz[-1] == 0:
+        if weights.sum() > 0 and not (values*weights).any():
+            return 0.
+        return np.nan
+    population = np.concatenate(([0], np.cumsum(weights)))/weights.sum()
+    lorenz /= lorenz[-1]
+    return 1 - np.dot(np.diff(population), lorenz[1:] + lorenz[:-1])
+
+def quantile_shares(values, weights, nquantiles = 10):
+    '''
+    Returns the shares of the total of values held by each weighted quantile 
+    (deciles by default), the observations being ranked by values. The shares 
+    are NaN when the total of values or the population is zero.
+    '''
+    values, weights = _sort(values, weights)
+    cumulated = np.cumsum(weights)
+    if not len(values) or cumulated[-1] == 0:
+        return np.nan*np.ones(nquantiles)
+    # an observation belongs to the quantile of the middle of its weight
+    rank = ((cumulated - weights/2)*nquantiles/cumulated[-1]).astype(int)
+    rank = np.minimum(rank, nquantiles - 1)
+    shares = np.bincount(rank, weights = values*weights, minlength = nquantiles)
+    if shares.sum() == 0:
+        return np.nan*np.ones(nquantiles)
+    return shares/shares.sum()
+
+class AggregateCube(object):
+    '''
+    Weighted sums and weighted numbers of beneficiaries (non zero values) of every 
+    numeric variable of a DataFrame, by category of each of the categorical 
+    variables, computed once so that any distribution is a lookup. For each 
+    categorical variable, the cube holds the sorted categories, their weight and 
+    two arrays of shape (number of categories, number of variables). The rows 
+    whose category is missing (NaN) are left out, as by DataFrame.groupby, and 
+    the non finite values (NaN, inf) of a variable count as zero.
+    '''
+    def __init__(self, data, categories, weight = 'wprm'):
+        super(AggregateCube, self).__init__()
+        categories = sorted(categories)
+        self.weight = weight
+        self.varnames = [var for var in data.columns 
+                         if var != weight and var not in categories and data[var].values.dtype.kind in 'biuf']
+        self.positions = dict((var, j) for j, var in enumerate(self.varnames))
+        w = np.asarray(data[weight].values, dtype = float)
+
+        # the rows are sorted once by category so that each sum is a reduceat
+        groups = {}
+        self.categories = {}
+        self.weights = {}
+        self.sums = {}
+        self.counts = {}
+        for by in categories:
+            values = data[by].values
+            rows = np.flatnonzero(~isnull(values))
+            order = rows[np.argsort(values[rows], kind = 'mergesort')]
+            sorted_values = values[order]
+            starts = np.flatnonzero(np.concatenate(([True], sorted_values[1:] != sorted_values[:-1])))
+            if not len(order):
+                starts = starts[:0]
+            groups[by] = (order, starts)
+            self.categories[by] = sorted_values[starts]
+            self.weights[by] = np.add.reduceat(w[order], starts)
+            self.sums[by] = np.empty((len(starts), len(self.varnames)))
+            self.counts[by] = np.empty((len(starts), len(self.varnames)))
+
+        for first in range(0, len(self.varnames), BLOCK_SIZE):
+            block = self.varnames[first:first + BLOCK_SIZE]
+            values = finite_values(get_matrix(data, block))
+            weighted = values*w[:, None]
+            beneficiaries = (values != 0)*w[:, None]
+            for by, (order, starts) in groups.iteritems():
+                self.sums[by][:, first:first + len(block)] = np.add.reduceat(weighted[order], starts)
+                self.counts[by][:, first:first + len(block)] = np.add.reduceat(beneficiaries[order], starts)
+
+    def _get_frame(self, by, varnames, table):
+        columns = [self.positions[var] for var in varnames]
+        items = [(by, self.categories[by]), (self.weight, self.weights[by])]
+        items.extend((var, table[:, j]) for var, j in zip(varnames, columns))
+        return DataFrame.from_items(items)
+
+    def get_sums(self, by, varnames):
+        '''
+        Returns a DataFrame of the weighted sums of varnames by category of by
+        '''
+        return self._get_frame(by, varnames, self.sums[by])
+
+    def get_counts(self, by, varnames):
+        '''
+        Returns a DataFrame of the weighted numbers of beneficiaries of varnames 
+        by category of by
+        '''
+        return self._get_frame(by, varnames, self.counts[by])
+
+    def get_means(self, by, varnames):
+        '''
+        Returns a DataFrame of the weighted means of varnames by category of by
+        '''
+        return self._get_frame(by, varnames, self.sums[by]/self.weights[by][:, None])
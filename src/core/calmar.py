@@ -10,7 +10,6 @@ from __future__ import division
 
 import numpy as np
 from numpy import exp, ones, zeros, unique, array, dot
-from scipy.optimize import fsolve
 
 def linear(u):
     return 1+u
@@ -26,12 +25,14 @@ def raking_ratio_prime(u):
         
 def logit(u,low,up):
     a=(up-low)/((1-low)*(up-1))
-    return (low*(up-1)+up*(1-low)*exp(a*u))/(up-1+(1-low)*exp(a*u))
+    # the exponent is bounded to avoid overflows: logit is constant to the float precision well before
+    e = exp(np.clip(a*u, -500, 500))
+    return (low*(up-1)+up*(1-low)*e)/(up-1+(1-low)*e)
 
 def logit_prime(u,low,up):
     a=(up-low)/((1-low)*(up-1))
-    return ( (a*up*(1-low)*exp(a*u))*(up-1+(1-low)*exp(a*u))-
-              (low*(up-1)+up*(1-low)*exp(a*u))*(1-low)*a*exp(a*u) )/(up-1+(1-low)*exp(a*u))**2
+    F = logit(u, low, up)
+    return a*(up-F)*(F-low)/(up-low)
 
 def build_dummies_dict(data):
     '''
@@ -43,38 +44,17 @@ def build_dummies_dict(data):
         output[val] = (data==val)
     return output
 
-def calmar(data, margins, param = {}, pondini='wprm_init'):
-    ''' 
-    calmar : calibration of weights according to some margins
-      - data is a dict containing individual data
-      - pondini (char) is the inital weight
-     margins is a dict containing for each var:
-      - a scalar var numeric variables
-      - a dict with categories key and population
-      - eventually a key named totalpop : total population. If absent initialized to actual total population 
-     param is a dict containing the following keys
-      - method : 'linear', 'raking ratio', 'logit'
-      - lo     : lower bound on weights ratio  <1
-      - up     : upper bound on weights ration >1
-      - use_proportions : default FALSE; if TRUE use proportions if total population from margins doesn't match total population
-      - param xtol  : relative precision on lagrangian multipliers. By default xtol = 1.49012e-08 (default fsolve xtol)
-      - param maxfev :  maximum number of function evaluation TODO  
-    '''   
-    # choice of method
-    
-    if not margins:
-        raise Exception("Calmar requires non empty dict of margins")
-    
-    if not 'method' in param:
-        param['method'] = 'linear'
-
-    if param['method'] == 'linear': 
-        F = linear
-        F_prime = linear_prime
-    elif param['method'] == 'raking ratio': 
-        F =  raking_ratio
-        F_prime =  raking_ratio_prime
-    elif param['method'] == 'logit':
+def get_functions(param):
+    '''
+    Returns the calibration function F and its derivative F_prime of the method 
+    given in param ('linear', 'raking ratio' or 'logit' with bounds 'lo' and 'up')
+    '''
+    method = param.get('method', 'linear')
+    if method == 'linear': 
+        return linear, linear_prime
+    elif method == 'raking ratio': 
+        return raking_ratio, raking_ratio_prime
+    elif method == 'logit':
         if not 'up' in param:
             raise Exception("When method is 'logit', 'up' parameter is needed in param")
         if not 'lo' in param:
@@ -83,109 +63,281 @@ def calmar(data, margins, param = {}, pondini='wprm_init'):
             raise Exception("When method is 'logit', 'up' should be strictly greater than 1")
         if param['lo'] >= 1:
             raise Exception("When method is 'logit', 'lo' should be strictly less than 1")        
-        F = lambda x: logit(x, param['lo'], param['up'])
-        F_prime = lambda x: logit_prime(x, param['lo'], param['up'])
-    
+        lo, up = param['lo'], param['up']
+        return lambda x: logit(x, lo, up), lambda x: logit_prime(x, lo, up)
     else:
         raise Exception("method should be 'linear', 'raking ratio' or 'logit'")
-    # construction observations matrix
-    if 'totalpop' in margins:
-        totalpop = margins.pop('totalpop')
-    else:
-        totalpop = data[pondini].sum()
-
-    if 'use_proportions' in param:
-        use_proportions = param['use_proportions']    
-    else:
-        use_proportions = False   
-
-    nk = len(data[pondini])
 
-    # number of Lagrange parameters (at least total population)
-    nj = 1
-    
-    margins_new = {}
+def check_margins(margins, totalpop, use_proportions = False):
+    '''
+    Returns a copy of margins without 'totalpop', where the margins of the categories
+    of each categorical variable are scaled to add up to totalpop if use_proportions
+    is True. Raises an exception if they do not add up to totalpop otherwise.
+    '''
     margins_new_dict = {}
     for var, val in margins.iteritems():
+        if var == 'totalpop':
+            continue
         if isinstance(val, dict):
-            dummies_dict = build_dummies_dict(data[var])            
-            k, pop = 0, 0
-            for cat, nb in val.iteritems():
-                cat_varname =  var + '_' + str(cat)
-                data[cat_varname] = dummies_dict[cat]
-                margins_new[cat_varname] = nb
-                if not margins_new_dict.has_key(var):
-                    margins_new_dict[var] = {}
-                margins_new_dict[var][cat] = nb
-                pop += nb
-                k += 1
-                nj += 1
+            margins_new_dict[var] = dict(val)
+            pop = sum(val.itervalues())
             # Check total popualtion
             if pop != totalpop:
                 if use_proportions:
                     print 'calmar: categorical variable %s is inconsistent with population; using proportions' % var
                     for cat, nb in val.iteritems():
-                        cat_varname =  var + '_' + str(cat)
-                        margins_new[cat_varname] = nb*totalpop/pop
                         margins_new_dict[var][cat] = nb*totalpop/pop
                 else:
                     raise Exception('calmar: categorical variable ', var, ' is inconsistent with population')
         else:
-            margins_new[var] = val
             margins_new_dict[var] = val
-            nj += 1
+    return margins_new_dict
 
-    # On conserve systematiquement la population  
-    if  hasattr(data,'dummy_is_in_pop'):
-        raise Exception('dummy_is_in_pop is not a valid variable name') 
-        
-    data['dummy_is_in_pop'] = ones(nk)
-    margins_new['dummy_is_in_pop'] = totalpop
+class Calmar(object):
+    '''
+    Calibration engine. The design matrix is kept as the dense columns of the 
+    numeric variables and, for each categorical variable, the code of the 
+    category of each observation, so that the dummies are never built. The 
+    margins are reached by a damped Newton method on the Lagrange multipliers 
+    using the closed form jacobian of the constraints, starting from the 
+    multipliers of the previous solution. The dense columns are stacked once 
+    and kept until the variables of the design change.
+    '''
+    def __init__(self, weights, param = {}):
+        super(Calmar, self).__init__()
+        self.weights = np.asarray(weights, dtype = float)
+        self.nk = len(self.weights)
+        self.numeric = {}
+        self.categorical = {}
+        # multipliers of the last solution: a scalar for a numeric variable, a dict by category otherwise
+        self.lambdas = {}
+        self.converged = False
+        self.iterations = 0
+        self.errors = {}
+        # matrix of the numeric columns of the last solve, and their names
+        self._design = None
+        self._design_names = None
+        self.set_param(param)
 
-    # paramètres de Lagrange initialisés à zéro
-    lambda0 = zeros(nj)
-    
-    # initial weights
-    d = data[pondini]
-    x = zeros((nk, nj)) # nb obs x nb constraints
-    xmargins = zeros(nj)
-    margins_dict = {}
-    j=0
-    for var , val in margins_new.iteritems():
-        x[:,j] = data[var]
-        xmargins[j] = val
-        margins_dict[var] =val
-        j += 1
-
-    # Résolution des équations du premier ordre
-    constraint = lambda l: dot(d*F(dot(x, l)), x) - xmargins
-    constraint_prime = lambda l: dot(d*( x.T*F_prime( dot(x, l))), x )
-    ## le jacobien celui ci-dessus est constraintprime = @(l) x*(d.*Fprime(x'*l)*x');
+    def set_param(self, param):
+        '''
+        Sets the method and the precision of the calibration. A change of method 
+        drops the multipliers of the last solution.
+        '''
+        method = (param.get('method', 'linear'), param.get('lo'), param.get('up'))
+        if method != getattr(self, 'method', None):
+            self.F, self.F_prime = get_functions(param)
+            self.method = method
+            self.lambdas = {}
+        self.xtol = param.get('xtol', 1.49012e-08)
+        self.maxiter = param.get('maxiter', 100)
+
+    def has_variable(self, var, categorical = False):
+        if categorical:
+            return var in self.categorical
+        return var in self.numeric
+
+    def add_variable(self, var, values, categorical = False):
+        '''
+        Adds the variable var to the design, values holding its value for each 
+        observation
+        '''
+        self.remove_variable(var)
+        if categorical:
+            categories, codes = unique(values, return_inverse = True)
+            self.categorical[var] = (categories, codes)
+        else:
+            self.numeric[var] = np.asarray(values, dtype = float)
+
+    def remove_variable(self, var):
+        self.numeric.pop(var, None)
+        self.categorical.pop(var, None)
+        self.lambdas.pop(var, None)
+        self._design = None
+        self._design_names = None
+
+    def get_margins(self, var, weights):
+        '''
+        Returns the total of the variable var with weights, by category (a dict) 
+        for a categorical variable
+        '''
+        if var in self.categorical:
+            categories, codes = self.categorical[var]
+            return dict(zip(categories, np.bincount(codes, weights = weights, minlength = len(categories))))
+        return dot(weights, self.numeric[var])
+
+    def _get_blocks(self, margins, totalpop):
+        '''
+        Returns the numeric columns, the categorical blocks and the vector of the 
+        targets of the constraints, the population being a numeric column of ones
+        '''
+        numeric = [('dummy_is_in_pop', ones(self.nk), totalpop)]
+        blocks = []
+        for var in sorted(margins):
+            val = margins[var]
+            if isinstance(val, dict):
+                if var not in self.categorical:
+                    raise Exception('calmar: categorical variable %s is not in the design' % var)
+                categories, codes = self.categorical[var]
+                positions = dict((cat, i) for i, cat in enumerate(categories))
+                active = []
+                for cat in sorted(val):
+                    if cat not in positions:
+                        raise Exception('calmar: category %s of variable %s is not found in data' % (cat, var))
+                    active.append(positions[cat])
+                targets = array([val[cat] for cat in sorted(val)], dtype = float)
+                blocks.append((var, sorted(val), codes, np.array(active, dtype = int), len(categories), targets))
+            else:
+                if var not in self.numeric:
+                    raise Exception('calmar: numeric variable %s is not in the design' % var)
+                numeric.append((var, self.numeric[var], val))
+        return numeric, blocks
+
+    def _get_design(self, numeric):
+        '''
+        Returns the matrix of the numeric columns given by _get_blocks, stacked 
+        again only when they are not those of the previous solve
+        '''
+        names = [var for var, values, target in numeric]
+        if names != self._design_names:
+            self._design = np.column_stack([values for var, values, target in numeric])
+            self._design_names = names
+        return self._design
+
+    def solve(self, margins, totalpop = None):
+        '''
+        Returns the calibrated weights reaching margins, a dict with for each 
+        variable of the design either a scalar for a numeric variable or a dict
+        of categories for a categorical one. The population totalpop is kept 
+        (by default the sum of the initial weights).
+        '''
+        if totalpop is None:
+            totalpop = self.weights.sum()
+        numeric, blocks = self._get_blocks(margins, totalpop)
+        names = [var for var, values, target in numeric]
+        x = self._get_design(numeric)
+        targets = np.concatenate([array([target for var, values, target in numeric], dtype = float)] + 
+                                 [block[5] for block in blocks])
+        nnum = len(numeric)
+        bounds = np.cumsum([nnum] + [len(block[3]) for block in blocks])
+        nj = bounds[-1]
+
+        # warm start from the previous multipliers of the variables still calibrated
+        lambdas = zeros(nj)
+        for j, var in enumerate(names):
+            lambdas[j] = self.lambdas.get(var, 0)
+        for b, (var, cats, codes, active, ncat, target) in enumerate(blocks):
+            previous = self.lambdas.get(var, {})
+            lambdas[bounds[b]:bounds[b+1]] = [previous.get(cat, 0) for cat in cats]
+
+        scale = np.where(targets != 0, abs(targets), 1)
+
+        def predictor(lambdas):
+            u = dot(x, lambdas[:nnum])
+            for b, (var, cats, codes, active, ncat, target) in enumerate(blocks):
+                full = zeros(ncat)
+                full[active] = lambdas[bounds[b]:bounds[b+1]]
+                u += full[codes]
+            return u
+
+        def residuals(w):
+            g = [dot(w, x)]
+            for var, cats, codes, active, ncat, target in blocks:
+                g.append(np.bincount(codes, weights = w, minlength = ncat)[active])
+            return np.concatenate(g) - targets
+
+        def jacobian(dw):
+            H = zeros((nj, nj))
+            H[:nnum, :nnum] = dot(x.T*dw, x)
+            for b, (var, cats, codes, active, ncat, target) in enumerate(blocks):
+                rows = slice(bounds[b], bounds[b+1])
+                H[rows, rows] = np.diag(np.bincount(codes, weights = dw, minlength = ncat)[active])
+                for j in range(nnum):
+                    H[rows, j] = np.bincount(codes, weights = dw*x[:, j], minlength = ncat)[active]
+                    H[j, rows] = H[rows, j]
+                for c in range(b):
+                    other = blocks[c]
+                    cols = slice(bounds[c], bounds[c+1])
+                    cross = np.bincount(codes*other[4] + other[2], weights = dw, minlength = ncat*other[4])
+                    H[rows, cols] = cross.reshape(ncat, other[4])[active][:, other[3]]
+                    H[cols, rows] = H[rows, cols].T
+            return H
+
+        d = self.weights
+        u = predictor(lambdas)
+        w = d*self.F(u)
+        g = residuals(w)
+        error = abs(g/scale).max()
+        self.converged = error < self.xtol
+        self.iterations = 0
+        while not self.converged and self.iterations < self.maxiter:
+            self.iterations += 1
+            H = jacobian(d*self.F_prime(u))
+            # the redundant constraints (e.g. categories adding up to the population) 
+            # make H singular: the system is solved in least squares once equilibrated
+            diag = np.sqrt(abs(np.diag(H)))
+            diag[diag == 0] = 1
+            step = np.linalg.lstsq(H/diag[:, None]/diag, -g/diag, rcond = 1e-10)[0]/diag
+            # damping: the step is halved until the margins get closer
+            t = 1
+            while t > 1e-6:
+                u_new = predictor(lambdas + t*step)
+                w_new = d*self.F(u_new)
+                g_new = residuals(w_new)
+                error_new = abs(g_new/scale).max()
+                if error_new < error:
+                    break
+                t /= 2
+            else:
+                break
+            lambdas = lambdas + t*step
+            u, w, g, error = u_new, w_new, g_new, error_new
+            self.converged = error < self.xtol
+
+        self.lambdasol = lambdas
+        self.lambdas = {}
+        for j, var in enumerate(names):
+            self.lambdas[var] = lambdas[j]
+        for b, (var, cats, codes, active, ncat, target) in enumerate(blocks):
+            self.lambdas[var] = dict(zip(cats, lambdas[bounds[b]:bounds[b+1]]))
+        errors = abs(g/scale)
+        self.errors = dict(zip(names, errors[:nnum]))
+        for b, (var, cats, codes, active, ncat, target) in enumerate(blocks):
+            self.errors[var] = errors[bounds[b]:bounds[b+1]].max()
+        return w
+
+def calmar(data, margins, param = {}, pondini='wprm_init'):
+    ''' 
+    calmar : calibration of weights according to some margins
+      - data is a dict containing individual data
+      - pondini (char) is the inital weight
+     margins is a dict containing for each var:
+      - a scalar var numeric variables
+      - a dict with categories key and population
+      - eventually a key named totalpop : total population. If absent initialized to actual total population 
+     param is a dict containing the following keys
+      - method : 'linear', 'raking ratio', 'logit'
+      - lo     : lower bound on weights ratio  <1
+      - up     : upper bound on weights ration >1
+      - use_proportions : default FALSE; if TRUE use proportions if total population from margins doesn't match total population
+      - param xtol  : relative precision on the margins. By default xtol = 1.49012e-08
+      - param maxiter :  maximum number of Newton iterations, 100 by default
+    See Calmar for the solver.
+    '''   
+    if not margins:
+        raise Exception("Calmar requires non empty dict of margins")
     
-    essai, ier = 0, 2
-    if 'xtol' in param: 
-        xtol = param['xtol']
+    engine = Calmar(data[pondini], param)
+    if 'totalpop' in margins:
+        totalpop = margins['totalpop']
     else:
-        xtol = 1.49012e-08
-        
-    err_max = 1    
-    conv = 1
-    while (ier==2 or ier==5 or ier==4) and not (essai >= 10 or (err_max < 1e-4 and conv < 1e-8 )):
-        lambdasol, infodict, ier, mesg = fsolve(constraint, lambda0, fprime=constraint_prime, maxfev= 256, xtol=xtol, full_output=1)
-        lambda0 = 1*lambdasol
-        essai += 1
-        
-        pondfin = d*F( dot(x, lambdasol))
-        rel_error ={}
-        for var, val in margins_new.iteritems():
-            rel_error[var] =  abs((data[var]*pondfin).sum() - margins_dict[var])/margins_dict[var]
-        import operator
-        sorted_err = sorted(rel_error.iteritems(), key=operator.itemgetter(1), reverse = True)
-        
-        conv = abs(err_max - sorted_err[0][1])
-        err_max = sorted_err[0][1]
-            
-    if (ier==2 or ier==5 or ier==4): 
-        print "calmar: stopped after ", essai, "tries"
-    return pondfin, lambdasol, margins_new_dict 
+        totalpop = engine.weights.sum()
+
+    margins_new_dict = check_margins(margins, totalpop, param.get('use_proportions', False))
+    for var, val in margins_new_dict.iteritems():
+        engine.add_variable(var, data[var], isinstance(val, dict))
 
+    pondfin = engine.solve(margins_new_dict, totalpop)
+    if not engine.converged: 
+        print "calmar: stopped after ", engine.iterations, "iterations"
+    return pondfin, engine.lambdasol, margins_new_dict
@@ -22,6 +22,9 @@ This file is part of openFisca.
 """
 
 from __future__ import division
+import ast
+import inspect
+import textwrap
 import numpy as np
 from utils import Enum
 
@@ -35,6 +38,8 @@ class Column(object):
         Column.count += 1
         self._default = default
         self._dtype = float
+        # if True, the values read from a survey can be stored in a narrower dtype (see compact)
+        self._compact = False
 
 class IntCol(Column):
     '''
@@ -43,6 +48,7 @@ class IntCol(Column):
     def __init__(self, label = None, default = 0):
         super(IntCol, self).__init__(label, default)
         self._dtype = np.float32
+        self._compact = True
         
 class EnumCol(IntCol):
     '''
@@ -87,10 +93,159 @@ class DateCol(Column):
         super(DateCol, self).__init__(label, default)
         self._dtype = np.datetime64
 
+# integer dtypes in which the columns of integers can be stored, narrowest first
+STORAGE_DTYPES = [np.int8, np.int16, np.int32]
+
+def compact(col, var):
+    '''
+    Returns var stored in the narrowest integer dtype of STORAGE_DTYPES that holds 
+    its values and the default value of col, or var itself if col cannot be 
+    compacted or if var holds non integer values. Values are read back in col._dtype 
+    by DataTable.get_value.
+    '''
+    if not col._compact or not len(var):
+        return var
+    low, high = min(var.min(), col._default), max(var.max(), col._default)
+    for dtype in STORAGE_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            if np.dtype(dtype).itemsize >= var.dtype.itemsize:
+                return var
+            stored = var.astype(dtype)
+            if np.array_equal(stored, var):
+                return stored
+            return var
+    return var
+
+class Aggregate(object):
+    '''
+    Value of the _option dict of a Prestation asking the solver for the reduction 
+    of an input over the members of the unit of the prestation, instead of a dict 
+    with the value of each person.
+    how can be 'sum', 'max', 'min', 'any' or 'count' (see DataTable.aggregate)
+    roles is an optional list of persons restricting the members (e.g. [CHEF, PART])
+    '''
+    def __init__(self, how = 'sum', roles = None):
+        super(Aggregate, self).__init__()
+        self.how = how
+        self.roles = roles
+        if roles is None:
+            self.key = (how, None)
+        else:
+            self.key = (how, tuple(roles))
+
+SUM = Aggregate('sum')
+        
+COMPARE_OPS = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', 
+               ast.Gt: '>', ast.GtE: '>=', ast.In: 'in', ast.NotIn: 'not in'}
+
+def param_reads(func, argname = '_P'):
+    '''
+    Returns the parameters read by func through its argument argname, as a set of 
+    paths (tuples of attribute names, ie _P.ir.bareme gives ('ir', 'bareme')) and 
+    a set of tests (path, op, value) for the parameters that are only compared 
+    to a literal, ie _P.datesim.year <= 2007 gives (('datesim', 'year'), '<=', 2007). 
+    Local aliases such as P = _P.fam are followed, so that P.af.bmaf gives 
+    ('fam', 'af', 'bmaf'). The empty path stands for the whole tree: it is 
+    returned when argname is used as such or when the source of func is not 
+    available.
+    '''
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    except (IOError, TypeError, SyntaxError):
+        return set([()]), set()
+
+    parents = {}
+    for node in ast.walk(tree):
+        for child in ast.iter_child_nodes(node):
+            parents[child] = node
+
+    def chain(node):
+        path = []
+        parent = parents.get(node)
+        while isinstance(parent, ast.Attribute) and parent.value is node:
+            path.append(parent.attr)
+            node, parent = parent, parents.get(parent)
+        return node, tuple(path)
+
+    def test(node):
+        compare = parents.get(node)
+        if not (isinstance(compare, ast.Compare) and compare.left is node and 
+                len(compare.ops) == 1 and type(compare.ops[0]) in COMPARE_OPS):
+            return None
+        try:
+            value = ast.literal_eval(compare.comparators[0])
+            hash(value)
+        except (ValueError, TypeError):
+            return None
+        return COMPARE_OPS[type(compare.ops[0])], value
+
+    # names bound to a subtree of the parameters, with the prefixes they stand for
+    prefixes = {argname: [()]}
+    names = [node for node in ast.walk(tree) 
+             if isinstance(node, ast.Name) and not isinstance(node.ctx, (ast.Param, ast.Store))]
+    assigned = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    assigned.setdefault(target.id, []).append(node.value)
+
+    aliases = set()
+    changed = True
+    while changed:
+        changed = False
+        for name, values in assigned.iteritems():
+            if name in prefixes or name == argname:
+                continue
+            found = []
+            for value in values:
+                root = value
+                while isinstance(root, ast.Attribute):
+                    root = root.value
+                if not (isinstance(root, ast.Name) and root.id in prefixes):
+                    found = None
+                    break
+                top, path = chain(root)
+                if top is not value:
+                    found = None
+                    break
+                found.extend(prefix + path for prefix in prefixes[root.id])
+            if found:
+                prefixes[name] = found
+                aliases.update(values)
+                changed = True
+
+    paths, tests = set(), set()
+    for node in names:
+        if node.id in prefixes:
+            top, path = chain(node)
+            if top in aliases:
+                continue
+            comparison = test(top)
+            for prefix in prefixes[node.id]:
+                if comparison is None or not prefix + path:
+                    paths.add(prefix + path)
+                else:
+                    tests.add((prefix + path,) + comparison)
+    return paths, tests
+
+def param_paths(func, argname = '_P'):
+    '''
+    Returns the set of the paths of the parameters read by func through its 
+    argument argname, tests included (see param_reads)
+    '''
+    paths, tests = param_reads(func, argname)
+    return paths | set(test[0] for test in tests)
+
 class Prestation(Column):
     '''
     Prestation is a wraper around a function which takes some arguments and return a single array. 
     _P is a reserved kwargs intended to pass a tree of parametres to the function
+    The function must not modify its arguments: the arrays it gets are shared by 
+    every prestation reading the same value (see SystemSf._gather) and are 
+    read-only, so that an assignment in place (x[...] = v, x += v) raises a 
+    ValueError. It works on a copy (x = x.copy()) and returns a new array.
     '''
     count = 0
     def __init__(self, func, unit= 'ind', label = None, start = None, end = None):
@@ -132,6 +287,24 @@ class Prestation(Column):
                 if var not in self.inputs:
                     raise Exception('%s in option but not in function args' % var)
     
+    def get_param_reads(self, argname = '_P'):
+        '''
+        Returns the paths and the tests of the parameters read through argname 
+        ('_P' or '_defaultP'), see param_reads
+        '''
+        if not hasattr(self, '_param_reads'):
+            self._param_reads = {}
+        if argname not in self._param_reads:
+            self._param_reads[argname] = param_reads(self._func, argname)
+        return self._param_reads[argname]
+
+    def get_param_paths(self, argname = '_P'):
+        '''
+        Returns the paths of the parameters read through argname ('_P' or '_defaultP')
+        '''
+        paths, tests = self.get_param_reads(argname)
+        return paths | set(test[0] for test in tests)
+
     def set_enabled(self):
         self._enabled = True
  
@@ -22,34 +22,51 @@ This file is part of openFisca.
 """
 
 from __future__ import division
+import os
+import pickle
 import numpy as np
-from Config import CONF
-from pandas import read_csv, DataFrame, concat
+from core.settings import CONF
+from pandas import read_csv, DataFrame
 from core.calmar import calmar
 
 from description import ModelDescription, Description
+from columns import Aggregate, compact
+from parametres.paramData import diff_params
+from profiler import Profiler
+from aggregates import weighted_sums
 
 INDEX = ['men', 'fam', 'foy']
 
+# survey data are cached as .npy files in the directory survey file + SURVEY_CACHE_EXT
+SURVEY_CACHE_EXT = '.cache'
+SURVEY_CACHE_VERSION = 2
+
 class DataTable(object):
     """
     Construct a SystemSf object is a set of Prestation objects
         * title [string]
         * comment [string]: text shown on the top of the first data item
     """
-    def __init__(self, model_description, survey_data = None, scenario = None):
+    def __init__(self, model_description, survey_data = None, scenario = None, datesim = None):
         super(DataTable, self).__init__()
 
         # Init instance attribute
+        self._model_description = model_description
         self.description = None
         self.scenario = None
         self._isPopulated = False
         self.col_names = []
-        self.table = DataFrame()
+        self._columns = {}
         self.index = {}
         self._nrows = 0
+        # DataFrame of the columns built by the table property, and the arrays it was built from
+        self._table = None
+        self._table_columns = None
 
-        self.datesim = CONF.get('simulation', 'datesim')
+        # date of the simulation, the one of the configuration unless given
+        if datesim is None:
+            datesim = CONF.get('simulation', 'datesim')
+        self.datesim = datesim
 
         self.NMEN = CONF.get('simulation', 'nmen')
         self.MAXREV = CONF.get('simulation', 'maxrev')
@@ -70,45 +87,161 @@ class DataTable(object):
             self.populate_from_survey_data(survey_data)
         elif scenario:
             self.populate_from_scenario(scenario)
+
+    @property
+    def table(self):
+        '''
+        DataFrame of the columns, built on demand (data exploration, csv export) 
+        and kept until a column is set or replaced. The columns never set are 
+        shown with their default value.
+        '''
+        if self._table is not None and self._table_columns == self._columns:
+            return self._table
+        columns = {}
+        for varname in self.col_names:
+            if varname in self._columns:
+                columns[varname] = self._columns[varname]
+            else:
+                columns[varname] = self._new_column(varname)
+        self._table = DataFrame(columns)
+        self._table_columns = _ColumnsKey(self._columns)
+        return self._table
+
+    def _new_column(self, varname):
+        '''
+        Returns a preallocated array of length nrows filled with the default value of varname
+        '''
+        col = self.description.get_col(varname)
+        var = np.empty(self._nrows, dtype = col._dtype)
+        var.fill(col._default)
+        return var
+
+    def _get_column(self, varname, store = True):
+        '''
+        Returns the stored array of varname. A column never set is allocated with 
+        its default value, and stored only if store is True.
+        '''
+        if varname in self._columns:
+            return self._columns[varname]
+        var = self._new_column(varname)
+        if store:
+            self._columns[varname] = var
+        return var
+
+    def _set_columns_from_frame(self, frame):
+        '''
+        Stores the columns of a DataFrame as typed numpy arrays, in a narrower dtype 
+        when possible (see columns.compact), adding missing columns filled with 
+        their default value. Returns the list of missing columns
+        '''
+        self._nrows = frame.shape[0]
+        self._columns = {}
+        missing_col = []
+        for col in self.description.columns.itervalues():
+            if col.name in frame:
+                self._columns[col.name] = compact(col, np.array(frame[col.name].values, dtype = col._dtype))
+            else:
+                missing_col.append(col.name)
+                self._columns[col.name] = compact(col, self._new_column(col.name))
+        return missing_col
         
     def gen_index(self, units):
-
-        self.index = {'ind': {0: {'idxIndi':np.arange(self._nrows), 
-                                  'idxUnit':np.arange(self._nrows)},
-                      'nb': self._nrows},
-                      'noi': {}}
-        dct = self.index['noi']
-        nois = self.table.noi.values
-        listnoi = np.unique(nois)
-        for noi in listnoi:
-            idxIndi = np.sort(np.squeeze((np.argwhere(nois == noi))))
-            idxUnit = np.searchsorted(listnoi, nois[idxIndi])
-            temp = {'idxIndi':idxIndi, 'idxUnit':idxUnit}
-            dct.update({noi: temp}) 
+        '''
+        Builds the index of individuals and of each unit. The individuals are sorted 
+        once by role (stable sort) and grouped by unit with np.unique, so that the
+        cost does not depend on the number of roles. For each unit, index[unit] holds
+            - 'nb': the number of units
+            - 'unitPos': the position of the unit of each individual
+            - 'role': the role (quifoy, quifam, quimen) of each individual
+            - 'order', 'offsets': the individuals sorted by role, those having the k-th 
+              role of the enum being order[offsets[k]:offsets[k+1]]
+            - for each role of the enum, a dict {'idxIndi', 'idxUnit'} with the rows 
+              of the individuals having this role and the position of their unit
+        '''
+        arrays = {}
+        listnoi, noiPos = np.unique(self._columns['noi'], return_inverse = True)
+        arrays['noi'] = {'nb': len(listnoi),
+                         'noi': listnoi,
+                         'unitPos': noiPos,
+                         'order': np.argsort(noiPos, kind = 'mergesort'),
+                         'offsets': np.concatenate(([0], np.cumsum(np.bincount(noiPos, minlength = len(listnoi)))))}
             
         for unit in units:
-            enum = self.description.get_col('qui'+unit).enum
             try:
-                idx = getattr(self.table, 'id'+unit).values
-                qui = getattr(self.table, 'qui'+unit).values
+                idx = self._columns['id'+unit]
+                qui = self._columns['qui'+unit]
                 enum = self.description.get_col('qui'+unit).enum
             except:
                 raise Exception('DataTable needs columns %s and %s to build index with unit %s' %
                           ('id' + unit, 'qui' + unit, unit))
 
-            self.index[unit] = {}
-            dct = self.index[unit]
-            idxlist = np.unique(idx)
-            dct['nb'] = len(idxlist)
-
-            for full, person in enum:
-                idxIndi = np.sort(np.squeeze((np.argwhere(qui == person))))
-#                if (person == 0) and (dct['nb'] != len(idxIndi)):
-#                    raise Exception('Invalid index for %s: There is %i %s and %i %s' %(unit, dct['nb'], unit, len(idxIndi), full))
-                idxUnit = np.searchsorted(idxlist, idx[idxIndi])
-                temp = {'idxIndi':idxIndi, 'idxUnit':idxUnit}
-                dct.update({person: temp}) 
+            idxlist, unitPos = np.unique(idx, return_inverse = True)
+            order = np.argsort(qui, kind = 'mergesort')
+            persons = sorted(person for full, person in enum)
+            roles = qui[order]
+            offsets = np.append(np.searchsorted(roles, persons, 'left'), 
+                                np.searchsorted(roles, persons[-1], 'right'))
+            arrays[unit] = {'nb': len(idxlist), 
+                            'unitPos': unitPos,
+                            'role': qui,
+                            'order': order,
+                            'offsets': offsets}
+
+        self._set_index(arrays)
+
+    def _set_index(self, arrays):
+        '''
+        Builds self.index from the compact arrays of each unit (see gen_index)
+        '''
+        rows = np.arange(self._nrows)
+        self.index = {'ind': {0: {'idxIndi': rows, 
+                                  'idxUnit': rows},
+                              'nb': self._nrows,
+                              'unitPos': rows}}
+
+        for unit, dct in arrays.iteritems():
+            if unit == 'noi':
+                persons = dct['noi']
+            else:
+                enum = self.description.get_col('qui'+unit).enum
+                persons = sorted(person for full, person in enum)
+            index = dict(dct)
+            order, offsets, unitPos = dct['order'], dct['offsets'], dct['unitPos']
+            for k, person in enumerate(persons):
+                idxIndi = order[offsets[k]:offsets[k+1]]
+                index[person] = {'idxIndi': idxIndi, 'idxUnit': unitPos[idxIndi]}
+            self.index[unit] = index
     
+    def take(self, rows):
+        '''
+        Returns a new DataTable holding the individuals at rows, in this order, 
+        with its own index
+        '''
+        table = DataTable(self._model_description, datesim = self.datesim)
+        table._nrows = len(rows)
+        table._columns = dict((name, var[rows]) for name, var in self._columns.iteritems())
+        table.gen_index(INDEX)
+        table._isPopulated = True
+        return table
+
+    def get_changed_columns(self, other):
+        '''
+        Returns the set of the columns whose values differ between other and this 
+        DataTable, or None if they do not hold the same individuals in the same units
+        '''
+        if other._model_description is not self._model_description or other._nrows != self._nrows:
+            return None
+        changed = set()
+        for varname in self.col_names:
+            if varname not in self._columns and varname not in other._columns:
+                continue
+            if not np.array_equal(self._get_column(varname, store = False), other._get_column(varname, store = False)):
+                changed.add(varname)
+        structure = set(['noi'] + ['id' + unit for unit in INDEX] + ['qui' + unit for unit in INDEX])
+        if changed & structure:
+            return None
+        return changed
+
     def propagate_to_members(self, unit , col):
         '''
         Set the variable of all unit member to the value of the (head of) unit
@@ -122,22 +255,21 @@ class DataTable(object):
 
     def inflate(self, totals):
         for varname in totals:
-            if varname in self.table:
-                x = sum(self.table[varname]*self.table['wprm'])/totals[varname]
+            if varname in self._columns:
+                var = self._columns[varname]
+                x = weighted_sums(var, self._columns['wprm'])/totals[varname]
                 if x>0:
-                    self.table[varname] = self.table[varname]/x
+                    col = self.description.get_col(varname)
+                    self._columns[varname] = np.asarray(var/x, dtype = col._dtype)
 
     def populate_from_survey_data(self, fname):
-        with open(fname) as survey_data_file:
-            self.table = read_csv(survey_data_file)
+        if self._load_survey_cache(fname):
+            self._isPopulated = True
+            self.set_value('wprm_init', self.get_value('wprm'),self.index['ind'])
+            return
 
-        self._nrows = self.table.shape[0]
-        missing_col = []
-        for col in self.description.columns.itervalues():
-            if not col.name in self.table:
-                missing_col.append(col.name)
-                self.table[col.name] = col._default
-            self.table[col.name] = self.table[col.name].astype(col._dtype)
+        with open(fname) as survey_data_file:
+            missing_col = self.populate_from_frame(read_csv(survey_data_file))
 
         if missing_col:
             message = "%i input variables missing\n" % len(missing_col)
@@ -145,6 +277,14 @@ class DataTable(object):
                 message += '  - '+ var + '\n'
             print Warning(message)
         
+        self._save_survey_cache(fname)
+
+    def populate_from_frame(self, frame):
+        '''
+        Populates the table with the survey data of a DataFrame and builds the index.
+        Returns the list of the columns missing in frame
+        '''
+        missing_col = self._set_columns_from_frame(frame)
         for var in INDEX:
             if ('id' + var) in missing_col:
                 raise Exception('Survey data needs variable %s' % ('id' + var))
@@ -152,11 +292,93 @@ class DataTable(object):
             if ('qui' + var) in missing_col:
                 raise Exception('Survey data needs variable %s' % ('qui' + var))
 
-        
         self.gen_index(INDEX)
         self._isPopulated = True
         
         self.set_value('wprm_init', self.get_value('wprm'),self.index['ind'])
+        return missing_col
+
+    def _survey_cache_meta(self, fname):
+        '''
+        Returns the metadata identifying a survey cache: the signature of the csv 
+        file and the name, type and default value of each column
+        '''
+        stat = os.stat(fname)
+        columns = {}
+        for col in self.description.columns.itervalues():
+            columns[col.name] = (np.dtype(col._dtype).str, col._default)
+        return {'version': SURVEY_CACHE_VERSION,
+                'csv': (os.path.abspath(fname), stat.st_size, stat.st_mtime),
+                'columns': columns,
+                'units': sorted(INDEX)}
+
+    def _save_survey_cache(self, fname):
+        '''
+        Writes the columns and the index of the survey as .npy files in the 
+        directory fname + '.cache' so that next loads can memory-map them
+        '''
+        cache_dir = fname + SURVEY_CACHE_EXT
+        try:
+            if not os.path.isdir(cache_dir):
+                os.mkdir(cache_dir)
+            meta_file = os.path.join(cache_dir, 'meta.pickle')
+            if os.path.exists(meta_file):
+                os.remove(meta_file)
+            for name, var in self._columns.iteritems():
+                np.save(os.path.join(cache_dir, name + '.npy'), var)
+            nb = {}
+            for unit in ['noi'] + INDEX:
+                for key, val in self.index[unit].iteritems():
+                    if key == 'nb':
+                        nb[unit] = val
+                    elif isinstance(key, basestring):
+                        np.save(os.path.join(cache_dir, 'index_%s_%s.npy' % (unit, key)), val)
+            meta = self._survey_cache_meta(fname)
+            meta['nrows'] = self._nrows
+            meta['nb'] = nb
+            # meta data are written last: a cache without them is never used
+            with open(meta_file, 'wb') as f:
+                pickle.dump(meta, f, pickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError), e:
+            print Warning('Unable to write survey cache %s: %s' % (cache_dir, e))
+
+    def _load_survey_cache(self, fname):
+        '''
+        Memory-maps the columns and the index of the survey from its cache if it is 
+        up to date. Returns False if the cache is missing or stale.
+        Columns are mapped copy-on-write: they are paged in only when used, and 
+        set_value never modifies the cache.
+        '''
+        cache_dir = fname + SURVEY_CACHE_EXT
+        meta_file = os.path.join(cache_dir, 'meta.pickle')
+        if not os.path.exists(meta_file):
+            return False
+        try:
+            with open(meta_file, 'rb') as f:
+                meta = pickle.load(f)
+            current = self._survey_cache_meta(fname)
+            for key, val in current.iteritems():
+                if meta.get(key) != val:
+                    return False
+
+            columns = {}
+            for name in self.description.col_names:
+                columns[name] = np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode = 'c')
+
+            arrays = {}
+            for unit in ['noi'] + INDEX:
+                arrays[unit] = {'nb': meta['nb'][unit]}
+                keys = ['noi', 'unitPos', 'order', 'offsets'] if unit == 'noi' else ['unitPos', 'role', 'order', 'offsets']
+                for key in keys:
+                    arrays[unit][key] = np.load(os.path.join(cache_dir, 'index_%s_%s.npy' % (unit, key)), mmap_mode = 'r')
+        except Exception, e:
+            print Warning('Unable to read survey cache %s: %s' % (cache_dir, e))
+            return False
+
+        self._columns = columns
+        self._nrows = meta['nrows']
+        self._set_index(arrays)
+        return True
 #        self.calage()
 
 #    def calage(self):
@@ -171,96 +393,118 @@ class DataTable(object):
 #        self.inflate(totals)             
 
     def populate_from_scenario(self, scenario):
-        self._nrows = self.NMEN*len(scenario.indiv)
-        MAXREV = self.MAXREV
+        '''
+        Populates the table with NMEN copies of the ménage of scenario, the income 
+        XAXIS of the reference person ranging from 0 to MAXREV. Each individual 
+        takes a block of NMEN contiguous rows, one per copy: the columns given by 
+        the scenario are allocated once and filled by block, the other ones are 
+        left to their default value (see _get_column), and the index is built from 
+        the structure of the scenario rather than by gen_index.
+        '''
+        NMEN = self.NMEN
         datesim = self.datesim
+        indiv = scenario.indiv.items()
+        nind = len(indiv)
+        self._nrows = NMEN*nind
+        self._columns = {}
+
+        def blocks(varname):
+            # view of the column with one line per individual and one row per copy
+            return self._get_column(varname).reshape(nind, NMEN)
+
+        qui = {}
+        for unit in INDEX:
+            enum = self.description.get_col('qui' + unit).enum
+            qui[unit] = np.array([enum[dct['qui' + unit]] for noi, dct in indiv])
+            blocks('qui' + unit)[:] = qui[unit][:, None]
+        nois = np.array([noi for noi, dct in indiv])
+        noidec = np.array([dct['noidec'] for noi, dct in indiv])
+        noichef = np.array([dct['noichef'] for noi, dct in indiv])
+        birth = [dct['birth'] for noi, dct in indiv]
+        idmen = np.arange(60001, 60001 + NMEN)
+        blocks('noi')[:] = nois[:, None]
+        blocks('age')[:] = np.array([datesim.year - b.year for b in birth])[:, None]
+        blocks('agem')[:] = np.array([12*(datesim.year - b.year) + datesim.month - b.month for b in birth])[:, None]
+        blocks('idmen')[:] = idmen
+        blocks('idfoy')[:] = 100*idmen + noidec[:, None]
+        blocks('idfam')[:] = 100*idmen + noichef[:, None]
+
+        # the values are given for the person noi of each unit
+        structure = ('birth', 'noipref', 'noidec', 'noichef', 'quifoy', 'quimen', 'quifam')
+        for unit, values, skip in (('men', scenario.indiv, structure), ('foy', scenario.declar, ()), ('men', scenario.menage, ())):
+            for noi, dct in values.iteritems():
+                members = qui[unit] == noi
+                for var, val in dct.iteritems():
+                    if var in skip: continue
+                    blocks(var)[members] = val
 
-        self.table = DataFrame()
-
-        idmen = np.arange(60001, 60001 + self.NMEN)
-        for noi, dct in scenario.indiv.iteritems():
-            birth = dct['birth']
-            age = datesim.year- birth.year
-            agem = 12*(datesim.year- birth.year) + datesim.month - birth.month
-            noidec = dct['noidec']
-            noichef = dct['noichef']
-            quifoy = self.description.get_col('quifoy').enum[dct['quifoy']]
-            quifam = self.description.get_col('quifam').enum[dct['quifam']]
-            quimen = self.description.get_col('quimen').enum[dct['quimen']]
-            dct = {'noi': noi*np.ones(self.NMEN),
-                   'age': age*np.ones(self.NMEN),
-                   'agem': agem*np.ones(self.NMEN),
-                   'quimen': quimen*np.ones(self.NMEN),
-                   'quifoy': quifoy*np.ones(self.NMEN),
-                   'quifam': quifam*np.ones(self.NMEN),
-                   'idmen': idmen,
-                   'idfoy': idmen*100 + noidec,
-                   'idfam': idmen*100 + noichef}
-            self.table = concat([self.table, DataFrame(dct)], ignore_index = True)
-
-        self.gen_index(INDEX)
-
-        for name in self.col_names:
-            if not name in self.table:
-                self.table[name] = self.description.get_col(name)._default
-            
-        index = self.index['men']
-        nb = index['nb']
-        for noi, dct in scenario.indiv.iteritems():
-            for var, val in dct.iteritems():
-                if var in ('birth', 'noipref', 'noidec', 'noichef', 'quifoy', 'quimen', 'quifam'): continue
-                if not index[noi] is None:
-                    self.set_value(var, np.ones(nb)*val, index, noi)
-
-        index = self.index['foy']
-        nb = index['nb']
-        for noi, dct in scenario.declar.iteritems():
-            for var, val in dct.iteritems():
-                if not index[noi] is None:
-                    self.set_value(var, np.ones(nb)*val, index, noi)
-
-        index = self.index['men']
-        nb = index['nb']
-        for noi, dct in scenario.menage.iteritems():
-            for var, val in dct.iteritems():
-                if not index[noi] is None:
-                    self.set_value(var, np.ones(nb)*val, index, noi)
-            
         # set xaxis
         # TODO: how to set xaxis vals properly
-        if self.NMEN>1:
-            var = self.XAXIS
-            vls = np.linspace(0, MAXREV, self.NMEN)
-            self.set_value(var, vls, {0:{'idxIndi': index[0]['idxIndi'], 'idxUnit': index[0]['idxIndi']}})
-        
+        if NMEN>1:
+            blocks(self.XAXIS)[qui['men'] == 0] = np.linspace(0, self.MAXREV, NMEN)
+
+        # index: the ménage of row k*NMEN + j is the copy j, its foyers and familles 
+        # are numbered by copy then by noidec and noichef
+        listnoi, noiPos = np.unique(nois, return_inverse = True)
+        arrays = {'noi': {'nb': len(listnoi),
+                          'noi': listnoi,
+                          'unitPos': np.repeat(noiPos, NMEN),
+                          'order': _block_order(noiPos, NMEN),
+                          'offsets': np.concatenate(([0], NMEN*np.cumsum(np.bincount(noiPos, minlength = len(listnoi)))))}}
+        heads = {'men': np.zeros(nind, dtype = int), 'foy': noidec, 'fam': noichef}
+        for unit in INDEX:
+            listhead, headPos = np.unique(heads[unit], return_inverse = True)
+            enum = self.description.get_col('qui' + unit).enum
+            persons = sorted(person for full, person in enum)
+            roles = np.repeat(np.sort(qui[unit], kind = 'mergesort'), NMEN)
+            arrays[unit] = {'nb': NMEN*len(listhead),
+                            'unitPos': (len(listhead)*np.arange(NMEN) + headPos[:, None]).ravel(),
+                            'role': self._columns['qui' + unit],
+                            'order': _block_order(qui[unit], NMEN),
+                            'offsets': np.append(np.searchsorted(roles, persons, 'left'), 
+                                                 np.searchsorted(roles, persons[-1], 'right'))}
+        self._set_index(arrays)
         self._isPopulated = True
 
-    def get_value(self, varname, index = None, opt = None, sum_ = False):
+    def get_value(self, varname, index = None, opt = None, sum_ = False, copy = False):
         '''
         method to read the value in an array
         index is a dict with the coordinates of each person in the array
-            - if index is none, returns the whole column (every person)
+            - if index is none, returns the whole column (every person) in the dtype of the 
+              column: a read-only view of the stored array, or a copy if copy is True 
+              or if it is stored in a narrower dtype (see columns.compact)
             - if index is not none, return an array of length len(unit)
         opt is a dict with the id of the person for which you want the value
             - if opt is None, returns the value for the person 0 (i.e. 'vous' for 'foy', 'chef' for 'fam', 'pref' for 'men')
             - if opt is not None, return a dict with key 'person' and values for this person
+        The columns are modified by set_value only.
         '''
         col = self.description.get_col(varname)
         dflt = col._default
         dtyp = col._dtype
-        var = np.array(self.table[varname].values, dtype = col._dtype)
-        if index is None:
+        if index is None or (opt is None and index is self.index.get('ind')):
+            # individuals are already in the order of the column
+            var = self._get_column(varname, store = index is None)
+            if var.dtype != dtyp:
+                return var.astype(dtyp)
+            if copy:
+                return var.copy()
+            var = var.view()
+            var.flags.writeable = False
             return var
+        var = self._get_column(varname, store = False)
         nb = index['nb']
         if opt is None:
-            temp = np.ones(nb, dtype = dtyp)*dflt
+            temp = np.empty(nb, dtype = dtyp)
+            temp.fill(dflt)
             idx = index[0]
             temp[idx['idxUnit']] = var[idx['idxIndi']]
             return temp
         else:
             out = {}
             for person in opt:
-                temp = np.ones(nb, dtype = dtyp)*dflt
+                temp = np.empty(nb, dtype = dtyp)
+                temp.fill(dflt)
                 idx = index[person]
                 temp[idx['idxUnit']] = var[idx['idxIndi']]
                 out[person] = temp
@@ -272,24 +516,67 @@ class DataTable(object):
                     sumout += val
                 return sumout
 
+    def aggregate(self, varname, unit, how = 'sum', roles = None):
+        '''
+        Reduces the column varname over the members of each unit in one pass and 
+        returns an array of length len(unit)
+            - how can be 'sum', 'max', 'min', 'any' or 'count' (number of members 
+              with a non zero value)
+            - roles is an optional list of persons (e.g. [CHEF, PART]) restricting 
+              the members taken into account
+        '''
+        index = self.index[unit]
+        nb = index['nb']
+        var = self._get_column(varname, store = False)
+        pos = index['unitPos']
+        if roles is not None:
+            members = np.in1d(index['role'], roles)
+            var = var[members]
+            pos = pos[members]
+
+        if how == 'sum':
+            return np.bincount(pos, weights = var, minlength = nb)
+        elif how == 'count':
+            return np.bincount(pos[var != 0], minlength = nb)
+        elif how == 'any':
+            return np.bincount(pos[var != 0], minlength = nb) > 0
+        elif how in ('max', 'min'):
+            ufunc = np.maximum if how == 'max' else np.minimum
+            col = self.description.get_col(varname)
+            out = np.empty(nb, dtype = col._dtype)
+            out.fill(col._default)
+            if len(var):
+                order = np.argsort(pos, kind = 'mergesort')
+                sorted_pos = pos[order]
+                starts = np.flatnonzero(np.concatenate(([True], sorted_pos[1:] != sorted_pos[:-1])))
+                out[sorted_pos[starts]] = ufunc.reduceat(var[order], starts)
+            return out
+        else:
+            raise Exception("how should be 'sum', 'max', 'min', 'any' or 'count' but is %s" % how)
+
     def set_value(self, varname, value, index, opt = None):
+        '''
+        Writes value (an array of length len(unit)) in place in the column varname
+        for the person opt of each unit (person 0 if opt is None). A read-only 
+        column, shared with another table (see SystemSf.reuse), is copied first.
+        '''
         if opt is None:
             idx = index[0]
         else:
             idx = index[opt]
 
-        # this command should work on later pandas version...
-        # self.table.ix[idx['idxIndi'], [varname]] = value
-
-        # for now, we're doing it manually
         col = self.description.get_col(varname)
-        values = self.table[varname].values
-        
-        dtyp = col._dtype
-        temp = np.array(value, dtype = dtyp)
-        var = np.array(values, dtype = dtyp)
-        var[idx['idxIndi']] =  temp[idx['idxUnit']]
-        self.table[varname] = var
+        temp = np.asarray(value, dtype = col._dtype)
+        var = self._get_column(varname)
+        if var.dtype != col._dtype:
+            # a compacted column gets back its dtype before being modified
+            var = var.astype(col._dtype)
+            self._columns[varname] = var
+        elif not var.flags.writeable:
+            var = var.copy()
+            self._columns[varname] = var
+        var[idx['idxIndi']] = temp[idx['idxUnit']]
+        self._table = None
 
     def to_csv(self, fname):
         self.table.to_csv(fname)
@@ -298,14 +585,101 @@ class DataTable(object):
         return self.table.__str__()
 
 
+class _ColumnsKey(dict):
+    '''
+    Copy of a dict of columns, equal to the dicts holding the same arrays
+    '''
+    def __eq__(self, other):
+        if len(self) != len(other):
+            return False
+        for name, var in self.iteritems():
+            if other.get(name) is not var:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+def _block_order(keys, size):
+    '''
+    Returns the stable argsort of np.repeat(keys, size), computed on keys: the 
+    blocks of size rows sorted by key
+    '''
+    order = np.argsort(keys, kind = 'mergesort')
+    return (size*order[:, None] + np.arange(size)).ravel()
+
+def _prefixes(paths):
+    '''
+    Returns the set of paths and the set of all their prefixes
+    '''
+    prefixes = set()
+    for path in paths:
+        for i in range(len(path) + 1):
+            prefixes.add(path[:i])
+    return set(paths), prefixes
+
+def _reads(paths, changed):
+    '''
+    Tells whether the parameters read at paths are affected by changed, as 
+    returned by _prefixes: a path is affected if it leads to a changed path or 
+    if it lies under one
+    '''
+    exact, prefixes = changed
+    for path in paths:
+        if path in prefixes:
+            return True
+        for i in range(len(path)):
+            if path[:i] in exact:
+                return True
+    return False
+
+def _get_param(param, path):
+    '''
+    Returns the value of the parameter at path in the tree param, None if missing
+    '''
+    for name in path:
+        param = getattr(param, name, None)
+    return param
+
+def _compare(value, op, other):
+    if op == '==': return value == other
+    if op == '!=': return value != other
+    if op == '<': return value < other
+    if op == '<=': return value <= other
+    if op == '>': return value > other
+    if op == '>=': return value >= other
+    if op == 'in': return value in other
+    if op == 'not in': return value not in other
+    raise Exception('unknown comparison %s' % op)
+
+def _tests_differ(tests, param, other):
+    '''
+    Tells whether one of the tests (path, op, value), as returned by param_reads, 
+    gives a different result on the parameter trees param and other
+    '''
+    for path, op, value in tests:
+        try:
+            if _compare(_get_param(param, path), op, value) != _compare(_get_param(other, path), op, value):
+                return True
+        except TypeError:
+            return True
+    return False
+
 class SystemSf(DataTable):
-    def __init__(self, model_description, param, defaultParam = None):
-        DataTable.__init__(self, model_description)
+    def __init__(self, model_description, param, defaultParam = None, datesim = None):
+        DataTable.__init__(self, model_description, datesim = datesim)
         self._primitives = set()
         self._param = param
         self._default_param = defaultParam
         self._inputs = None
         self.index = None
+        self._gather_cache = {}
+        self._gather_keys = {}
+        self._calculated = set()
+        self._enabled_cols = set()
+        self.profiler = None
+        if CONF.get('simulation', 'profile'):
+            self.profiler = Profiler()
         self.reset()
         self.build()
 
@@ -329,6 +703,8 @@ class SystemSf(DataTable):
                 if col._start > self.datesim: col.set_disabled()
             if col._end:
                 if col._end < self.datesim: col.set_disabled()
+            if col._enabled:
+                self._enabled_cols.add(col.name)
 
             for input_varname in col.inputs:
                 if input_varname in self.description.col_names:
@@ -350,57 +726,263 @@ class SystemSf(DataTable):
         self.index = inputs.index
         self._nrows = inputs._nrows
 
-        # initialize the pandas DataFrame to store data
-        dct = {}
-        for col in self.description.columns.itervalues():
-            dflt = col._default
-            dtyp = col._dtype
-            dct[col.name] = np.ones(self._nrows, dtyp)*dflt
-        
-        self.table = DataFrame(dct)
-        
+        # the columns are allocated when they are calculated (see DataTable._get_column)
+        self._columns = {}
 
-    def calculate(self, varname = None):
+    def get_plan(self, varnames = None):
         '''
-        Solver: finds dependencies and calculate accordingly all needed variables 
+        Returns the list of the enabled columns needed to compute varnames, sorted 
+        in topological order (parents before children).
+            - if varnames is None, the plan covers every column of the model
+            - columns already calculated are not walked through again
+            - disabled columns and their exclusive ancestors are left out
+        The columns calculated and enabled are read from self._calculated and 
+        self._enabled_cols rather than from the flags of the columns, which are 
+        shared by every system of the model.
         '''
-        if varname is None:
-            # TODO:
-            for col in self.description.columns.itervalues():
-                self.calculate(col.name)
-            return "Will calculate all"
-
-        col = self.description.get_col(varname)
+        if varnames is None:
+            targets = sorted(self.description.columns.itervalues(), key = lambda col: col._order)
+        else:
+            targets = [self.description.get_col(varname) for varname in varnames]
+        
+        plan = []
+        visited = set()
+        for target in targets:
+            if target in visited:
+                continue
+            # iterative depth first search, a column is appended once all its parents are
+            stack = [(target, None)]
+            path = set()
+            while stack:
+                col, parents = stack.pop()
+                if parents is None:
+                    if col in visited:
+                        continue
+                    if col.name in self._calculated or col.name not in self._enabled_cols:
+                        visited.add(col)
+                        continue
+                    if col in path:
+                        raise Exception('Circular reference detected: %s depends on itself' % col.name)
+                    path.add(col)
+                    parents = iter(sorted(col._parents, key = lambda x: x._order))
+                for parent in parents:
+                    if parent not in visited:
+                        if parent in path:
+                            raise Exception('Circular reference detected: %s -> %s' % (col.name, parent.name))
+                        stack.append((col, parents))
+                        stack.append((parent, None))
+                        break
+                else:
+                    path.discard(col)
+                    visited.add(col)
+                    plan.append(col)
+        return plan
 
+    def calculate(self, varnames = None, free_intermediates = False):
+        '''
+        Solver: finds dependencies and calculate accordingly all needed variables
+        varnames can be a variable name, a list of variable names or None to calculate
+        every variable of the model
+        If free_intermediates is True, the columns needed to calculate varnames but 
+        not in varnames are freed as soon as their last child in the plan is 
+        calculated: they will be calculated again if they are needed later.
+        '''
         if not self._primitives <= self._inputs.col_names:
             raise Exception('%s are not set, use set_inputs before calling calculate. Primitives needed: %s, Inputs: %s' % (self._primitives - self._inputs.col_names, self._primitives, self._inputs.col_names))
 
-        if col._isCalculated:
-            return
-        
-        if not col._enabled:
-            return
+        if isinstance(varnames, basestring):
+            varnames = [varnames]
+
+        plan = self.get_plan(varnames)
+        # number of children still to calculate of each intermediate column
+        pending = {}
+        if free_intermediates and varnames is not None:
+            planned = set(plan)
+            targets = set(varnames)
+            for col in plan:
+                for parent in col._parents:
+                    if parent in planned and parent.name not in targets:
+                        pending[parent] = pending.get(parent, 0) + 1
+
+        try:
+            for col in plan:
+                self._calculate_col(col)
+                for parent in col._parents:
+                    if parent in pending:
+                        pending[parent] -= 1
+                        if pending[parent] == 0:
+                            self._free(parent)
+        finally:
+            self.clear_gather_cache()
+
+    def _free(self, col):
+        '''
+        Drops the values of col, which is no longer calculated
+        '''
+        self._columns.pop(col.name, None)
+        for key in self._gather_keys.pop(col.name, ()):
+            del self._gather_cache[key]
+        col._isCalculated = False
+        self._calculated.discard(col.name)
 
-        idx = self.index[col._unit]
+    def get_descendants(self, input_varnames):
+        '''
+        Returns the names of the columns depending, directly or through their 
+        parents, on the inputs input_varnames
+        '''
+        input_varnames = set(input_varnames) & self._primitives
+        stack = [col for col in self.description.columns.itervalues() if col.inputs & input_varnames]
+        descendants = set()
+        while stack:
+            col = stack.pop()
+            if col.name not in descendants:
+                descendants.add(col.name)
+                stack.extend(col._children)
+        return descendants
+
+    def reuse(self, baseline, varnames = None):
+        '''
+        Takes from baseline, a SystemSf already calculated on the same individuals, 
+        the columns needed by varnames that do not read any parameter or input 
+        differing between the two systems and whose parents are unchanged. The arrays 
+        are shared and the columns marked as calculated, so that calculate only 
+        evaluates the columns affected by the changes. Returns the affected columns.
+        The shared arrays are made read-only in both systems: set_value copies 
+        them before writing, so that neither system changes the other.
+        '''
+        if baseline._inputs is self._inputs:
+            stale = set()
+        else:
+            changed_inputs = self._inputs.get_changed_columns(baseline._inputs)
+            if changed_inputs is None or baseline.datesim != self.datesim:
+                raise Exception('baseline must be calculated on the same individuals at the same date')
+            stale = self.get_descendants(changed_inputs)
+        params = {'_P': (baseline._param, self._param),
+                  '_defaultP': (baseline._default_param, self._default_param)}
+        changed = dict((argname, _prefixes(diff_params(*trees))) for argname, trees in params.iteritems())
+        needs = {'_P': '_needParam', '_defaultP': '_needDefaultParam'}
+
+        affected = set()
+        for col in self.get_plan(varnames):
+            name = col.name
+            if name not in baseline._calculated or name in stale:
+                affected.add(name)
+                continue
+            for argname in ('_P', '_defaultP'):
+                if getattr(col, needs[argname]):
+                    paths, tests = col.get_param_reads(argname)
+                    if (_reads(paths, changed[argname]) or 
+                        (_reads([test[0] for test in tests], changed[argname]) and 
+                         _tests_differ(tests, *params[argname]))):
+                        break
+            else:
+                argname = None
+            if argname is not None:
+                affected.add(name)
+                continue
+            for parent in col._parents:
+                if (parent.name in affected or 
+                    (parent.name in self._enabled_cols) != (parent.name in baseline._enabled_cols)):
+                    affected.add(name)
+                    break
+            else:
+                var = baseline._columns[name]
+                var.flags.writeable = False
+                self._columns[name] = var
+                col._isCalculated = True
+                self._calculated.add(name)
+        return affected
+
+    def clear_gather_cache(self):
+        ''' drops the unit level inputs gathered during the current run '''
+        self._gather_cache = {}
+        self._gather_keys = {}
+
+    def _gather(self, table, varname, unit, opt = None):
+        '''
+        Returns table.get_value(varname, self.index[unit], opt), gathering it only 
+        once per run. The cached arrays are read-only since they are shared by every 
+        formula that needs them.
+        '''
+        if opt is None:
+            key = (varname, unit, None)
+        elif isinstance(opt, Aggregate):
+            key = (varname, unit, opt.key)
+        else:
+            key = (varname, unit, tuple(opt))
+
+        if key in self._gather_cache:
+            value = self._gather_cache[key]
+        else:
+            if isinstance(opt, Aggregate):
+                value = table.aggregate(varname, unit, opt.how, opt.roles)
+            else:
+                value = table.get_value(varname, self.index[unit], opt)
+            if not isinstance(value, dict):
+                value.flags.writeable = False
+            else:
+                for val in value.itervalues():
+                    val.flags.writeable = False
+            if self.profiler is not None:
+                if isinstance(value, dict):
+                    self.profiler.allocated += sum(val.nbytes for val in value.itervalues())
+                else:
+                    self.profiler.allocated += value.nbytes
+            self._gather_cache[key] = value
+            self._gather_keys.setdefault(varname, set()).add(key)
+
+        if isinstance(value, dict):
+            return dict(value)
+        return value
+
+    def _ensure_calculated(self, varname):
+        '''
+        Calculates varname if it is enabled but not calculated, ie never calculated 
+        or freed by calculate(varnames, free_intermediates = True). The disabled 
+        columns keep their default value.
+        '''
+        if varname not in self._calculated and varname in self._enabled_cols:
+            self.calculate([varname])
+
+    def get_value(self, varname, index = None, opt = None, sum_ = False, copy = False):
+        ''' same as DataTable.get_value, varname being calculated first if needed '''
+        self._ensure_calculated(varname)
+        return DataTable.get_value(self, varname, index, opt, sum_, copy)
+
+    def aggregate(self, varname, unit, how = 'sum', roles = None):
+        ''' same as DataTable.aggregate, varname being calculated first if needed '''
+        self._ensure_calculated(varname)
+        return DataTable.aggregate(self, varname, unit, how, roles)
+
+    def set_value(self, varname, value, index, opt = None):
+        DataTable.set_value(self, varname, value, index, opt)
+        # invalidate the gathered values of varname
+        for key in self._gather_keys.pop(varname, ()):
+            del self._gather_cache[key]
+
+    def _calculate_col(self, col):
+        '''
+        Evaluates the formula of col, all its parents must have been calculated
+        '''
+        varname = col.name
+        unit = col._unit
+        idx = self.index[unit]
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+            allocated = profiler.allocated
 
         required = set(col.inputs)
         funcArgs = {}
         for var in required:
             if var in self._inputs.col_names:
-                if var in col._option: 
-                    funcArgs[var] = self._inputs.get_value(var, idx, col._option[var])
-                else:
-                    funcArgs[var] = self._inputs.get_value(var, idx)
+                funcArgs[var] = self._gather(self._inputs, var, unit, col._option.get(var))
         
         for var in col._parents:
             parentname = var.name
             if parentname in funcArgs:
-                raise Exception('%s provided twice: %s was found in primitives and in parents' %  (varname, varname))
-            self.calculate(parentname)
-            if parentname in col._option: 
-                funcArgs[parentname] = self.get_value(parentname, idx, col._option[parentname])
-            else:
-                funcArgs[parentname] = self.get_value(parentname, idx)
+                raise Exception('%s provided twice: %s was found in primitives and in parents' %  (varname, parentname))
+            funcArgs[parentname] = self._gather(self, parentname, unit, col._option.get(parentname))
         
         if col._needParam:
             funcArgs['_P'] = self._param
@@ -412,6 +994,18 @@ class SystemSf(DataTable):
         
         provided = set(funcArgs.keys())        
         if provided != required:
-            raise Exception('%s missing: %s needs %s but only %s were provided' % (str(list(required - provided)), self._name, str(list(required)), str(list(provided))))
-        self.set_value(varname, col._func(**funcArgs), idx)
-        col._isCalculated = True
\ No newline at end of file
+            raise Exception('%s missing: %s needs %s but only %s were provided' % (str(list(required - provided)), varname, str(list(required)), str(list(provided))))
+        if varname in self._columns and not self._columns[varname].flags.writeable:
+            # a column shared with another system is allocated again rather than copied
+            del self._columns[varname]
+        if profiler is None:
+            self.set_value(varname, col._func(**funcArgs), idx)
+        else:
+            gathered = profiler.clock()
+            value = col._func(**funcArgs)
+            computed = profiler.clock()
+            self.set_value(varname, value, idx)
+            profiler.add(col, gathered - start, computed - gathered, profiler.clock() - computed, 
+                         profiler.allocated - allocated + np.asarray(value).nbytes)
+        col._isCalculated = True
+        self._calculated.add(varname)
@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from __future__ import division
+import mmap
+import os
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from core.datatable import SystemSf
+
+# a shard holds at least this number of individuals
+MIN_SHARD_ROWS = 5000
+
+# state shared with the worker processes, inherited when they are forked
+_shared = {}
+
+def shard_rows(table, nshards):
+    '''
+    Splits the rows of table into at most nshards arrays of rows in their original 
+    order. Ménages are never split, and neither are the foyers and familles, 
+    ménages sharing a foyer or a famille going to the same shard.
+    '''
+    index = table.index
+    label = index['men']['unitPos']
+    while True:
+        new = label
+        for unit in ('foy', 'fam', 'men'):
+            lowest = np.empty(index[unit]['nb'], dtype = new.dtype)
+            lowest.fill(table._nrows)
+            np.minimum.at(lowest, index[unit]['unitPos'], new)
+            new = lowest[index[unit]['unitPos']]
+        if (new == label).all():
+            break
+        label = new
+
+    # shards of about the same number of rows made of whole groups
+    groups, groupPos = np.unique(label, return_inverse = True)
+    sizes = np.bincount(groupPos)
+    start = np.cumsum(sizes) - sizes
+    shard = (start*nshards // table._nrows)[groupPos]
+    order = np.argsort(shard, kind = 'mergesort')
+    offsets = np.cumsum(np.bincount(shard))
+    return [rows for rows in np.split(order, offsets[:-1]) if len(rows)]
+
+def _shared_column(system, varname):
+    '''
+    Returns a column of system allocated in anonymous shared memory, that
+    forked worker processes can fill
+    '''
+    col = system.description.get_col(varname)
+    dtype = np.dtype(col._dtype)
+    buf = mmap.mmap(-1, max(system._nrows*dtype.itemsize, 1))
+    var = np.frombuffer(buf, dtype = dtype, count = system._nrows)
+    var.fill(col._default)
+    return var
+
+def _calculate_shard(k):
+    '''
+    Calculates the k-th shard and writes its values to the shared columns. The 
+    columns already calculated in system, ie taken from a baseline by reuse, 
+    are copied to the shard and not calculated again.
+    '''
+    system = _shared['system']
+    rows = _shared['rows'][k]
+    inputs = system._inputs.take(rows)
+    shard = SystemSf(system._model_description, system._param, system._default_param, datesim = system.datesim)
+    shard.set_inputs(inputs)
+    for varname in system._calculated:
+        shard._columns[varname] = system._columns[varname][rows]
+        shard._calculated.add(varname)
+    shard.calculate(_shared['varnames'], _shared['free_intermediates'])
+    for varname, var in _shared['columns'].iteritems():
+        var[rows] = shard._columns[varname]
+
+def calculate_in_shards(system, varnames = None, processes = None, free_intermediates = False):
+    '''
+    Same as system.calculate(varnames, free_intermediates), the individuals being split into shards 
+    of whole ménages calculated in a pool of processes (cpu_count() if processes is 
+    None). The workers are forked: they read the inputs of system without copying 
+    them and write their results in shared memory. Where processes cannot be 
+    forked, if the table is too small or if system is profiled, the calculation 
+    is not split.
+    '''
+    if isinstance(varnames, basestring):
+        varnames = [varnames]
+    if processes is None:
+        processes = cpu_count()
+    nshards = min(processes, system._nrows // MIN_SHARD_ROWS)
+    if nshards < 2 or not hasattr(os, 'fork') or system.profiler is not None:
+        system.calculate(varnames, free_intermediates)
+        return
+
+    names = [col.name for col in system.get_plan(varnames)]
+    if free_intermediates and varnames is not None:
+        names = [varname for varname in names if varname in varnames]
+    columns = dict((varname, _shared_column(system, varname)) for varname in names)
+    _shared.update(system = system, varnames = varnames, columns = columns, 
+                   free_intermediates = free_intermediates,
+                   rows = shard_rows(system._inputs, nshards))
+    try:
+        pool = Pool(len(_shared['rows']))
+        try:
+            pool.map(_calculate_shard, range(len(_shared['rows'])))
+        finally:
+            pool.terminate()
+    finally:
+        _shared.clear()
+
+    # the shard systems of the workers do not affect the columns of system
+    for varname, var in columns.iteritems():
+        system._columns[varname] = var
+        system.description.get_col(varname)._isCalculated = True
+        system._calculated.add(varname)
+
+def _solve_margins(k):
+    '''
+    Calibrates on the k-th margins and writes the weights to the k-th shared column
+    '''
+    calmar = _shared['calmar']
+    margins, totalpop = _shared['margins'][k]
+    _shared['weights'][:, k] = calmar.solve(margins, totalpop)
+    return calmar.converged, calmar.iterations
+
+def solve_margins_in_parallel(calmar, margins, processes = None):
+    '''
+    Returns the array of the weights calibrated by calmar (a core.calmar.Calmar 
+    holding every margin variable) on each of the margins, a list of (margins, 
+    totalpop), one column per margins, and the list of the margins on which 
+    calmar converged (booleans). The margins are solved in a pool of forked 
+    processes sharing the design of calmar, or one after the other, each 
+    solution starting from the previous one, if processes is 1 or processes 
+    cannot be forked.
+    '''
+    if processes is None:
+        processes = cpu_count()
+    processes = min(processes, len(margins))
+    if processes < 2 or not hasattr(os, 'fork'):
+        weights = np.empty((calmar.nk, len(margins)))
+        converged = []
+        for k, (margin, totalpop) in enumerate(margins):
+            weights[:, k] = calmar.solve(margin, totalpop)
+            converged.append(calmar.converged)
+            if not calmar.converged:
+                print "calmar: stopped after ", calmar.iterations, "iterations on margins %d" % k
+        return weights, converged
+
+    buf = mmap.mmap(-1, max(calmar.nk*len(margins)*8, 1))
+    weights = np.frombuffer(buf, dtype = float, count = calmar.nk*len(margins)).reshape(calmar.nk, len(margins))
+    _shared.update(calmar = calmar, margins = margins, weights = weights)
+    try:
+        pool = Pool(processes)
+        try:
+            status = pool.map(_solve_margins, range(len(margins)))
+        finally:
+            pool.terminate()
+    finally:
+        _shared.clear()
+    for k, (converged, iterations) in enumerate(status):
+        if not converged:
+            print "calmar: stopped after ", iterations, "iterations on margins %d" % k
+    return np.array(weights), [converged for converged, iterations in status]
@@ -0,0 +1,78 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import division
+import numpy as np
+from core.datatable import SystemSf
+from parametres.paramData import XmlReader
+
+class MultiPeriodSystem(object):
+    '''
+    Evaluates a model on the same inputs for several legislation dates.
+    The inputs and their index are shared by every date and the parameters of 
+    each date are read from the compiled parameter file. From one date to the 
+    next, a column is evaluated again only if it reads parameters that changed, 
+    if it is enabled at one date and not at the other, or if one of its parents 
+    changed; the others are taken from the previous date (see SystemSf.reuse).
+    '''
+    def __init__(self, model_description, inputs, param_file):
+        super(MultiPeriodSystem, self).__init__()
+        self.model_description = model_description
+        self.inputs = inputs
+        self.param_file = param_file
+
+    def get_param(self, datesim):
+        '''
+        Returns the parameters at datesim
+        '''
+        param = XmlReader(self.param_file, datesim).param
+        param.datesim = datesim
+        return param
+
+    def calculate(self, dates, varnames = None):
+        '''
+        Calculates varnames (every column of the model if None) for each date of 
+        dates and returns a dict {varname: array of shape (len(dates), nrows)} 
+        whose rows follow the order of dates
+        '''
+        results = {}
+        previous = None
+        for datesim in dates:
+            param = self.get_param(datesim)
+            system = SystemSf(self.model_description, param, param, datesim = datesim)
+            system.set_inputs(self.inputs)
+            if previous is not None:
+                system.reuse(previous, varnames)
+            system.calculate(varnames)
+
+            if varnames is None:
+                names = system.col_names
+            else:
+                names = varnames
+            for varname in names:
+                results.setdefault(varname, []).append(system.get_value(varname))
+            previous = system
+
+        for varname, values in results.iteritems():
+            results[varname] = np.vstack(values)
+        return results
@@ -0,0 +1,83 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from __future__ import division
+from timeit import default_timer
+from pandas import DataFrame
+
+class Profiler(object):
+    '''
+    Collects, for each prestation calculated by a SystemSf, the time spent gathering 
+    its inputs, in its formula and in set_value, and the bytes it allocated (gathered 
+    inputs and result). A SystemSf is profiled when its profiler attribute is set.
+    '''
+    def __init__(self):
+        super(Profiler, self).__init__()
+        self.clock = default_timer
+        # bytes allocated by the gathering of inputs, updated by SystemSf._gather
+        self.allocated = 0
+        # name -> [unit, calls, gather, formula, set_value, bytes]
+        self.stats = {}
+
+    def add(self, col, gather, formula, set_value, nbytes):
+        if col.name in self.stats:
+            stat = self.stats[col.name]
+        else:
+            stat = self.stats[col.name] = [col._unit, 0, 0, 0, 0, 0]
+        stat[1] += 1
+        stat[2] += gather
+        stat[3] += formula
+        stat[4] += set_value
+        stat[5] += nbytes
+
+    def get_rows(self):
+        '''
+        Returns the list of (name, unit, calls, wall, gather, formula, set_value, bytes)
+        of each prestation, the most expensive first (times in seconds)
+        '''
+        rows = []
+        for name, (unit, calls, gather, formula, set_value, nbytes) in self.stats.iteritems():
+            rows.append((name, unit, calls, gather + formula + set_value, gather, formula, set_value, nbytes))
+        return sorted(rows, key = lambda row: row[3], reverse = True)
+
+    def get_report(self):
+        '''
+        Returns the statistics of each prestation as a DataFrame, the most expensive first
+        '''
+        rows = self.get_rows()
+        return DataFrame([row[1:] for row in rows], index = [row[0] for row in rows],
+                         columns = ['unit', 'calls', 'wall', 'gather', 'formula', 'set_value', 'bytes'])
+
+    def save(self, prefix):
+        '''
+        Writes the report to prefix + '.txt' and a trace in the folded stacks 
+        format of flame graphs (times in microseconds) to prefix + '.folded'
+        '''
+        with open(prefix + '.txt', 'w') as f:
+            f.write(self.get_report().to_string())
+            f.write('\n')
+        with open(prefix + '.folded', 'w') as f:
+            for name, unit, calls, wall, gather, formula, set_value, nbytes in self.get_rows():
+                for step, duration in (('gather', gather), ('formula', formula), ('set_value', set_value)):
+                    f.write('calculate;%s;%s %d\n' % (name, step, round(duration*1e6)))
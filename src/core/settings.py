@@ -0,0 +1,151 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Qt free part of the configuration, the configuration dialogs are in Config
+
+import os
+from ConfigParser import RawConfigParser
+from datetime import datetime
+
+VERSION = "0.1.3"
+
+class NoDefault:
+    pass
+
+
+DEFAULTS = [
+            ('simulation', 
+             {
+              'datesim': '2010-01-01',
+              'nmen': 101,
+              'xaxis':  'sal',
+              'maxrev': 50000,
+              'profile': False,
+              'processes': 1,
+              }),
+            ('paths',
+             {'data_dir': 'data',
+              'cas_type_dir': 'castypes',
+              'reformes_dir': 'reformes',
+              'calib_dir'   :  'calibrations',
+              'survey_data/file':'data/final.csv',
+              'survey_data/bareme_only': False,
+              'survey_data/survey_enabled': True,
+              'output_dir' : os.path.expanduser('~'),
+
+              }),
+            ('calibration', 
+             {'inputs_filename': 'calage_men.csv',
+              'pfam_filename': 'calage_pfam.csv',
+              'method': 'logit',
+              'up': 3.0,
+              'invlo': 3.0,
+              })
+            
+            ]
+
+class UserConfigParser(RawConfigParser):
+    def __init__(self, defaults, filename):
+        RawConfigParser.__init__(self)
+        self.defaults = defaults
+
+        try:
+            open(filename)
+            self.read(filename)
+        except:
+            for section in DEFAULTS:
+                self.add_section(section[0])
+                for key, val in section[1].iteritems():
+                    self.set(section[0], key, val)
+
+    def get(self, section, option):
+#    def get(self, section, option, default=NoDefault):
+        """
+        Get an option
+        section=None: attribute a default section name
+        default: default value (if not specified, an exception
+        will be raised if option doesn't exist)
+        """
+#        section = self.__check_section_option(section, option)
+#
+#        if not self.has_section(section):
+#            if default is NoDefault:
+#                raise NoSectionError(section)
+#            else:
+#                self.add_section(section)
+#        
+#        if not self.has_option(section, option):
+#            if default is NoDefault:
+#                raise NoOptionError(option, section)
+#            else:
+#                self.set(section, option, default)
+#                return default
+            
+#        value = ConfigParser.get(self, section, option, self.raw)
+        default_value = self.get_default(section, option)
+        if self.has_option(section, option):
+            value = RawConfigParser.get(self, section, option)
+        else:
+            # option added after the configuration file was written
+            value = default_value
+        if isinstance(default_value, bool):
+            if not isinstance(value, bool):
+                value = eval(value)
+        elif isinstance(default_value, float):
+            value = float(value)
+        elif isinstance(default_value, int):
+            value = int(value)
+        else:
+            try:
+                value = datetime.strptime(value ,"%Y-%m-%d").date()
+            except:
+                pass
+                
+#        else:
+#            if isinstance(default_value, basestring):
+#                try:
+#                    value = value.decode('utf-8')
+#                except (UnicodeEncodeError, UnicodeDecodeError):
+#                    pass
+#            try:
+#                # lists, tuples, ...
+#                value = eval(value)
+#                print value
+#            except:
+#                pass
+        return value
+
+    def get_default(self, section, option):
+        """
+        Get Default value for a given (section, option)
+        -> useful for type checking in 'get' method
+        """
+#        section = self.__check_section_option(section, option)
+        for sec, options in self.defaults:
+            if sec == section:
+                if option in options:
+                    return options[ option ]
+#        else:
+#            return NoDefault
+
+CONF = UserConfigParser(DEFAULTS, 'main.cfg')
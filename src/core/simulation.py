@@ -0,0 +1,435 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Simulations without any graphical interface: nothing imported here depends on Qt
+
+from __future__ import division
+import os
+from datetime import datetime
+import numpy as np
+from pandas import DataFrame, read_csv, concat
+from core.settings import CONF
+from core.datatable import DataTable, SystemSf
+from core.columns import EnumCol, BoolCol, AgesCol, DateCol
+from core.calmar import Calmar, check_margins
+from core.parallel import calculate_in_shards, solve_margins_in_parallel
+from core.utils import Scenario
+from parametres.paramData import XmlReader, Tree2Object
+
+# number of rows read at once by the streaming mode
+CHUNKSIZE = 50000
+
+# calibrated weights are saved next to the survey file in survey file + WEIGHTS_EXT
+WEIGHTS_EXT = '.weights.npz'
+
+def survey_chunks(fname, chunksize = CHUNKSIZE):
+    '''
+    Reads the survey file fname by chunks of about chunksize rows and yields 
+    DataFrames of whole ménages. The rows of a ménage must be contiguous in the 
+    file, and so must be its foyers and familles.
+    '''
+    rest = None
+    for frame in read_csv(fname, chunksize = chunksize):
+        if rest is not None:
+            frame = concat([rest, frame], ignore_index = True)
+        # the last ménage of the chunk may go on in the next one
+        idmen = frame['idmen'].values
+        others = np.flatnonzero(idmen != idmen[-1])
+        cut = others[-1] + 1 if len(others) else 0
+        if cut:
+            yield frame[:cut]
+        rest = frame[cut:]
+    if rest is not None and len(rest):
+        yield rest
+
+def read_margins(fname, years, categorical = ()):
+    '''
+    Reads the margins file fname (columns var, mod and one column per year) and 
+    returns for each of years the margins as expected by calmar: a dict of 
+    categories for the variables in categorical, the total over the modalities 
+    otherwise, and the population totalpop
+    '''
+    totals = read_csv(fname, index_col = (0,1))
+    margins = {}
+    for year in years:
+        year = str(year)
+        if year not in totals:
+            raise Exception('no margins for %s in %s' % (year, fname))
+        margins[year] = {}
+        for (var, mod), value in totals[year].iteritems():
+            if var == 'totalpop':
+                margins[year][var] = value
+            elif var in categorical:
+                margins[year].setdefault(var, {})[mod] = value
+            else:
+                margins[year][var] = margins[year].get(var, 0) + value
+    return margins
+
+def save_weights(fname, weights):
+    '''
+    Saves the DataFrame weights (one column per year, indexed by idmen) next to 
+    the survey file fname
+    '''
+    np.savez(fname + WEIGHTS_EXT, years = np.array([str(year) for year in weights.columns]), 
+             weights = weights.values, idmen = np.asarray(weights.index))
+
+def load_weights(fname):
+    '''
+    Returns the weights saved by save_weights next to the survey file fname, a 
+    DataFrame indexed by idmen with one column per year
+    '''
+    saved = np.load(fname + WEIGHTS_EXT)
+    return DataFrame(saved['weights'], index = saved['idmen'], columns = list(saved['years']))
+
+class RunningAggregates(object):
+    '''
+    Weighted aggregates of ménage level values accumulated chunk after chunk: 
+    for each variable, the sum and the number of ménages with a non zero value, 
+    in total and by value of each groupby variable
+    '''
+    def __init__(self, varnames, groupby = ()):
+        super(RunningAggregates, self).__init__()
+        self.varnames = list(varnames)
+        self.groupby = list(groupby)
+        self.weight = 0
+        self.sums = dict.fromkeys(self.varnames, 0)
+        self.counts = dict.fromkeys(self.varnames, 0)
+        # groupby variable -> group -> weight and sums of the variables
+        self.groups = dict((by, {}) for by in self.groupby)
+
+    def update(self, values, weight, groups = None):
+        '''
+        Adds the ménages of a chunk, values and groups being dicts of arrays of 
+        ménage level values and weight the array of their weights
+        '''
+        self.weight += weight.sum()
+        for varname in self.varnames:
+            self.sums[varname] += np.dot(weight, values[varname])
+            self.counts[varname] += weight[values[varname] != 0].sum()
+
+        for by in self.groupby:
+            keys, pos = np.unique(groups[by], return_inverse = True)
+            nb = len(keys)
+            sums = [np.bincount(pos, weights = weight, minlength = nb)]
+            for varname in self.varnames:
+                sums.append(np.bincount(pos, weights = weight*values[varname], minlength = nb))
+            sums = np.array(sums).T
+            dct = self.groups[by]
+            for key, val in zip(keys, sums):
+                if key in dct:
+                    dct[key] += val
+                else:
+                    dct[key] = val
+
+    def get_totals(self):
+        ''' Returns a DataFrame of the sum and weighted count of each variable '''
+        return DataFrame({'sum': [self.sums[varname] for varname in self.varnames],
+                          'count': [self.counts[varname] for varname in self.varnames]},
+                         index = self.varnames, columns = ['sum', 'count'])
+
+    def get_groups(self, by):
+        ''' Returns a DataFrame of the weight and the sums of the variables by group of by '''
+        keys = sorted(self.groups[by])
+        return DataFrame([self.groups[by][key] for key in keys], index = keys,
+                         columns = ['wprm'] + self.varnames)
+
+class Simulation(object):
+    '''
+    Runs a model on a survey or on a scenario (.ofct) with a parameter file, 
+    possibly modified by a reform (.ofp). The reform values replace the values 
+    of the parameter file, whose original values are the default parameters.
+    '''
+    def __init__(self, model_description, input_description, param_file, datesim = None, reform_file = None):
+        super(Simulation, self).__init__()
+        self.model_description = model_description
+        self.input_description = input_description
+        self.param_file = param_file
+        self.reform_file = reform_file
+
+        if reform_file is not None:
+            reform = XmlReader(reform_file)
+            if datesim is None: datesim = reform._date
+        else:
+            reform = None
+        if datesim is None:
+            datesim = CONF.get('simulation', 'datesim')
+        if isinstance(datesim, basestring):
+            datesim = datetime.strptime(datesim, "%Y-%m-%d").date()
+        self.datesim = datesim
+
+        reader = XmlReader(param_file, datesim)
+        if reform is not None:
+            reader.tree.load(reform.tree)
+        self.P = Tree2Object(reader.tree)
+        self.P.datesim = datesim
+        self.P_default = Tree2Object(reader.tree, defaut = True)
+        self.P_default.datesim = datesim
+
+        self.inputs = None
+        self.survey_file = None
+        self.outputs = None
+        self.outputs_default = None
+        self.aggregates_default = None
+
+    def load_survey(self, fname):
+        ''' reads the inputs from a survey file '''
+        self.inputs = DataTable(self.input_description, survey_data = fname, datesim = self.datesim)
+        self.survey_file = fname
+
+    def load_scenario(self, fname):
+        ''' reads the inputs from a scenario file (.ofct) '''
+        scenario = Scenario()
+        scenario.openFile(fname)
+        scenario.year = self.datesim.year
+        self.inputs = DataTable(self.input_description, scenario = scenario, datesim = self.datesim)
+
+    def compute(self, varnames = None, processes = 1):
+        '''
+        Calculates varnames (every column of the model if None) and returns the 
+        output SystemSf. With a reform, the model is first calculated with the 
+        default parameters (outputs_default) and only the columns affected by the 
+        reform are calculated again. With processes > 1, the survey is split into
+        shards of ménages calculated in parallel (see calculate_in_shards).
+        Without reform, the intermediate columns needed by varnames are freed once
+        used: only varnames are available afterwards.
+        '''
+        if self.inputs is None:
+            raise Exception('inputs are not loaded, use load_survey or load_scenario first')
+
+        if self.reform_file is not None:
+            self.outputs_default = SystemSf(self.model_description, self.P_default, self.P_default, datesim = self.datesim)
+            self.outputs_default.set_inputs(self.inputs)
+            calculate_in_shards(self.outputs_default, varnames, processes)
+
+        self.outputs = SystemSf(self.model_description, self.P, self.P_default, datesim = self.datesim)
+        self.outputs.set_inputs(self.inputs)
+        if self.outputs_default is not None:
+            self.outputs.reuse(self.outputs_default, varnames)
+            calculate_in_shards(self.outputs, varnames, processes)
+        else:
+            calculate_in_shards(self.outputs, varnames, processes, free_intermediates = True)
+        return self.outputs
+
+    def calibrate(self, margins_file, years, param = None, processes = None):
+        '''
+        Calibrates the weights of the ménages on the margins of each of years found in 
+        margins_file (see read_margins) and returns a DataFrame of the weights indexed
+        by idmen with one column per year. The margin variables are read once, from the inputs 
+        or from the outputs (use compute first, the output margin variables are 
+        calculated again if they were freed), and the years are solved in 
+        parallel (see solve_margins_in_parallel). param defaults to the 
+        calibration configuration. The weights of a survey are also saved next 
+        to the survey file (see save_weights), unless calmar did not converge 
+        on every year.
+        '''
+        if self.inputs is None:
+            raise Exception('inputs are not loaded, use load_survey or load_scenario first')
+        if param is None:
+            param = {'method': CONF.get('calibration', 'method'),
+                     'lo': 1/CONF.get('calibration', 'invlo'),
+                     'up': CONF.get('calibration', 'up'),
+                     'use_proportions': True}
+        idx = self.inputs.index['men']
+        weights_init = self.inputs.get_value('wprm_init', idx)
+
+        tables = [self.inputs] + [table for table in (self.outputs,) if table is not None]
+        totals = read_csv(margins_file, index_col = (0,1))
+        variables = {}
+        for var in set(var for var, mod in totals.index) - set(['totalpop']):
+            for table in tables:
+                if table.description.has_col(var):
+                    variables[var] = table
+                    break
+            else:
+                raise Exception('%s was not find in inputs nor in outputs' % var)
+        categorical = [var for var, table in variables.iteritems() 
+                       if isinstance(table.description.get_col(var), (EnumCol, BoolCol, AgesCol, DateCol))]
+        margins = read_margins(margins_file, years, categorical)
+        outvars = [var for var, table in variables.iteritems() if table is not self.inputs]
+        if outvars:
+            self.outputs.calculate(outvars)
+
+        calmar = Calmar(weights_init, param)
+        for var, table in variables.iteritems():
+            if table is self.inputs:
+                value = table.get_value(var, idx)
+            else:
+                value = table.aggregate(var, 'men')
+            calmar.add_variable(var, value, var in categorical)
+
+        batch = []
+        for year in years:
+            totalpop = margins[str(year)].get('totalpop', weights_init.sum())
+            batch.append((check_margins(margins[str(year)], totalpop, param.get('use_proportions', False)), totalpop))
+        weights, converged = solve_margins_in_parallel(calmar, batch, processes)
+        weights = DataFrame(weights, index = self.inputs.get_value('idmen', idx), 
+                            columns = [str(year) for year in years])
+        if not all(converged):
+            print "calibrate: the weights are not saved, calmar did not converge on", \
+                [year for year, ok in zip(years, converged) if not ok]
+        elif self.survey_file is not None:
+            save_weights(self.survey_file, weights)
+        return weights
+
+    def stream_survey(self, fname, varnames, output = None, groupby = (), chunksize = CHUNKSIZE, output_default = None):
+        '''
+        Calculates varnames on the survey fname chunk after chunk (see survey_chunks)
+        so that memory use is bounded by the chunk size, and returns their 
+        RunningAggregates by ménage, grouped by the ménage level variables groupby.
+        varnames and groupby may hold input variables, which are read from the chunk.
+        With a reform, each chunk is first calculated with the default parameters, 
+        as by compute, and the RunningAggregates of the default values are kept 
+        in aggregates_default.
+        If output (output_default) is given, the values of varnames (with the 
+        default parameters) are appended to this csv file.
+        '''
+        varnames = list(varnames)
+        aggregates = RunningAggregates(varnames, groupby)
+        if self.reform_file is not None:
+            self.aggregates_default = RunningAggregates(varnames, groupby)
+        else:
+            self.aggregates_default = None
+        header = True
+        for frame in survey_chunks(fname, chunksize):
+            self.inputs = DataTable(self.input_description, datesim = self.datesim)
+            self.inputs.populate_from_frame(frame)
+            del frame
+            if self.reform_file is not None:
+                self.outputs_default = SystemSf(self.model_description, self.P_default, self.P_default, datesim = self.datesim)
+                self.outputs_default.set_inputs(self.inputs)
+            self.outputs = SystemSf(self.model_description, self.P, self.P_default, datesim = self.datesim)
+            self.outputs.set_inputs(self.inputs)
+
+            # the variables of the model are calculated, the others read from the inputs
+            calculated = []
+            for varname in varnames + list(groupby):
+                if self.outputs.description.has_col(varname):
+                    calculated.append(varname)
+                elif not self.inputs.description.has_col(varname):
+                    raise Exception('%s was not find in inputs nor in outputs' % varname)
+            if self.outputs_default is not None:
+                self.outputs_default.calculate(calculated)
+                self.outputs.reuse(self.outputs_default, calculated)
+                self.outputs.calculate(calculated)
+            else:
+                self.outputs.calculate(calculated, free_intermediates = True)
+
+            idx = self.inputs.index['men']
+            weight = self.inputs.get_value('wprm', idx)
+            for default, running in ((False, aggregates), (True, self.aggregates_default)):
+                if running is None:
+                    continue
+                outputs = self.outputs_default if default else self.outputs
+                tables = dict((varname, outputs if varname in calculated else self.inputs) 
+                              for varname in varnames + list(groupby))
+                values = dict((varname, tables[varname].aggregate(varname, 'men')) for varname in varnames)
+                groups = dict((by, tables[by].get_value(by, idx)) for by in groupby)
+                running.update(values, weight, groups)
+
+            for default, fname_out in ((False, output), (True, output_default)):
+                if fname_out is None or (default and self.outputs_default is None):
+                    continue
+                with open(fname_out, 'w' if header else 'a') as f:
+                    self._get_frame(varnames, default).to_csv(f, index = False, header = header)
+            header = False
+        return aggregates
+
+    def _get_frame(self, varnames = None, default = False):
+        '''
+        Returns a DataFrame of varnames (every column of the model if None) 
+        preceded by the identifiers of the inputs
+        '''
+        outputs = self.outputs_default if default else self.outputs
+        if varnames is None:
+            varnames = outputs.col_names
+        data = {}
+        columns = []
+        for varname in ('idmen', 'noi'):
+            if varname in self.inputs.col_names:
+                data[varname] = self.inputs.get_value(varname)
+                columns.append(varname)
+        for varname in varnames:
+            if varname in outputs.col_names:
+                data[varname] = outputs.get_value(varname)
+            else:
+                data[varname] = self.inputs.get_value(varname)
+            columns.append(varname)
+        return DataFrame(data, columns = columns)
+
+    def save(self, fname, varnames = None, default = False):
+        '''
+        Writes varnames (every column of the model if None) to the csv file fname, 
+        preceded by the identifiers of the inputs. With default = True, the values 
+        calculated with the default parameters are written.
+        '''
+        outputs = self.outputs_default if default else self.outputs
+        if outputs is None:
+            raise Exception('nothing to save, use compute first')
+        self._get_frame(varnames, default).to_csv(fname, index = False)
+
+class ScenarioSession(object):
+    '''
+    Keeps the systems calculated on a scenario between two edits. A new system 
+    takes from the previous one the columns that depend neither on the inputs nor 
+    on the parameters changed since (see SystemSf.reuse): only their descendants
+    are calculated again.
+    '''
+    def __init__(self, model_description, input_description):
+        super(ScenarioSession, self).__init__()
+        self.model_description = model_description
+        self.input_description = input_description
+        self.inputs = None
+        self.systems = {}
+
+    def set_scenario(self, scenario):
+        '''
+        Builds the inputs of scenario and returns the input columns changed since 
+        the previous scenario, None if the individuals, their units or the 
+        simulation date changed, in which case no system can be reused
+        '''
+        inputs = DataTable(self.input_description, scenario = scenario)
+        changed = None
+        if self.inputs is not None and self.inputs.datesim == inputs.datesim:
+            changed = inputs.get_changed_columns(self.inputs)
+        if changed is None:
+            self.systems = {}
+        self.inputs = inputs
+        return changed
+
+    def get_system(self, name, param, default_param, baseline = None):
+        '''
+        Returns a new system named name on the current inputs, holding the columns 
+        of the previous system of this name, or of the system named baseline if 
+        there is none, that are not affected by the changes. The other columns 
+        are calculated by SystemSf.calculate.
+        '''
+        if self.inputs is None:
+            raise Exception('no scenario, use set_scenario first')
+        system = SystemSf(self.model_description, param, default_param)
+        system.set_inputs(self.inputs)
+        previous = self.systems.get(name, self.systems.get(baseline))
+        if previous is not None:
+            system.reuse(previous)
+        self.systems[name] = system
+        return system
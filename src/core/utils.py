@@ -25,7 +25,7 @@ from xml.dom import minidom
 from numpy import maximum as max_, minimum as min_
 import numpy as np
 from bisect import bisect_right
-from Config import CONF, VERSION
+from core.settings import CONF, VERSION
 import pickle
 from datetime import datetime
 from pandas import DataFrame
@@ -74,15 +74,12 @@ def handle_output_xml(doc, tree, model, unit = 'men'):
                 tree.addChild(child)
                 handle_output_xml(element, child, model)
     else:
-        idx = model.index[unit]
         inputs = model._inputs
-        enum = inputs.description.get_col('qui'+unit).enum
-        people = [x[1] for x in enum]
         if tree.code in model.col_names:
             model.calculate(tree.code)
-            val = model.get_value(tree.code, idx, opt = people, sum_ = True)
+            val = model.aggregate(tree.code, unit)
         elif tree.code in inputs.col_names:
-            val = inputs.get_value(tree.code, idx, opt = people, sum_ = True)
+            val = inputs.aggregate(tree.code, unit)
         else:
             raise Exception('%s was not find in model nor in inputs' % tree.code)
         tree.setVals(val)
@@ -93,27 +90,34 @@ def gen_output_data(model):
     _doc = minidom.parse('data/totaux.xml')
     tree = OutNode('root', 'root')
 
+    # calculate at once the subgraph needed by the output tree
+    codes = set(element.getAttribute('code') for element in _doc.getElementsByTagName('NODE'))
+    model.calculate(codes & model.col_names)
+
     handle_output_xml(_doc, tree, model)
     return tree
 
-def gen_aggregate_output(model):
+def gen_aggregate_output(model, varnames = None):
+    '''
+    Returns a DataFrame of the ménage level sums of varnames (every column of 
+    the model if None) and of the variables describing the ménages
+    '''
 
     out_dct = {}
     inputs = model._inputs
 
     unit = 'men'
     idx = model.index[unit]
-    enum = inputs.description.get_col('qui'+unit).enum
-    people = [x[1] for x in enum]
-
-    model.calculate()
-    for varname in model.col_names:
-        val = model.get_value(varname, idx, opt = people, sum_ = True)
-        out_dct[varname] = val
 
     # TODO: should take care the variables that shouldn't be summed automatically
     # MBJ: should we introduce a scope (men, fam, ind) in a the definition of columns ?
     varlist = ['wprm', 'typ_men', 'so', 'typmen15', 'tu99', 'ddipl', 'ageq', 'cstotpragr']
+
+    if varnames is None:
+        varnames = model.col_names
+    model.calculate((set(varnames) | set(varlist)) & model.col_names)
+    for varname in varnames:
+        out_dct[varname] = model.aggregate(varname, unit)
     
     for varname in varlist:
         if varname in model.col_names:
@@ -727,36 +731,39 @@ class Bareme(object):
         '''
         Calcule un impôt selon le barême non linéaire exprimé en tranches de taux marginaux.
         'assiette' est l'assiette de l'impôt, en colonne;
+        La tranche de chaque assiette est trouvée par recherche dichotomique sur les seuils,
+        l'impôt cumulé à chaque seuil étant précalculé.
         '''
+        assiette = np.asarray(assiette)
         k = self.nb
-        n = len(assiette)
+        seuils = np.array(self.seuils, dtype = float)
+        # j est la tranche de l'assiette, -1 sous le premier seuil
+        j = np.searchsorted(seuils, assiette, side = 'right') - 1
         if not self._linear_taux_moy:
-            assi = np.tile(assiette, (k, 1)).T
-            seui = np.tile(np.hstack((self.seuils, np.inf)), (n, 1))
-            a = max_(min_(assi, seui[:, 1:]) - seui[:,:-1], 0)
-            i = np.dot(self.taux,a.T)
-            if getT:
-                t = np.squeeze(max_(np.dot((a>0), np.ones((k, 1)))-1, 0))
-                return i, t
+            if k == 0:
+                i = np.zeros(assiette.shape)
             else:
-                return i
+                taux = np.array(self.taux, dtype = float)
+                cumul = np.hstack((0, np.cumsum(taux[:-1]*np.diff(seuils))))
+                jj = max_(j, 0)
+                i = np.where(j >= 0, cumul[jj] + taux[jj]*(assiette - seuils[jj]), 0)
         else:
             if len(self.tauxM) == 1:
                 i = assiette*self.tauxM[0]
             else:
-                assi = np.tile(assiette, (k-1, 1)).T
-                seui = np.tile(np.hstack(self.seuils), (n, 1))
-                k = self.t_x().T
-                a = (assi >= seui[:,:-1])*(assi < seui[:, 1:])
-                A = np.dot(a, self.t_x().T)
-                B = np.dot(a, np.array(self.seuils[1:]))
-                C = np.dot(a, np.array(self.tauxM[:-1]))
-                i = assiette*(A*(assiette-B) + C) + max_(assiette - self.seuils[-1], 0)*self.tauxM[-1] + (assiette >= self.seuils[-1])*self.seuils[-1]*self.tauxM[-2]
-            if getT:
-                t = np.squeeze(max_(np.dot((a>0), np.ones((k, 1)))-1, 0))
-                return i, t
-            else:
-                return i
+                tauxM = np.array(self.tauxM, dtype = float)
+                dans = (j >= 0) & (j < k - 1)
+                jj = np.clip(j, 0, k - 2)
+                A = np.where(dans, self.t_x()[jj], 0)
+                B = np.where(dans, seuils[1:][jj], 0)
+                C = np.where(dans, tauxM[:-1][jj], 0)
+                i = assiette*(A*(assiette-B) + C) + max_(assiette - seuils[-1], 0)*tauxM[-1] + (assiette >= seuils[-1])*seuils[-1]*tauxM[-2]
+        if getT:
+            # nombre de seuils strictement dépassés, moins un
+            t = max_(np.searchsorted(seuils, assiette, side = 'left') - 1, 0)
+            return i, t
+        else:
+            return i
 
     def t_x(self):
         s = self.seuils
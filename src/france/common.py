@@ -26,6 +26,7 @@ from numpy import (round, ceil, floor, maximum as max_, minimum as min_,
                    logical_not as not_)
 from france.data import QUIFAM, QUIMEN
 from france.pfam import nb_enf
+from core.columns import SUM
 
 CHEF = QUIFAM['chef']
 PART = QUIFAM['part']
@@ -73,15 +74,12 @@ def _revdisp_i(rev_trav, pen, rev_cap, ir_lps, psoc, ppe, impo):
     '''Revenu disponible - individuel'''
     return rev_trav + pen + rev_cap + ir_lps + psoc + ppe + impo
 
-def _revdisp(revdisp_i, _option = {'revdisp_i': ALL}):
+def _revdisp(revdisp_i, _option = {'revdisp_i': SUM}):
     '''
     Revenu disponible - ménage
     'men'
     '''
-    r = 0
-    for rev in revdisp_i.itervalues():
-        r += rev
-    return r
+    return revdisp_i
 
 def _nivvie(revdisp, uc):
     '''
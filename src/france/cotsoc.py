@@ -25,7 +25,7 @@ from __future__ import division
 from france.data import CAT
 from numpy import maximum as max_, minimum as min_, logical_not as not_, zeros
 from core.utils import Bareme
-from parametres.paramData import Tree2Object
+from parametres.paramData import Tree2Object, fingerprint
 
 class Object(object):
     def __init__(self):
@@ -138,14 +138,25 @@ def _prelsoc_cap_lib(rev_cap_lib, _P):
 ## Salaires
 ############################################################################
 
-def _salbrut(sali, hsup, type_sal, _defaultP):
+# barèmes inverses de _salbrut, indexés par l'empreinte des paramètres utilisés
+_salbrut_baremes = {}
+SALBRUT_CACHE_SIZE = 32
+
+def salbrut_baremes(P, csg_deduc):
     '''
-    Calcule le salaire brut à partir du salaire net
+    Renvoie les barèmes inverses (net vers brut) des non cadres, des cadres et 
+    des fonctionnaires, P étant les paramètres des cotisations sociales et 
+    csg_deduc le barème de la CSG déductible. Ils ne sont construits qu'une 
+    fois pour des paramètres donnés.
     '''
-    plaf_ss = 12*_defaultP.cotsoc.gen.plaf_ss
+    key = P.gen.plaf_ss, fingerprint(P.sal), fingerprint(csg_deduc)
+    if key in _salbrut_baremes:
+        return _salbrut_baremes[key]
 
-    sal = scaleBaremes(_defaultP.cotsoc.sal, plaf_ss)
-    csg = scaleBaremes(_defaultP.csg       , plaf_ss)
+    plaf_ss = 12*P.gen.plaf_ss
+
+    sal = scaleBaremes(P.sal, plaf_ss)
+    deduc = scaleBaremes(csg_deduc, plaf_ss)
     
     sal.noncadre.__dict__.update(sal.commun.__dict__)
     sal.cadre.__dict__.update(sal.commun.__dict__)
@@ -155,13 +166,21 @@ def _salbrut(sali, hsup, type_sal, _defaultP):
     fonc     = combineBaremes(sal.fonc)
 
     # On ajoute la CSG deductible
-    noncadre.addBareme(csg.act.deduc)
-    cadre.addBareme(csg.act.deduc)
-    fonc.addBareme(csg.act.deduc)
+    noncadre.addBareme(deduc)
+    cadre.addBareme(deduc)
+    fonc.addBareme(deduc)
     
-    nca = noncadre.inverse()
-    cad = cadre.inverse()
-    fon = fonc.inverse()
+    baremes = noncadre.inverse(), cadre.inverse(), fonc.inverse()
+    if len(_salbrut_baremes) >= SALBRUT_CACHE_SIZE:
+        _salbrut_baremes.clear()
+    _salbrut_baremes[key] = baremes
+    return baremes
+
+def _salbrut(sali, hsup, type_sal, _defaultP):
+    '''
+    Calcule le salaire brut à partir du salaire net
+    '''
+    nca, cad, fon = salbrut_baremes(_defaultP.cotsoc, _defaultP.csg.act.deduc)
 
     brut_nca = nca.calc(sali)
     brut_cad = cad.calc(sali)
@@ -25,6 +25,7 @@ from numpy import ( maximum as max_, minimum as min_, logical_xor as xor_,
                      logical_not as not_, round) 
 
 from france.data import QUIFOY
+from core.columns import SUM
 
 VOUS = QUIFOY['vous']
 CONJ = QUIFOY['conj']
@@ -179,16 +180,12 @@ def _tspr(sal_pen_net, rto_net):
     '''
     return sal_pen_net + rto_net
 
-def _rev_cat_tspr(tspr, _option = {'tspr': ALL}):
+def _rev_cat_tspr(tspr, _option = {'tspr': SUM}):
     '''
     Traitemens salaires pensions et rentes
     'foy'
     '''
-    out = 0
-    for qui in tspr.itervalues():
-        out += qui
-    
-    return out
+    return tspr
 
 def _deficit_rcm(f2aa, f2al, f2am, f2an):
     return f2aa + f2al + f2am + f2an
@@ -248,19 +245,12 @@ def _rev_cat_rfon(f4ba, f4bb, f4bc, f4bd, f4be, _P):
     out  = (c13>=0)*(g13 + e13*(e13<0)) - (c13<0)*d13
     return out
 
-def _rev_cat_rpns(rpns_i, _option = {'rpns_i': ALL}):
+def _rev_cat_rpns(rpns_i, _option = {'rpns_i': SUM}):
     '''
     Traitemens salaires pensions et rentes
     'foy'
     '''
-    out = None
-    for qui in rpns_i.itervalues():
-        if out is None:
-            out = qui
-        else:
-            out += qui
-    
-    return out
+    return rpns_i
 
 def _rev_cat(rev_cat_tspr, rev_cat_rvcm, rev_cat_rfon, rev_cat_rpns):
     ''' Revenus Categoriels '''
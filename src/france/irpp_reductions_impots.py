@@ -98,7 +98,7 @@ def _dfppce(rbg_int, f7uf, f7xs, f7xt, f7xu, f7xw, f7xy, _P):
     2002-
     '''
     P = _P.ir.reductions_impots.dfppce
-    base = f7uf
+    base = f7uf.copy()
     if _P.datesim.year >= 2004: base += f7xs
     if _P.datesim.year >= 2005: base += f7xt
     if _P.datesim.year >= 2006: base += f7xu
@@ -282,7 +282,7 @@ def _cappme(marpac, f7cf, f7cl, f7cm, f7cn, f7cu, _P):
     2002-
     '''
     P = _P.ir.reductions_impots.cappme
-    base = f7cf
+    base = f7cf.copy()
     if _P.datesim.year >= 2003: base += f7cl
     if _P.datesim.year >= 2004: base += f7cm
     if _P.datesim.year >= 2005: base += f7cn
@@ -23,6 +23,7 @@ This file is part of openFisca.
 from __future__ import division
 from numpy import ( maximum as max_, minimum as min_) 
 from france.data import QUIFOY
+from core.columns import SUM
 ALL = [x[1] for x in QUIFOY]
 
 
@@ -187,19 +188,12 @@ def _maj_cga_i(frag_impo, nrag_impg,
     maj_cga = max_(0,_P.ir.rpns.cga_taux2*(ntimp + frag_impo))
     return maj_cga
 
-def _maj_cga(maj_cga_i, _option = {'maj_cga_i': ALL}):
+def _maj_cga(maj_cga_i, _option = {'maj_cga_i': SUM}):
     '''
     Traitemens salaires pensions et rentes
     'foy'
     '''
-    out = None
-    for qui in maj_cga_i.itervalues():
-        if out is None:
-            out = qui
-        else:
-            out += qui
-    
-    return out
+    return maj_cga_i
 
 
 def _bouclier_rev(rbg, maj_cga, csg_deduc, rvcm_plus_abat, rev_cap_lib, rev_exo, rev_or, cd_penali, cd_eparet):
@@ -0,0 +1,86 @@
+# /usr/bin/env python
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Command line simulations, without Qt:
+#   python openFiscaBatch.py --survey data/final.csv --reform reformes/x.ofp -o out.csv
+
+import os
+import sys
+from argparse import ArgumentParser
+from core.settings import CONF
+
+def main(argv = None):
+    parser = ArgumentParser(description = "Simulation openFisca sans interface graphique")
+    inputs = parser.add_mutually_exclusive_group(required = True)
+    inputs.add_argument('--survey', help = "fichier de données d'enquête (csv)")
+    inputs.add_argument('--scenario', help = "cas type (.ofct)")
+    parser.add_argument('--param', default = os.path.join(CONF.get('paths', 'data_dir'), 'param.xml'),
+                        help = "fichier de paramètres (par défaut %(default)s)")
+    parser.add_argument('--reform', help = "réforme (.ofp) appliquée aux paramètres")
+    parser.add_argument('--datesim', help = "date de la simulation AAAA-MM-JJ (par défaut celle de la configuration ou de la réforme)")
+    parser.add_argument('--vars', nargs = '+', help = "variables à calculer et à écrire (par défaut toutes)")
+    parser.add_argument('--processes', type = int, default = 1, help = "nombre de processus de calcul (par défaut %(default)s)")
+    parser.add_argument('--chunksize', type = int, help = "lit l'enquête par blocs de ménages d'environ ce nombre de lignes")
+    parser.add_argument('--groupby', nargs = '+', default = [], help = "variables des ménages selon lesquelles les agrégats des blocs sont ventilés")
+    parser.add_argument('--profile', metavar = 'PREFIX', help = "mesure le coût de chaque prestation et l'écrit dans PREFIX.txt et PREFIX.folded (flame graph)")
+    parser.add_argument('-o', '--output', required = True, help = "fichier csv des résultats")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        CONF.set('simulation', 'profile', True)
+
+    # imported here so that --help does not load the model
+    from core.simulation import Simulation
+    from france.model import ModelFrance
+    from france.data import InputTable
+
+    simulation = Simulation(ModelFrance, InputTable, args.param, datesim = args.datesim, reform_file = args.reform)
+    root, ext = os.path.splitext(args.output)
+    if args.chunksize:
+        if not (args.survey and args.vars):
+            parser.error('--chunksize needs --survey and --vars')
+        output_default = root + '_default' + ext if args.reform else None
+        aggregates = simulation.stream_survey(args.survey, args.vars, args.output, args.groupby, args.chunksize, output_default)
+        aggregates.get_totals().to_csv(root + '_aggregates' + ext)
+        for by in args.groupby:
+            aggregates.get_groups(by).to_csv(root + '_' + by + ext)
+        if args.reform:
+            simulation.aggregates_default.get_totals().to_csv(root + '_default_aggregates' + ext)
+            for by in args.groupby:
+                simulation.aggregates_default.get_groups(by).to_csv(root + '_default_' + by + ext)
+        return
+
+    if args.survey:
+        simulation.load_survey(args.survey)
+    else:
+        simulation.load_scenario(args.scenario)
+    simulation.compute(args.vars, args.processes)
+    if args.profile:
+        simulation.outputs.profiler.save(args.profile)
+    simulation.save(args.output, args.vars)
+    if args.reform:
+        simulation.save(root + '_default' + ext, args.vars, default = True)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,269 @@
+# /usr/bin/env python
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Benchmarks of the simulation core on synthetic surveys:
+#   python openFiscaBench.py --sizes 1000 100000 --save bench.json
+#   python openFiscaBench.py --sizes 1000 100000 --baseline bench.json
+
+from __future__ import division
+import os
+import sys
+import json
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from datetime import datetime
+from timeit import default_timer as clock
+import numpy as np
+from pandas import DataFrame
+from core.settings import CONF
+from france.data import QUIMEN, QUIFOY, QUIFAM
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+def peak_memory():
+    '''
+    Returns the peak resident memory of the process since it started in MB, 
+    None if unknown
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak/2**20
+    return peak/2**10
+
+def resident_memory():
+    '''
+    Returns the current resident memory of the process in MB, None if unknown 
+    (read from /proc, ie on Linux only)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages*os.sysconf('SC_PAGE_SIZE')/2**20
+
+def synthetic_survey(nind, seed = 0):
+    '''
+    Returns a DataFrame of about nind individuals of InputTable living in ménages 
+    of one or two adults and up to four children. Unmarried couples make two 
+    foyers, every ménage is a single famille.
+    '''
+    rng = np.random.RandomState(seed)
+    nmen = max(1, int(nind/2.3))
+    adults = rng.randint(1, 3, nmen)
+    children = rng.choice(5, nmen, p = [.45, .2, .2, .1, .05])
+    size = adults + children
+    married = (adults == 2) & (rng.rand(nmen) < .7)
+
+    idmen = np.repeat(np.arange(nmen), size)
+    start = np.cumsum(size) - size
+    noi = np.arange(size.sum()) - np.repeat(start, size)
+    nadults = np.repeat(adults, size)
+    adult = noi < nadults
+    second = noi == 1
+    own_foyer = second & adult & ~np.repeat(married, size)
+    child = noi - nadults # rank of the child, negative for adults
+
+    quimen = np.where(adult, np.where(second, QUIMEN['cref'], QUIMEN['pref']), QUIMEN['enf1'] + child)
+    quifam = np.where(adult, np.where(second, QUIFAM['part'], QUIFAM['chef']), QUIFAM['enf1'] + child)
+    quifoy = np.where(adult, np.where(second, QUIFOY['conj'], QUIFOY['vous']), QUIFOY['pac1'] + child)
+    quifoy[own_foyer] = QUIFOY['vous']
+
+    n = len(noi)
+    age = np.where(adult, rng.randint(20, 80, n), rng.randint(0, 20, n))
+    working = adult & (age < 62) & (rng.rand(n) < .8)
+    sali = np.where(working, np.round(rng.lognormal(10, .6, n)), 0)
+    return DataFrame({'idmen': idmen,
+                      'idfoy': 100*idmen + own_foyer,
+                      'idfam': 100*idmen,
+                      'noi': noi,
+                      'quimen': quimen,
+                      'quifoy': quifoy,
+                      'quifam': quifam,
+                      'age': age,
+                      'agem': 12*age,
+                      'sali': sali,
+                      'choi': np.where(adult & ~working & (age < 62), np.round(rng.lognormal(9, .5, n)), 0),
+                      'rsti': np.where(adult & (age >= 62), np.round(rng.lognormal(9.5, .5, n)), 0),
+                      'statmarit': np.where(np.repeat(married, size) & adult, 1, 2),
+                      'type_sal': rng.randint(0, 3, n),
+                      'so': np.repeat(rng.randint(1, 7, nmen), size),
+                      'loyer': np.repeat(rng.randint(0, 1000, nmen), size),
+                      'zone_apl': np.repeat(rng.randint(1, 4, nmen), size),
+                      'wprm': np.repeat(rng.uniform(500, 3000, nmen), size)})
+
+class Benchmark(object):
+    '''
+    Times the steps of a simulation on a synthetic survey of a given size
+    '''
+    def __init__(self, param_file, datesim, repeat = 1):
+        super(Benchmark, self).__init__()
+        self.param_file = param_file
+        self.datesim = datesim
+        self.repeat = repeat
+        self.results = []
+
+    def time(self, name, size, func, setup = None):
+        '''
+        Records the best time of repeat calls of func, setup being called before each 
+        of them, and the growth of the resident memory of the process across the 
+        last call, ie the memory still held by its result (the temporaries 
+        freed before func returns are not counted). Returns the result of func
+        '''
+        best = None
+        for i in range(self.repeat):
+            if setup is not None:
+                setup()
+            result = None # the result of the previous call is freed before measuring
+            before = resident_memory()
+            start = clock()
+            result = func()
+            duration = clock() - start
+            after = resident_memory()
+            if best is None or duration < best:
+                best = duration
+        if before is None or after is None:
+            delta = None
+        else:
+            delta = after - before
+        self.results.append({'benchmark': name, 'size': size, 'seconds': best, 'rss_delta_mb': delta})
+        if delta is None:
+            print '%-24s %10d %10.4fs' % (name, size, best)
+        else:
+            print '%-24s %10d %10.4fs %+10.1f MB' % (name, size, best, delta)
+        return result
+
+    def run(self, sizes):
+        from core.datatable import DataTable, SystemSf, INDEX
+        from core.calmar import calmar
+        from france.data import InputTable
+        from france.model import ModelFrance
+        from parametres.paramData import XmlReader, get_compiled_file
+        import parametres.paramData as paramData
+
+        tmp = tempfile.mkdtemp()
+        # the parameters are read from a copy, the compiled file of the original is left as is
+        param_file = os.path.join(tmp, os.path.basename(self.param_file))
+        def cold_param():
+            paramData._compiled_params.clear()
+            if os.path.exists(get_compiled_file(param_file)):
+                os.remove(get_compiled_file(param_file))
+        try:
+            shutil.copyfile(self.param_file, param_file)
+            self.time('XmlReader (xml)', 0, lambda: XmlReader(param_file, self.datesim), cold_param)
+            self.time('XmlReader (compiled)', 0, lambda: XmlReader(param_file, self.datesim), paramData._compiled_params.clear)
+            P = XmlReader(param_file, self.datesim).param
+            P.datesim = self.datesim
+            P_default = XmlReader(param_file, self.datesim).param
+            P_default.datesim = self.datesim
+
+            for size in sizes:
+                fname = os.path.join(tmp, 'survey_%d.csv' % size)
+                synthetic_survey(size).to_csv(fname, index = False)
+                cache = fname + '.cache'
+                def remove_cache():
+                    if os.path.isdir(cache):
+                        shutil.rmtree(cache)
+
+                inputs = self.time('populate (csv)', size, lambda: DataTable(InputTable, survey_data = fname, datesim = self.datesim), remove_cache)
+                inputs = self.time('populate (cache)', size, lambda: DataTable(InputTable, survey_data = fname, datesim = self.datesim))
+                self.time('gen_index', size, lambda: inputs.gen_index(INDEX))
+
+                def calculate():
+                    system = SystemSf(ModelFrance, P, P_default, datesim = self.datesim)
+                    system.set_inputs(inputs)
+                    system.calculate()
+                    return system
+                system = self.time('calculate', size, calculate)
+
+                revenues = np.asarray(system.get_value('rbg'), dtype = float)
+                self.time('Bareme.calc', size, lambda: P.ir.bareme.calc(revenues))
+
+                idx = inputs.index['men']
+                weights = inputs.get_value('wprm', idx)
+                so = inputs.get_value('so', idx)
+                revdisp = system.aggregate('revdisp', 'men')
+                rng = np.random.RandomState(0)
+                margins = {'so': dict((cat, weights[so == cat].sum()*rng.uniform(.9, 1.1)) for cat in np.unique(so)),
+                           'revdisp': np.dot(weights, revdisp)*1.02}
+                param = {'method': 'logit', 'lo': 1/3, 'up': 3, 'use_proportions': True}
+                self.time('calmar', size, lambda: calmar({'wprm_init': weights, 'so': so, 'revdisp': revdisp}, 
+                                                         dict(margins), dict(param), 'wprm_init'))
+        finally:
+            cold_param()
+            shutil.rmtree(tmp)
+        return self.results
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints the ratio of each time to its baseline and returns the regressions, 
+    ie the benchmarks slower than the baseline by more than tolerance
+    '''
+    reference = dict(((row['benchmark'], row['size']), row['seconds']) for row in baseline)
+    regressions = []
+    for row in results:
+        key = (row['benchmark'], row['size'])
+        if key not in reference:
+            continue
+        ratio = row['seconds']/reference[key]
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = 'REGRESSION'
+            regressions.append(row)
+        print '%-24s %10d %10.4fs %10.4fs %6.2f %s' % (key[0], key[1], row['seconds'], reference[key], ratio, flag)
+    return regressions
+
+def main(argv = None):
+    parser = ArgumentParser(description = "Benchmarks du coeur de simulation sur des enquêtes synthétiques")
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [1000, 10000, 100000], help = "nombres d'individus des enquêtes synthétiques")
+    parser.add_argument('--param', default = os.path.join(CONF.get('paths', 'data_dir'), 'param.xml'), help = "fichier de paramètres")
+    parser.add_argument('--datesim', default = str(CONF.get('simulation', 'datesim')), help = "date de la simulation AAAA-MM-JJ")
+    parser.add_argument('--repeat', type = int, default = 3, help = "nombre de mesures de chaque étape, la meilleure est retenue")
+    parser.add_argument('--save', help = "enregistre les résultats (json) comme référence")
+    parser.add_argument('--baseline', help = "compare les résultats à une référence (json)")
+    parser.add_argument('--tolerance', type = float, default = .25, help = "ralentissement relatif toléré par rapport à la référence")
+    args = parser.parse_args(argv)
+
+    datesim = datetime.strptime(args.datesim, "%Y-%m-%d").date()
+    results = Benchmark(args.param, datesim, args.repeat).run(args.sizes)
+    print 'peak memory of the process: %s MB' % peak_memory()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent = 1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -22,10 +22,19 @@ This file is part of openFisca.
 """
     
 from xml.etree.ElementTree import ElementTree, SubElement, Element
-from xml.dom import minidom
+from xml.etree.cElementTree import iterparse
 from core.utils import Bareme
-from datetime import datetime
-from Config import CONF
+from datetime import datetime, date
+from core.settings import CONF
+import hashlib
+import os
+import pickle
+
+# compiled parameter files are cached in the directory COMPILED_DIR of the user,
+# one file per parameter file with this extension
+COMPILED_DIR = os.path.join(os.path.expanduser('~'), '.openfisca', 'compiled')
+COMPILED_EXT = '.compiled'
+COMPILED_VERSION = 2
 
 class Tree2Object(object):
     def __init__(self, node, defaut = False):
@@ -40,66 +49,246 @@ class Tree2Object(object):
             else:
                 setattr(self,a, Tree2Object(b, defaut))
 
-class XmlReader2(object):
-    def __init__(self, paramFile, date = None):
-        super(XmlReader, self).__init__()
-        self._doc = minidom.parse(paramFile)        
-        self.tree = Node('root')
-        if date is None: self._date = datetime.strptime(self._doc.childNodes[0].getAttribute('datesim'),"%Y-%m-%d").date()
-        else: self._date = date
-        self.handleNodeList(self._doc.childNodes, self.tree)
-        self.tree = self.tree.child(0)
-        self.param = Tree2Object(self.tree)
+def diff_params(param, other, path = ()):
+    '''
+    Returns the set of the paths (tuples of attribute names) of the values and 
+    baremes that differ between the parameter trees param and other
+    '''
+    if param is other:
+        return set()
+    if isinstance(param, Tree2Object) and isinstance(other, Tree2Object):
+        changed = set()
+        for name in set(param.__dict__) | set(other.__dict__):
+            if name in param.__dict__ and name in other.__dict__:
+                changed |= diff_params(param.__dict__[name], other.__dict__[name], path + (name,))
+            else:
+                changed.add(path + (name,))
+        return changed
+    if type(param) is not type(other):
+        return set([path])
+    if param == other:
+        return set()
+    return set([path])
+
+def fingerprint(param):
+    '''
+    Returns a hashable summary of the values and baremes of a parameter tree: 
+    trees holding the same values have the same fingerprint
+    '''
+    if isinstance(param, Tree2Object):
+        return tuple((name, fingerprint(val)) for name, val in sorted(param.__dict__.iteritems()))
+    if isinstance(param, Bareme):
+        return (Bareme,) + tuple(tuple(tranche) for tranche in param._tranches)
+    return param
 
 class XmlReader(object):
     def __init__(self, paramFile, date = None):
         super(XmlReader, self).__init__()
-        self._doc = minidom.parse(paramFile)        
-        self.tree = Node('root')
-        if date is None: self._date = datetime.strptime(self._doc.childNodes[0].getAttribute('datesim'),"%Y-%m-%d").date()
+        compiled = get_compiled_param(paramFile)
+        if date is None: self._date = datetime.strptime(compiled.datesim,"%Y-%m-%d").date()
         else: self._date = date
-        self.handleNodeList(self._doc.childNodes, self.tree)
-        self.tree = self.tree.child(0)
+        self.tree = compiled.get_tree(self._date)
         self.param = Tree2Object(self.tree)
 
-    def handleNodeList(self, nodeList, parent):
-        for element in nodeList:
-            if element.nodeType is not element.TEXT_NODE:
-                if element.tagName == "BAREME":
-                    code = element.getAttribute('code')
-                    desc = element.getAttribute('description')
-                    tranches = Bareme(code)
-                    for tranche in element.getElementsByTagName("TRANCHE"):
-                        seuil = self.handleValues(tranche.getElementsByTagName("SEUIL")[0], self._date)
-                        assi = tranche.getElementsByTagName("ASSIETTE")
-                        if assi:  assiette = self.handleValues(assi[0], self._date)
-                        else: assiette = 1
-                        taux  = self.handleValues(tranche.getElementsByTagName("TAUX")[0], self._date)
-                        if not seuil is None and not taux is None:
-                            tranches.addTranche(seuil, taux*assiette)
-                    tranches.marToMoy()
-                    node = BaremeNode(code, desc, tranches, parent)
-                elif element.tagName == "CODE":
-                    code = element.getAttribute('code')
-                    desc = element.getAttribute('description')
-                    valueFormat = element.getAttribute('format')
-                    val = self.handleValues(element, self._date)
-                    if not val is None:
-                        node = CodeNode(code, desc, float(val), parent, valueFormat)
+
+def _ordinal(string):
+    '''
+    Returns the ordinal of a date written as 'YYYY-MM-DD'
+    '''
+    try:
+        year, month, day = string.split('-')
+        return date(int(year), int(month), int(day)).toordinal()
+    except (AttributeError, ValueError):
+        raise Exception("Invalid date %s: dates should be written 'YYYY-MM-DD'" % string)
+
+def _value_at(values, ordinal):
+    '''
+    Returns the first value of a list of (deb, fin, valeur) valid at date ordinal.
+    A value that could not be read is (None, None, error): the error is raised 
+    when it is met before the value valid at ordinal.
+    '''
+    for deb, fin, val in values:
+        if deb is None:
+            raise Exception(val)
+        if deb <= ordinal <= fin:
+            return val
+    return None
+
+class CompiledParam(object):
+    '''
+    Parameter file compiled once: the structure of the tree with, for each code and 
+    each tranche of bareme, the list of its dated values as (deb, fin, valeur) where 
+    deb and fin are date ordinals. Building the tree of parameters at a given date 
+    is then a lookup in these lists, without parsing the xml again. As when the 
+    xml was read for one date, an invalid date or value only fails the reading of 
+    its node at the dates where it is looked at (see _value_at), and datesim, the
+    date of the file, is kept as written.
+    Entries of the structure are
+        ('NODE', code, description, children)
+        ('CODE', code, description, format, values)
+        ('BAREME', code, description, tranches) where tranches is a list of dicts 
+            with the values of 'SEUIL', 'TAUX' and optionally 'ASSIETTE'
+    '''
+    def __init__(self, paramFile = None):
+        super(CompiledParam, self).__init__()
+        self.datesim = None
+        self.root = None
+        if paramFile is not None:
+            self.compile(paramFile)
+
+    def compile(self, paramFile):
+        '''
+        Parses the parameter file in one streaming pass
+        '''
+        stack = []
+        tranche = None
+        values = None
+        for event, element in iterparse(paramFile, events = ('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == 'VALUE':
+                    if values is not None:
+                        try:
+                            values.append((_ordinal(element.get('deb')), 
+                                           _ordinal(element.get('fin')), 
+                                           float(element.get('valeur'))))
+                        except Exception, e:
+                            values.append((None, None, str(e)))
+                elif tag in ('SEUIL', 'ASSIETTE', 'TAUX'):
+                    # only the first one of a tranche is used
+                    if tranche is not None and not tag in tranche:
+                        values = tranche[tag] = []
+                elif tag == 'TRANCHE':
+                    tranche = {}
                 else:
-                    code = element.getAttribute('code')
-                    desc = element.getAttribute('description')
-                    node = Node(code, desc, parent)
-                    self.handleNodeList(element.childNodes, node)
-    
-    def handleValues(self, element, date):
-        # TODO gérer les assiettes en mettan l'assiette à 1 si elle n'existe pas
-        for val in element.getElementsByTagName("VALUE"):
-            deb = datetime.strptime(val.getAttribute('deb'),"%Y-%m-%d").date()
-            fin   = datetime.strptime(val.getAttribute('fin'),"%Y-%m-%d").date()
-            if deb <= date <= fin:
-                return float(val.getAttribute('valeur'))
-        return None
+                    code = unicode(element.get('code', ''))
+                    desc = unicode(element.get('description', ''))
+                    if tag == 'CODE':
+                        values = []
+                        entry = ('CODE', code, desc, unicode(element.get('format', '')), values)
+                    elif tag == 'BAREME':
+                        entry = ('BAREME', code, desc, [])
+                    else:
+                        entry = ('NODE', code, desc, [])
+                    if not stack:
+                        self.datesim = element.get('datesim', '')
+                    stack.append(entry)
+            else:
+                if tag in ('SEUIL', 'ASSIETTE', 'TAUX'):
+                    values = None
+                elif tag == 'TRANCHE':
+                    if stack and stack[-1][0] == 'BAREME':
+                        stack[-1][3].append(tranche)
+                    tranche = None
+                elif tag != 'VALUE':
+                    entry = stack.pop()
+                    values = None
+                    if stack:
+                        if stack[-1][0] == 'NODE':
+                            stack[-1][3].append(entry)
+                    else:
+                        self.root = entry
+                # the children have been compiled, release the element
+                element.clear()
+
+    def get_tree(self, date):
+        '''
+        Returns the tree of parameter nodes valid at date
+        '''
+        tree = Node('root')
+        self._build_node(self.root, tree, date.toordinal())
+        return tree.child(0)
+
+    def _build_node(self, entry, parent, ordinal):
+        if entry[0] == 'BAREME':
+            tag, code, desc, tranches = entry
+            bareme = Bareme(code)
+            for tranche in tranches:
+                seuil = _value_at(tranche['SEUIL'], ordinal)
+                if 'ASSIETTE' in tranche: assiette = _value_at(tranche['ASSIETTE'], ordinal)
+                else: assiette = 1
+                taux = _value_at(tranche['TAUX'], ordinal)
+                if not seuil is None and not taux is None:
+                    bareme.addTranche(seuil, taux*assiette)
+            bareme.marToMoy()
+            BaremeNode(code, desc, bareme, parent)
+        elif entry[0] == 'CODE':
+            tag, code, desc, valueFormat, values = entry
+            val = _value_at(values, ordinal)
+            if not val is None:
+                CodeNode(code, desc, val, parent, valueFormat)
+        else:
+            tag, code, desc, children = entry
+            node = Node(code, desc, parent)
+            for child in children:
+                self._build_node(child, node, ordinal)
+
+_compiled_params = {}
+
+def get_compiled_file(paramFile):
+    '''
+    Returns the file of COMPILED_DIR caching the compiled parameters of 
+    paramFile, named after its absolute path
+    '''
+    path = os.path.abspath(paramFile)
+    if isinstance(path, unicode):
+        key = hashlib.sha1(path.encode('utf-8'))
+    else:
+        key = hashlib.sha1(path)
+    return os.path.join(COMPILED_DIR, '%s-%s%s' % (os.path.basename(path), key.hexdigest()[:16], COMPILED_EXT))
+
+def _save_compiled(compiled_file, signature, compiled):
+    '''
+    Pickles the compiled parameters to compiled_file. The cache may not be 
+    writeable: the parameters are then compiled again at the next run.
+    '''
+    # written to a temporary file first, so that a concurrent reader never gets a partial file
+    temp = '%s.%d' % (compiled_file, os.getpid())
+    try:
+        if not os.path.isdir(COMPILED_DIR):
+            os.makedirs(COMPILED_DIR)
+        with open(temp, 'wb') as f:
+            pickle.dump((signature, compiled.datesim, compiled.root), f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(compiled_file):
+            os.remove(compiled_file)
+        os.rename(temp, compiled_file)
+    except (IOError, OSError, pickle.PicklingError), e:
+        print Warning('Unable to write compiled parameters %s: %s' % (compiled_file, e))
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+def get_compiled_param(paramFile):
+    '''
+    Returns the CompiledParam of paramFile. The compiled parameters are kept in memory
+    and pickled to COMPILED_DIR (see get_compiled_file); both are used as long as 
+    the size and the modification time of the file are unchanged.
+    '''
+    path = os.path.abspath(paramFile)
+    stat = os.stat(path)
+    signature = (COMPILED_VERSION, path, stat.st_size, stat.st_mtime)
+    if path in _compiled_params and _compiled_params[path][0] == signature:
+        return _compiled_params[path][1]
+
+    compiled = None
+    compiled_file = get_compiled_file(path)
+    try:
+        with open(compiled_file, 'rb') as f:
+            stored_signature, datesim, root = pickle.load(f)
+        if stored_signature == signature:
+            compiled = CompiledParam()
+            compiled.datesim = datesim
+            compiled.root = root
+    except Exception:
+        pass
+
+    if compiled is None:
+        compiled = CompiledParam(path)
+        _save_compiled(compiled_file, signature, compiled)
+
+    _compiled_params[path] = (signature, compiled)
+    return compiled
 
 class Node(object):
     def __init__(self, code, description = '', parent=None):        
@@ -0,0 +1,93 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+from __future__ import division
+import atexit
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+import numpy as np
+from core.settings import CONF
+import parametres.paramData as paramData
+from parametres.paramData import XmlReader
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATESIM = date(2010, 1, 1)
+
+# the files of the source tree used by the tests are copied to a temporary 
+# directory, where the compiled parameters are cached too: the tests leave src 
+# and the cache of the user as they are
+DATA_DIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, DATA_DIR, True)
+paramData.COMPILED_DIR = os.path.join(DATA_DIR, 'compiled')
+
+def copy_file(*path):
+    '''
+    Returns the path of a copy in DATA_DIR of the file path of the source tree
+    '''
+    copy = os.path.join(DATA_DIR, os.path.basename(path[-1]))
+    if not os.path.exists(copy):
+        shutil.copyfile(os.path.join(SRC_DIR, *path), copy)
+    return copy
+
+PARAM_FILE = copy_file('data', 'param.xml')
+
+def get_param(datesim = DATESIM, param_file = PARAM_FILE):
+    '''
+    Returns the parameters at datesim, as the simulations use them
+    '''
+    param = XmlReader(param_file, datesim).param
+    param.datesim = datesim
+    return param
+
+def assert_same_columns(test, table, other, names):
+    '''
+    Checks that the columns names of the DataTables table and other are equal
+    '''
+    for name in names:
+        value, expected = table.get_value(name), other.get_value(name)
+        test.assertEqual(value.dtype, expected.dtype, name)
+        test.assertTrue(np.allclose(value, expected, equal_nan = True), name)
+
+class SurveyTestCase(unittest.TestCase):
+    '''
+    Writes a synthetic survey of NIND individuals to a temporary directory 
+    (self.tmp) shared by the tests of the class
+    '''
+    NIND = 1000
+
+    @classmethod
+    def setUpClass(cls):
+        from openFiscaBench import synthetic_survey
+        CONF.set('simulation', 'datesim', str(DATESIM))
+        cls.tmp = tempfile.mkdtemp()
+        cls.survey_file = os.path.join(cls.tmp, 'survey.csv')
+        synthetic_survey(cls.NIND, seed = 1).to_csv(cls.survey_file, index = False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
@@ -0,0 +1,150 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+
+
+from __future__ import division
+import unittest
+import numpy as np
+from pandas import DataFrame
+from core.aggregates import (AggregateCube, get_matrix, weighted_sums, weighted_counts, weighted_means, 
+                             group_sums, weighted_quantiles, gini, quantile_shares)
+
+def reference_gini(values, weights):
+    '''
+    The Gini coefficient as the weighted mean absolute difference of every pair 
+    of observations over twice the weighted mean
+    '''
+    differences = abs(values[:, None] - values[None, :])
+    return np.dot(weights, np.dot(differences, weights))/(2*weights.sum()*np.dot(weights, values))
+
+class AggregateCubeTest(unittest.TestCase):
+    '''
+    The distributions of the cube are those of a pandas groupby, the missing 
+    and infinite values being left out
+    '''
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        n = 500
+        so = rng.randint(1, 6, n).astype(float)
+        so[rng.rand(n) < .1] = np.nan
+        rev = np.round(rng.lognormal(9, 1, n))*(rng.rand(n) < .7)
+        rev[rng.rand(n) < .1] = np.nan
+        aide = rng.randint(0, 3, n)*100.
+        aide[:3] = [np.inf, -np.inf, np.nan]
+        self.frame = DataFrame({'so': so, 
+                                'typmen': rng.randint(1, 4, n),
+                                'rev': rev,
+                                'aide': aide,
+                                'nbenf': rng.randint(0, 3, n),
+                                'wprm': rng.uniform(100, 1000, n)})
+        self.varnames = ['rev', 'aide', 'nbenf']
+
+    def test_cube(self):
+        cube = AggregateCube(self.frame, ['so', 'typmen'])
+        self.assertEqual(sorted(cube.varnames), sorted(self.varnames))
+        frame = self.frame.replace([np.inf, -np.inf], np.nan)
+        weight = frame['wprm']
+        for by in ('so', 'typmen'):
+            groups = frame.groupby(by)
+            sums = cube.get_sums(by, self.varnames).set_index(by)
+            counts = cube.get_counts(by, self.varnames).set_index(by)
+            means = cube.get_means(by, self.varnames).set_index(by)
+            self.assertTrue(np.allclose(sums['wprm'], groups['wprm'].sum()))
+            for var in self.varnames:
+                expected = (frame[var]*weight).groupby(frame[by]).sum()
+                self.assertTrue(np.array_equal(sums.index.values, expected.index.values))
+                self.assertTrue(np.allclose(sums[var], expected), (by, var))
+                self.assertTrue(np.allclose(means[var], expected/groups['wprm'].sum()), (by, var))
+                expected = ((frame[var].fillna(0) != 0)*weight).groupby(frame[by]).sum()
+                self.assertTrue(np.allclose(counts[var], expected), (by, var))
+
+    def test_totals(self):
+        values = get_matrix(self.frame, self.varnames)
+        weight = self.frame['wprm'].values
+        frame = self.frame.replace([np.inf, -np.inf], np.nan)
+        expected = [(frame[var]*frame['wprm']).sum() for var in self.varnames]
+        self.assertTrue(np.allclose(weighted_sums(values, weight), expected))
+        expected = [((frame[var].fillna(0) != 0)*frame['wprm']).sum() for var in self.varnames]
+        self.assertTrue(np.allclose(weighted_counts(values, weight), expected))
+        self.assertTrue(np.allclose(weighted_sums(values[:, 0], weight), 
+                                    (frame['rev']*frame['wprm']).sum()))
+
+class DistributionTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        n = 300
+        self.values = np.round(rng.lognormal(9, 1, n))*(rng.rand(n) < .8)
+        self.weights = rng.randint(1, 5, n).astype(float)
+        self.codes = rng.randint(0, 4, n)
+
+    def test_means(self):
+        self.assertTrue(np.allclose(weighted_means(self.values, self.weights), 
+                                    np.average(self.values, weights = self.weights)))
+        matrix = np.column_stack((self.values, self.codes))
+        self.assertTrue(np.allclose(weighted_means(matrix, self.weights), 
+                                    np.average(matrix, axis = 0, weights = self.weights)))
+
+    def test_group_sums(self):
+        sums = group_sums(self.codes, self.values, self.weights, 6)
+        self.assertEqual(len(sums), 6)
+        for k in range(6):
+            members = self.codes == k
+            self.assertTrue(np.allclose(sums[k], np.dot(self.values[members], self.weights[members])))
+
+    def test_quantiles(self):
+        # with integer weights, the quantiles of the observations repeated by their weight
+        expanded = np.sort(np.repeat(self.values, self.weights.astype(int)))
+        q = np.array([0, .1, .25, .5, .9, 1])
+        expected = expanded[np.maximum(np.ceil(q*len(expanded)).astype(int) - 1, 0)]
+        self.assertTrue(np.array_equal(weighted_quantiles(self.values, self.weights, q), expected))
+        self.assertEqual(weighted_quantiles(self.values, self.weights, .5), expected[3])
+
+    def test_gini(self):
+        self.assertTrue(np.allclose(gini(self.values, self.weights), reference_gini(self.values, self.weights)))
+        self.assertTrue(np.allclose(gini(np.ones(10)*5, np.ones(10)), 0))
+        holder = np.zeros(10)
+        holder[3] = 1
+        self.assertTrue(np.allclose(gini(holder, np.ones(10)), .9))
+        # the total is zero
+        self.assertEqual(gini(np.zeros(10), np.ones(10)), 0)
+        self.assertTrue(np.isnan(gini(np.array([-1., 1.]), np.ones(2))))
+        self.assertTrue(np.isnan(gini(np.zeros(3), np.zeros(3))))
+
+    def test_quantile_shares(self):
+        shares = quantile_shares(np.arange(10, 0, -1), np.ones(10))
+        self.assertTrue(np.allclose(shares, np.arange(1, 11)/55))
+        shares = quantile_shares(self.values, self.weights, 5)
+        self.assertEqual(len(shares), 5)
+        self.assertTrue(np.allclose(shares.sum(), 1))
+        self.assertTrue((np.diff(shares) >= 0).all())
+        # the total is zero
+        for values, weights in [(np.zeros(10), np.ones(10)), (np.ones(10), np.zeros(10)), (np.zeros(0), np.zeros(0))]:
+            shares = quantile_shares(values, weights)
+            self.assertEqual(len(shares), 10)
+            self.assertTrue(np.isnan(shares).all())
+
+if __name__ == '__main__':
+    unittest.main()
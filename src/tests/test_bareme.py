@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+from __future__ import division
+import unittest
+import numpy as np
+from core.utils import Bareme
+from france.data import CAT
+from france import cotsoc
+from tests.common import get_param
+
+def reference_calc(bareme, assiette):
+    '''
+    The tax of assiette computed tranche by tranche, and the index of the tranche 
+    of each assiette, as Bareme.calc(assiette, getT = True)
+    '''
+    seuils = np.hstack((bareme.seuils, np.inf))
+    a = np.maximum(np.minimum(assiette[:, None], seuils[None, 1:]) - seuils[None, :-1], 0)
+    return np.dot(a, bareme.taux), np.maximum((a > 0).sum(axis = 1) - 1, 0)
+
+def reference_calc_moy(bareme, assiette):
+    '''
+    The tax of assiette by linear interpolation of the average rates, as 
+    Bareme.calc when _linear_taux_moy is True
+    '''
+    seuils, tauxM = np.array(bareme.seuils, dtype = float), np.array(bareme.tauxM, dtype = float)
+    a = (assiette[:, None] >= seuils[None, :-1])*(assiette[:, None] < seuils[None, 1:])
+    A = np.dot(a, bareme.t_x())
+    B = np.dot(a, seuils[1:])
+    C = np.dot(a, tauxM[:-1])
+    return (assiette*(A*(assiette - B) + C) + np.maximum(assiette - seuils[-1], 0)*tauxM[-1] + 
+            (assiette >= seuils[-1])*seuils[-1]*tauxM[-2])
+
+class BaremeTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.assiette = np.hstack((rng.uniform(-1000, 200000, 5000), [0, 5963, 11896, 26420, 70830, 1e7]))
+        self.baremes = [get_param().ir.bareme]
+        bareme = Bareme('test')
+        for seuil, taux in [(0, 0), (1000, .1), (5000, .25), (20000, .4)]:
+            bareme.addTranche(seuil, taux)
+        self.baremes.append(bareme)
+
+    def test_calc(self):
+        for bareme in self.baremes:
+            tax, tranche = bareme.calc(self.assiette, getT = True)
+            expected_tax, expected_tranche = reference_calc(bareme, self.assiette)
+            self.assertTrue(np.allclose(tax, expected_tax))
+            self.assertTrue(np.array_equal(tranche, expected_tranche))
+            self.assertTrue(np.allclose(bareme.calc(self.assiette), expected_tax))
+
+    def test_calc_moy(self):
+        for bareme in self.baremes:
+            bareme.marToMoy()
+            bareme._linear_taux_moy = True
+            self.assertTrue(np.allclose(bareme.calc(self.assiette), reference_calc_moy(bareme, self.assiette)))
+
+def reference_salbrut(sali, type_sal, P):
+    '''
+    The gross wage of the net wage sali, the inverse baremes being built for 
+    each call as _salbrut did before they were memoized
+    '''
+    plaf_ss = 12*P.cotsoc.gen.plaf_ss
+    sal = cotsoc.scaleBaremes(P.cotsoc.sal, plaf_ss)
+    csg = cotsoc.scaleBaremes(P.csg, plaf_ss)
+    sal.noncadre.__dict__.update(sal.commun.__dict__)
+    sal.cadre.__dict__.update(sal.commun.__dict__)
+    salbrut = np.zeros(len(sali))
+    for cat, baremes in [('noncadre', sal.noncadre), ('cadre', sal.cadre), ('fonc', sal.fonc)]:
+        bareme = cotsoc.combineBaremes(baremes)
+        bareme.addBareme(csg.act.deduc)
+        salbrut += bareme.inverse().calc(sali)*(type_sal == CAT[cat])
+    return salbrut
+
+class SalbrutTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.sali = np.hstack((rng.uniform(0, 150000, 3000), [0, 1e6]))
+        self.type_sal = rng.choice([CAT['noncadre'], CAT['cadre'], CAT['fonc']], len(self.sali))
+        self.hsup = np.zeros(len(self.sali))
+        cotsoc._salbrut_baremes.clear()
+
+    def salbrut(self, P):
+        return cotsoc._salbrut(self.sali, self.hsup, self.type_sal, P)
+
+    def test_memoized(self):
+        P = get_param()
+        expected = reference_salbrut(self.sali, self.type_sal, P)
+        self.assertTrue(np.allclose(self.salbrut(P), expected))
+        baremes = cotsoc._salbrut_baremes.values()
+        self.assertEqual(len(baremes), 1)
+
+        # equal parameters read again share the baremes
+        self.assertTrue(np.allclose(self.salbrut(get_param()), expected))
+        self.assertEqual(cotsoc._salbrut_baremes.values(), baremes)
+
+    def test_changed_params(self):
+        self.salbrut(get_param())
+        for change in [lambda P: setattr(P.cotsoc.gen, 'plaf_ss', 1.1*P.cotsoc.gen.plaf_ss), 
+                       lambda P: P.csg.act.deduc.setTaux(0, 2*P.csg.act.deduc.taux[0]), 
+                       lambda P: P.cotsoc.sal.cadre.agirc.setTaux(1, .2)]:
+            P = get_param()
+            change(P)
+            self.assertTrue(np.allclose(self.salbrut(P), reference_salbrut(self.sali, self.type_sal, P)))
+        self.assertEqual(len(cotsoc._salbrut_baremes), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+
+
+from __future__ import division
+import os
+import sys
+import unittest
+from StringIO import StringIO
+import numpy as np
+import parametres.paramData as paramData
+from parametres.paramData import XmlReader
+from france.data import QUIMEN, QUIFOY
+from openFiscaBench import Benchmark, synthetic_survey, compare
+from tests.common import PARAM_FILE, DATESIM
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_synthetic_survey(self):
+        frame = synthetic_survey(1000, seed = 4)
+        self.assertTrue(800 < len(frame) < 1300)
+        self.assertTrue(frame.equals(synthetic_survey(1000, seed = 4)))
+        # one person of reference by ménage and one declarant by foyer
+        self.assertEqual((frame['quimen'] == QUIMEN['pref']).sum(), frame['idmen'].nunique())
+        self.assertEqual((frame['quifoy'] == QUIFOY['vous']).sum(), frame['idfoy'].nunique())
+
+    def test_run(self):
+        XmlReader(PARAM_FILE, DATESIM)
+        compiled = sorted(os.listdir(paramData.COMPILED_DIR))
+        results = Benchmark(PARAM_FILE, DATESIM).run([200])
+        names = [row['benchmark'] for row in results]
+        for name in ('XmlReader (xml)', 'XmlReader (compiled)', 'populate (csv)', 'populate (cache)', 
+                     'gen_index', 'calculate', 'Bareme.calc', 'calmar'):
+            self.assertIn(name, names)
+        self.assertTrue(all(row['seconds'] >= 0 for row in results))
+        # the parameters benchmarked are a copy, whose compiled file is removed
+        self.assertEqual(sorted(os.listdir(paramData.COMPILED_DIR)), compiled)
+
+    def test_compare(self):
+        baseline = [{'benchmark': 'calculate', 'size': 10, 'seconds': 1.}, 
+                    {'benchmark': 'calmar', 'size': 10, 'seconds': 1.}]
+        results = [{'benchmark': 'calculate', 'size': 10, 'seconds': 1.2}, 
+                   {'benchmark': 'calmar', 'size': 10, 'seconds': 1.3}, 
+                   {'benchmark': 'calmar', 'size': 100, 'seconds': 9.}]
+        self.assertEqual(compare(results, baseline, .25), [results[1]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,405 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+
+
+from __future__ import division
+import os
+import unittest
+from datetime import date
+import numpy as np
+from core import parallel
+from core.columns import param_reads
+from core.datatable import DataTable, SystemSf
+from core.periods import MultiPeriodSystem
+from core.profiler import Profiler
+from core.settings import CONF
+from core.simulation import ScenarioSession
+from core.utils import Scenario
+from france.data import InputTable
+from france.model import ModelFrance
+from tests.common import SurveyTestCase, PARAM_FILE, DATESIM, get_param, assert_same_columns
+
+def reference_calculate(system, varname):
+    '''
+    Calculates varname after its parents, recursively, as SystemSf.calculate did 
+    before it followed a plan
+    '''
+    col = system.description.get_col(varname)
+    if varname in system._calculated or varname not in system._enabled_cols:
+        return
+    for parent in col._parents:
+        reference_calculate(system, parent.name)
+    system._calculate_col(col)
+    system.clear_gather_cache()
+
+class PlanTest(SurveyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(PlanTest, cls).setUpClass()
+        cls.inputs = DataTable(InputTable, survey_data = cls.survey_file)
+        cls.param = get_param()
+
+    def get_system(self):
+        system = SystemSf(ModelFrance, self.param, self.param, datesim = DATESIM)
+        system.set_inputs(self.inputs)
+        return system
+
+    def test_order(self):
+        system = self.get_system()
+        plan = system.get_plan()
+        self.assertEqual(len(plan), len(set(plan)))
+        self.assertEqual(set(col.name for col in plan), system._enabled_cols)
+        position = dict((col, k) for k, col in enumerate(plan))
+        for col in plan:
+            for parent in col._parents:
+                if parent in position:
+                    self.assertLess(position[parent], position[col], (parent.name, col.name))
+
+        # the plan of revdisp holds its enabled ancestors
+        ancestors, stack = set(), [system.description.get_col('revdisp')]
+        while stack:
+            col = stack.pop()
+            if col.name in system._enabled_cols and col not in ancestors:
+                ancestors.add(col)
+                stack.extend(col._parents)
+        self.assertEqual(set(system.get_plan(['revdisp'])), ancestors)
+
+    def test_calculate(self):
+        system = self.get_system()
+        system.calculate()
+        reference = self.get_system()
+        for col in sorted(reference.description.columns.itervalues(), key = lambda col: col._order):
+            reference_calculate(reference, col.name)
+        self.assertEqual(system._calculated, reference._calculated)
+        assert_same_columns(self, system, reference, reference._calculated)
+
+class ReuseTest(SurveyTestCase):
+    '''
+    A system taking the columns of a baseline gives the values of a full 
+    calculation, and the two systems do not share their changes
+    '''
+    @classmethod
+    def setUpClass(cls):
+        super(ReuseTest, cls).setUpClass()
+        cls.inputs = DataTable(InputTable, survey_data = cls.survey_file)
+        cls.param = get_param()
+        cls.reform = get_param()
+        cls.reform.fam.af.taux.enf2 = .5
+
+    def get_system(self, param, inputs = None, baseline = None):
+        system = SystemSf(ModelFrance, param, self.param, datesim = DATESIM)
+        system.set_inputs(inputs or self.inputs)
+        if baseline is not None:
+            self.affected = system.reuse(baseline)
+        system.calculate()
+        return system
+
+    def test_reform(self):
+        baseline = self.get_system(self.param)
+        full = self.get_system(self.reform)
+        system = self.get_system(self.reform, baseline = baseline)
+        self.assertIn('af_base', self.affected)
+        self.assertNotIn('salbrut', self.affected)
+        self.assertLess(len(self.affected), len(full._calculated))
+        assert_same_columns(self, system, full, full._calculated)
+
+    def test_changed_inputs(self):
+        baseline = self.get_system(self.param)
+        inputs = DataTable(InputTable, survey_data = self.survey_file)
+        sali = inputs.get_value('sali', inputs.index['ind'])
+        inputs.set_value('sali', sali*1.1, inputs.index['ind'])
+        full = self.get_system(self.param, inputs)
+        system = self.get_system(self.param, inputs, baseline)
+        self.assertIn('salbrut', self.affected)
+        assert_same_columns(self, system, full, full._calculated)
+
+    def test_edit_after_reuse(self):
+        baseline = self.get_system(self.param)
+        expected = dict((name, baseline.get_value(name, copy = True)) for name in baseline._calculated)
+        system = self.get_system(self.reform, baseline = baseline)
+        self.assertIs(system._columns['salbrut'], baseline._columns['salbrut'])
+
+        # edits and new calculations of either system leave the other one as is
+        index = self.inputs.index['ind']
+        system.set_value('salbrut', np.zeros(index['nb']), index)
+        system._free(system.description.get_col('revdisp'))
+        system.calculate(['revdisp'])
+        for name, value in expected.iteritems():
+            self.assertTrue(np.array_equal(baseline.get_value(name), value), name)
+
+        reform = dict((name, system.get_value(name, copy = True)) for name in system._calculated)
+        baseline.set_value('revdisp', np.zeros(index['nb']), index)
+        baseline.set_value('salbrut', np.ones(index['nb']), index)
+        for name, value in reform.iteritems():
+            self.assertTrue(np.array_equal(system.get_value(name), value), name)
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'the shards need fork')
+class ShardsTest(SurveyTestCase):
+    '''
+    A calculation split into shards of ménages gives the values of a serial 
+    calculation
+    '''
+    @classmethod
+    def setUpClass(cls):
+        super(ShardsTest, cls).setUpClass()
+        cls.inputs = DataTable(InputTable, survey_data = cls.survey_file)
+        cls.param = get_param()
+        cls.serial = SystemSf(ModelFrance, cls.param, cls.param, datesim = DATESIM)
+        cls.serial.set_inputs(cls.inputs)
+        cls.serial.calculate()
+
+    def setUp(self):
+        # small shards so that the test survey is split
+        self.min_shard_rows = parallel.MIN_SHARD_ROWS
+        parallel.MIN_SHARD_ROWS = 100
+
+    def tearDown(self):
+        parallel.MIN_SHARD_ROWS = self.min_shard_rows
+
+    def test_shards(self):
+        rows = parallel.shard_rows(self.inputs, 3)
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(np.array_equal(np.sort(np.concatenate(rows)), np.arange(self.inputs._nrows)))
+
+        system = SystemSf(ModelFrance, self.param, self.param, datesim = DATESIM)
+        system.set_inputs(self.inputs)
+        parallel.calculate_in_shards(system, processes = 3)
+        self.assertEqual(system._calculated, self.serial._calculated)
+        assert_same_columns(self, system, self.serial, self.serial._calculated)
+
+    def test_reform_reuse(self):
+        reform = get_param()
+        reform.fam.af.taux.enf2 = .5
+        full = SystemSf(ModelFrance, reform, self.param, datesim = DATESIM)
+        full.set_inputs(self.inputs)
+        full.calculate()
+
+        # the reused columns are copied to the shards
+        system = SystemSf(ModelFrance, reform, self.param, datesim = DATESIM)
+        system.set_inputs(self.inputs)
+        affected = system.reuse(self.serial)
+        self.assertLess(len(affected), len(full._calculated))
+        parallel.calculate_in_shards(system, processes = 3)
+        assert_same_columns(self, system, full, full._calculated)
+
+class CountingSystem(SystemSf):
+    '''
+    Counts the columns allocated at most at once during a calculation
+    '''
+    def _calculate_col(self, col, *args, **kwargs):
+        SystemSf._calculate_col(self, col, *args, **kwargs)
+        self.peak_columns = max(getattr(self, 'peak_columns', 0), len(self._columns))
+
+class FreeIntermediatesTest(SurveyTestCase):
+    '''
+    The columns are allocated when calculated and the intermediate columns freed 
+    once their children are calculated
+    '''
+    @classmethod
+    def setUpClass(cls):
+        super(FreeIntermediatesTest, cls).setUpClass()
+        cls.inputs = DataTable(InputTable, survey_data = cls.survey_file)
+        cls.param = get_param()
+        cls.serial = SystemSf(ModelFrance, cls.param, cls.param, datesim = DATESIM)
+        cls.serial.set_inputs(cls.inputs)
+        cls.serial.calculate()
+
+    def get_system(self):
+        system = CountingSystem(ModelFrance, self.param, self.param, datesim = DATESIM)
+        system.set_inputs(self.inputs)
+        self.assertEqual(system._columns, {})
+        return system
+
+    def test_free_intermediates(self):
+        kept = self.get_system()
+        kept.calculate(['revdisp'])
+        system = self.get_system()
+        system.calculate(['revdisp'], free_intermediates = True)
+        self.assertEqual(system._calculated, set(['revdisp']))
+        self.assertEqual(set(system._columns), set(['revdisp']))
+        self.assertLess(system.peak_columns, kept.peak_columns//2)
+        assert_same_columns(self, system, self.serial, ['revdisp'])
+
+    def test_freed_column(self):
+        system = self.get_system()
+        system.calculate(['revdisp'], free_intermediates = True)
+        self.assertNotIn('af', system._calculated)
+        # calculated again when read
+        self.assertTrue(np.allclose(system.aggregate('af', 'fam'), self.serial.aggregate('af', 'fam')))
+        assert_same_columns(self, system, self.serial, ['irpp', 'af'])
+
+class ProfilerTest(SurveyTestCase):
+    '''
+    A profiled calculation gives the values of a plain one and the cost of 
+    every prestation calculated
+    '''
+    def test_profile(self):
+        inputs = DataTable(InputTable, survey_data = self.survey_file)
+        param = get_param()
+        plain = SystemSf(ModelFrance, param, param, datesim = DATESIM)
+        plain.set_inputs(inputs)
+        plain.calculate(['revdisp'])
+        system = SystemSf(ModelFrance, param, param, datesim = DATESIM)
+        system.set_inputs(inputs)
+        system.profiler = Profiler()
+        system.calculate(['revdisp'])
+        assert_same_columns(self, system, plain, plain._calculated)
+
+        stats = system.profiler.stats
+        self.assertEqual(set(stats), system._calculated)
+        for name, (unit, calls, gather, formula, set_value, nbytes) in stats.iteritems():
+            self.assertEqual(unit, system.description.get_col(name)._unit)
+            self.assertEqual(calls, 1)
+            self.assertTrue(min(gather, formula, set_value) >= 0, name)
+            self.assertTrue(nbytes > 0, name)
+
+        report = system.profiler.get_report()
+        self.assertEqual(sorted(report.index), sorted(stats))
+        self.assertTrue((np.diff(report['wall'].values) <= 0).all())
+        prefix = os.path.join(self.tmp, 'profile')
+        system.profiler.save(prefix)
+        with open(prefix + '.folded') as f:
+            self.assertEqual(len(f.readlines()), 3*len(stats))
+
+class ScenarioSessionTest(unittest.TestCase):
+    '''
+    The systems of a session recalculate the descendants of the edited inputs 
+    only, with the values of a full calculation, and leave the systems of the 
+    previous edits as they are
+    '''
+    def setUp(self):
+        CONF.set('simulation', 'datesim', str(DATESIM))
+        self.param = get_param()
+        self.reform = get_param()
+        self.reform.fam.af.taux.enf2 = .5
+        self.scenario = Scenario()
+        self.scenario.addIndiv(1, date(1976, 1, 1), 'conj', 'part')
+        self.scenario.addIndiv(2, date(2005, 1, 1), 'pac', 'enf')
+        self.scenario.addIndiv(3, date(2008, 1, 1), 'pac', 'enf')
+
+    def full(self, inputs, param):
+        system = SystemSf(ModelFrance, param, self.param, datesim = DATESIM)
+        system.set_inputs(inputs)
+        system.calculate()
+        return system
+
+    def test_edits(self):
+        session = ScenarioSession(ModelFrance, InputTable)
+        previous = []
+        edits = [None, ('sali', 15000), ('sali', 22000), ('choi', 5000), ('sali', 0)]
+        for k, edit in enumerate(edits):
+            if edit is not None:
+                self.scenario.indiv[1][edit[0]] = edit[1]
+            changed = session.set_scenario(self.scenario)
+            if k == 0:
+                self.assertIsNone(changed)
+            else:
+                self.assertEqual(changed, set([edit[0]]))
+            for name, param, baseline in [('default', self.param, None), ('courant', self.reform, 'default')]:
+                before = session.systems.get(name, session.systems.get(baseline))
+                system = session.get_system(name, param, self.param, baseline)
+                if before is not None:
+                    # the columns depending on neither the edit nor the reform are shared
+                    shared = [varname for varname in before._calculated if system._columns.get(varname) is before._columns[varname]]
+                    self.assertTrue(0 < len(shared) < len(before._calculated))
+                system.calculate()
+                full = self.full(session.inputs, param)
+                self.assertEqual(system._calculated, full._calculated)
+                assert_same_columns(self, system, full, full._calculated)
+            # the systems of the previous edits are left as they are
+            for system, values in previous:
+                for varname, value in values.iteritems():
+                    self.assertTrue(np.array_equal(system.get_value(varname), value), (k, varname))
+            for system in session.systems.itervalues():
+                previous.append((system, dict((varname, system.get_value(varname, copy = True)) 
+                                              for varname in system._calculated)))
+
+class CheckedSystem(SystemSf):
+    '''
+    SystemSf checking that the formulas get read-only arrays
+    '''
+    def _gather(self, table, varname, unit, opt = None):
+        value = SystemSf._gather(self, table, varname, unit, opt)
+        for var in (value.itervalues() if isinstance(value, dict) else [value]):
+            if var.flags.writeable:
+                raise Exception('%s is given writeable to a formula' % varname)
+        return value
+
+class ReadOnlyInputsTest(SurveyTestCase):
+    '''
+    The formulas do not modify the arrays they get, which are shared by the 
+    prestations reading them
+    '''
+    # dates where the model can be calculated, every prestation being enabled at one of them
+    DATES = [date(2004, 1, 1), date(2005, 1, 1), date(2007, 1, 1), date(2008, 1, 1), 
+             date(2009, 7, 1), date(2010, 1, 1)]
+    # prestations enabled at earlier dates only, calculated on their own
+    EARLIER = (date(2003, 1, 1), ['intemp', 'invrev'])
+
+    def test_prestations(self):
+        inputs = DataTable(InputTable, survey_data = self.survey_file)
+        values = dict((name, inputs.get_value(name, copy = True)) for name in inputs.col_names)
+        calculated = set()
+        for datesim, varnames in [(datesim, None) for datesim in self.DATES] + [self.EARLIER]:
+            param = get_param(datesim)
+            system = CheckedSystem(ModelFrance, param, param, datesim = datesim)
+            system.set_inputs(inputs)
+            system.calculate(varnames)
+            calculated |= system._calculated
+        self.assertEqual(calculated, set(system.col_names))
+        for name, value in values.iteritems():
+            self.assertTrue(np.array_equal(inputs.get_value(name), value), name)
+
+class MultiPeriodTest(SurveyTestCase):
+    def test_multi_period(self):
+        inputs = DataTable(InputTable, survey_data = self.survey_file)
+        # forth and back, the columns being taken from the previous date
+        dates = [date(2008, 1, 1), date(2009, 7, 1), date(2010, 1, 1), date(2009, 1, 1)]
+        varnames = ['revdisp', 'af', 'irpp', 'rsa_act']
+        results = MultiPeriodSystem(ModelFrance, inputs, PARAM_FILE).calculate(dates, varnames)
+        for k, datesim in enumerate(dates):
+            param = get_param(datesim)
+            system = SystemSf(ModelFrance, param, param, datesim = datesim)
+            system.set_inputs(inputs)
+            system.calculate()
+            for varname in varnames:
+                self.assertTrue(np.allclose(results[varname][k], system.get_value(varname)), (datesim, varname))
+
+def _example(x, _P):
+    P = _P.fam
+    bmaf = P.af.bmaf
+    if _P.datesim.year <= 2007:
+        return x*bmaf
+    return x*P.af.taux.enf1 + _P.ir.bareme.calc(x)
+
+class ParamReadsTest(unittest.TestCase):
+    def test_param_reads(self):
+        paths, tests = param_reads(_example)
+        self.assertEqual(paths, set([('fam', 'af', 'bmaf'), ('fam', 'af', 'taux', 'enf1'), ('ir', 'bareme', 'calc')]))
+        self.assertEqual(tests, set([(('datesim', 'year'), '<=', 2007)]))
+
+if __name__ == '__main__':
+    unittest.main()
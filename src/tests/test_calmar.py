@@ -0,0 +1,217 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+from __future__ import division
+import os
+import unittest
+import warnings
+import numpy as np
+from core.calmar import Calmar, calmar, get_functions
+from core.simulation import Simulation, WEIGHTS_EXT, load_weights
+from france.data import InputTable
+from france.model import ModelFrance
+from tests.common import SurveyTestCase, PARAM_FILE, DATESIM
+
+try:
+    from scipy.optimize import fsolve
+except ImportError:
+    fsolve = None
+
+def reference_calmar(data, margins, param, pondini = 'wprm_init'):
+    '''
+    The calibrated weights found by solving the first order conditions with 
+    fsolve, as calmar did before it was solved by Newton iterations
+    '''
+    weights = data[pondini]
+    columns, targets = [np.ones(len(weights))], [margins['totalpop']]
+    for var, val in sorted(margins.iteritems()):
+        if var == 'totalpop':
+            continue
+        if isinstance(val, dict):
+            for cat, nb in sorted(val.iteritems()):
+                columns.append(data[var] == cat)
+                targets.append(nb)
+        else:
+            columns.append(data[var])
+            targets.append(val)
+    # each constraint is divided by its target, which does not change the weights
+    x, targets = np.column_stack(columns)/np.array(targets, dtype = float), np.ones(len(targets))
+    F, F_prime = get_functions(param)
+    constraint = lambda l: np.dot(weights*F(np.dot(x, l)), x) - targets
+    constraint_prime = lambda l: np.dot(weights*(x.T*F_prime(np.dot(x, l))), x)
+    with warnings.catch_warnings():
+        # fsolve warns about its progress once the constraints hold to the float precision
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lambdas = fsolve(constraint, np.zeros(len(targets)), fprime = constraint_prime)
+    return weights*F(np.dot(x, lambdas))
+
+class CalmarTest(unittest.TestCase):
+    PARAMS = [{'method': 'linear'},
+              {'method': 'raking ratio'},
+              {'method': 'logit', 'lo': .5, 'up': 2}]
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        n = 200
+        self.data = {'wprm_init': rng.uniform(10, 30, n),
+                     'cat': rng.randint(0, 3, n),
+                     'rev': rng.lognormal(9, 1, n)}
+        w = self.data['wprm_init']
+        # categorical margins adding up to the population, 4% more of rev 
+        totalpop = round(w.sum()*1.02)
+        cat = {0: round(totalpop*.3), 1: round(totalpop*.3)}
+        cat[2] = totalpop - cat[0] - cat[1]
+        self.margins = {'totalpop': totalpop, 'cat': cat, 'rev': np.dot(w, self.data['rev'])*1.04}
+
+    def check_margins(self, weights):
+        self.assertTrue(np.allclose(weights.sum(), self.margins['totalpop']))
+        for k, nb in self.margins['cat'].iteritems():
+            self.assertTrue(np.allclose(weights[self.data['cat'] == k].sum(), nb))
+        self.assertTrue(np.allclose(np.dot(weights, self.data['rev']), self.margins['rev']))
+
+    def test_linear(self):
+        # the linear method has a closed form
+        weights, lambdas, margins = calmar(dict(self.data), dict(self.margins), {'method': 'linear'})
+        self.check_margins(weights)
+        d = self.data['wprm_init']
+        x = np.column_stack([np.ones(len(d))] + [self.data['cat'] == k for k in range(3)][1:] + [self.data['rev']])
+        targets = np.array([self.margins['totalpop']] + [self.margins['cat'][k] for k in range(3)][1:] + [self.margins['rev']])
+        lambdas = np.linalg.solve(np.dot(x.T*d, x), targets - np.dot(d, x))
+        self.assertTrue(np.allclose(weights, d*(1 + np.dot(x, lambdas))))
+
+    @unittest.skipIf(fsolve is None, 'scipy is needed for the reference')
+    def test_reference(self):
+        for param in self.PARAMS:
+            weights, lambdas, margins = calmar(dict(self.data), dict(self.margins), dict(param))
+            self.check_margins(weights)
+            self.assertTrue(np.allclose(weights, reference_calmar(self.data, self.margins, param)), param['method'])
+            if param['method'] == 'logit':
+                ratio = weights/self.data['wprm_init']
+                self.assertTrue((ratio >= param['lo'] - 1e-9).all() and (ratio <= param['up'] + 1e-9).all())
+
+    def get_engine(self, param):
+        engine = Calmar(self.data['wprm_init'], param)
+        engine.add_variable('cat', self.data['cat'], True)
+        engine.add_variable('rev', self.data['rev'])
+        return engine
+
+    def solve(self, engine, margins):
+        return engine.solve(dict((var, val) for var, val in margins.iteritems() if var != 'totalpop'), 
+                            margins['totalpop'])
+
+    def test_engine(self):
+        # solving again after a change of the margins gives the weights of a new calibration
+        engine = self.get_engine({'method': 'raking ratio'})
+        margins = dict(self.margins)
+        margins['rev'] *= 1.01
+        self.solve(engine, margins)
+        design = engine._design
+        weights = self.solve(engine, self.margins)
+        self.assertTrue(engine.converged)
+        self.assertIs(engine._design, design)
+        expected = calmar(dict(self.data), dict(self.margins), {'method': 'raking ratio'})[0]
+        self.assertTrue(np.allclose(weights, expected))
+
+        # the design follows the variables
+        engine.add_variable('rev', 2*self.data['rev'])
+        self.assertIsNone(engine._design)
+        margins['rev'] = 2*self.margins['rev']
+        self.assertTrue(np.allclose(self.solve(engine, margins), expected))
+        self.assertTrue(np.array_equal(engine._design[:, 1], 2*self.data['rev']))
+
+    def test_warm_start(self):
+        # a solve starting from the multipliers of close margins gives the weights of a cold solve
+        for param in self.PARAMS:
+            margins = dict(self.margins)
+            warm = self.get_engine(param)
+            for ratio in (1.04, 1.05, 1.06):
+                margins['rev'] = np.dot(self.data['wprm_init'], self.data['rev'])*ratio
+                weights = self.solve(warm, margins)
+                cold = self.get_engine(param)
+                expected = self.solve(cold, margins)
+                self.assertTrue(warm.converged and cold.converged)
+                self.assertTrue(np.allclose(weights, expected), param['method'])
+                self.assertLessEqual(warm.iterations, cold.iterations)
+
+class CalibrateTest(SurveyTestCase):
+    def setUp(self):
+        self.simulation = Simulation(ModelFrance, InputTable, PARAM_FILE, datesim = DATESIM)
+        self.simulation.load_survey(self.survey_file)
+        # af is an intermediate column, freed after the calculation of revdisp
+        self.simulation.compute(['revdisp'])
+        self.weights_file = self.survey_file + WEIGHTS_EXT
+        if os.path.exists(self.weights_file):
+            os.remove(self.weights_file)
+
+        reference = Simulation(ModelFrance, InputTable, PARAM_FILE, datesim = DATESIM)
+        reference.load_survey(self.survey_file)
+        reference.compute()
+        self.af = reference.outputs.aggregate('af', 'men')
+        self.weights_init = reference.inputs.get_value('wprm_init', reference.inputs.index['men'])
+
+    def write_margins(self, af_ratio):
+        fname = os.path.join(self.tmp, 'margins.csv')
+        with open(fname, 'w') as f:
+            f.write('var,mod,2010\n')
+            f.write('totalpop,0,%r\n' % self.weights_init.sum())
+            f.write('af,0,%r\n' % (np.dot(self.weights_init, self.af)*af_ratio))
+        return fname
+
+    def test_output_margin(self):
+        self.assertGreater(np.dot(self.weights_init, self.af), 0)
+        margins_file = self.write_margins(1.1)
+        weights = self.simulation.calibrate(margins_file, [2010], processes = 1)
+        self.assertTrue(np.allclose(np.dot(weights['2010'].values, self.af), np.dot(self.weights_init, self.af)*1.1))
+        self.assertTrue(np.allclose(weights['2010'].sum(), self.weights_init.sum()))
+        self.assertTrue(load_weights(self.survey_file).equals(weights))
+
+    def test_not_converged(self):
+        margins_file = self.write_margins(50)
+        param = {'method': 'logit', 'lo': .5, 'up': 2, 'use_proportions': False}
+        self.simulation.calibrate(margins_file, [2010], param, processes = 1)
+        self.assertFalse(os.path.exists(self.weights_file))
+
+    def test_years(self):
+        # each year is calibrated on its own margins, whatever the number of processes
+        ratios = {2009: 1.05, 2010: 1.1, 2011: .95}
+        fname = os.path.join(self.tmp, 'years.csv')
+        with open(fname, 'w') as f:
+            f.write('var,mod,%s\n' % ','.join(str(year) for year in sorted(ratios)))
+            f.write('totalpop,0,%s\n' % ','.join(repr(self.weights_init.sum()) for year in sorted(ratios)))
+            f.write('af,0,%s\n' % ','.join(repr(np.dot(self.weights_init, self.af)*ratios[year]) for year in sorted(ratios)))
+        param = {'method': 'logit', 'lo': 1/3, 'up': 3, 'use_proportions': True}
+        processes = [1]
+        if hasattr(os, 'fork'):
+            processes.append(3)
+        for n in processes:
+            weights = self.simulation.calibrate(fname, sorted(ratios), dict(param), processes = n)
+            self.assertEqual(list(weights.columns), [str(year) for year in sorted(ratios)])
+            for year, ratio in ratios.iteritems():
+                margins = {'totalpop': self.weights_init.sum(), 'af': np.dot(self.weights_init, self.af)*ratio}
+                expected = calmar({'wprm_init': self.weights_init, 'af': self.af}, margins, dict(param))[0]
+                self.assertTrue(np.allclose(weights[str(year)].values, expected), (n, year))
+
+if __name__ == '__main__':
+    unittest.main()
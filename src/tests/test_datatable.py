@@ -0,0 +1,325 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+
+
+from __future__ import division
+import unittest
+from datetime import date
+import numpy as np
+from pandas import DataFrame, concat
+from core.columns import IntCol, AgesCol, FloatCol, compact
+from core.datatable import DataTable, INDEX
+from core.utils import Scenario
+from france.data import InputTable
+from openFiscaBench import synthetic_survey
+
+class FrameTable(object):
+    '''
+    get_value and set_value of the DataTable whose columns were the columns of a 
+    DataFrame, rebuilt by every set_value
+    '''
+    def __init__(self, table):
+        self.description = table.description
+        self.frame = DataFrame(dict((name, table.get_value(name)) for name in table.col_names))
+
+    def get_value(self, varname, index = None, opt = None):
+        col = self.description.get_col(varname)
+        var = np.array(self.frame[varname].values, dtype = col._dtype)
+        if index is None:
+            return var
+        out = {}
+        for person in ([0] if opt is None else opt):
+            temp = np.ones(index['nb'], dtype = col._dtype)*col._default
+            idx = index[person]
+            temp[idx['idxUnit']] = var[idx['idxIndi']]
+            out[person] = temp
+        if opt is None:
+            return out[0]
+        return out
+
+    def set_value(self, varname, value, index, opt = None):
+        idx = index[0 if opt is None else opt]
+        col = self.description.get_col(varname)
+        var = np.array(self.frame[varname].values, dtype = col._dtype)
+        var[idx['idxIndi']] = np.array(value, dtype = col._dtype)[idx['idxUnit']]
+        self.frame[varname] = var
+
+def reference_index(table, units):
+    '''
+    The index of table built role by role with argwhere, as gen_index did
+    '''
+    index = {'noi': {}}
+    nois = table.get_value('noi')
+    listnoi = np.unique(nois)
+    for noi in listnoi:
+        idxIndi = np.sort(np.squeeze((np.argwhere(nois == noi))))
+        index['noi'][noi] = {'idxIndi': idxIndi, 'idxUnit': np.searchsorted(listnoi, nois[idxIndi])}
+    for unit in units:
+        idx = table.get_value('id' + unit)
+        qui = table.get_value('qui' + unit)
+        idxlist = np.unique(idx)
+        index[unit] = {'nb': len(idxlist)}
+        for full, person in table.description.get_col('qui' + unit).enum:
+            idxIndi = np.sort(np.squeeze((np.argwhere(qui == person))))
+            index[unit][person] = {'idxIndi': idxIndi, 'idxUnit': np.searchsorted(idxlist, idx[idxIndi])}
+    return index
+
+def reference_scenario(scenario, datesim):
+    '''
+    The table of scenario built by concat and set_value, as populate_from_scenario 
+    did before it filled the columns by block
+    '''
+    table = DataTable(InputTable, datesim = datesim)
+    NMEN = table.NMEN
+    frame = DataFrame()
+    idmen = np.arange(60001, 60001 + NMEN)
+    for noi, dct in scenario.indiv.iteritems():
+        birth = dct['birth']
+        frame = concat([frame, DataFrame({'noi': noi*np.ones(NMEN),
+                                          'age': (datesim.year - birth.year)*np.ones(NMEN),
+                                          'agem': (12*(datesim.year - birth.year) + datesim.month - birth.month)*np.ones(NMEN),
+                                          'quimen': table.description.get_col('quimen').enum[dct['quimen']]*np.ones(NMEN),
+                                          'quifoy': table.description.get_col('quifoy').enum[dct['quifoy']]*np.ones(NMEN),
+                                          'quifam': table.description.get_col('quifam').enum[dct['quifam']]*np.ones(NMEN),
+                                          'idmen': idmen,
+                                          'idfoy': idmen*100 + dct['noidec'],
+                                          'idfam': idmen*100 + dct['noichef']})], ignore_index = True)
+    table._set_columns_from_frame(frame)
+    table.gen_index(INDEX)
+
+    structure = ('birth', 'noipref', 'noidec', 'noichef', 'quifoy', 'quimen', 'quifam')
+    for unit, values, skip in (('men', scenario.indiv, structure), ('foy', scenario.declar, ()), ('men', scenario.menage, ())):
+        index = table.index[unit]
+        for noi, dct in values.iteritems():
+            for var, val in dct.iteritems():
+                if var not in skip and index.get(noi) is not None:
+                    table.set_value(var, np.ones(index['nb'])*val, index, noi)
+    index = table.index['men']
+    if NMEN > 1:
+        table.set_value(table.XAXIS, np.linspace(0, table.MAXREV, NMEN), 
+                        {0: {'idxIndi': index[0]['idxIndi'], 'idxUnit': index[0]['idxIndi']}})
+    return table
+
+class ColumnStoreTest(unittest.TestCase):
+    '''
+    The typed arrays of DataTable give the values of the former DataFrame
+    '''
+    def setUp(self):
+        self.table = DataTable(InputTable)
+        self.table.populate_from_frame(synthetic_survey(300, seed = 2))
+        self.reference = FrameTable(self.table)
+
+    def test_values(self):
+        rng = np.random.RandomState(0)
+        index = self.table.index
+        writes = [('sali', 'ind', None), ('sali', 'foy', 1), ('choi', 'fam', 2), ('loyer', 'men', None), 
+                  ('statmarit', 'foy', 0), ('age', 'men', 1), ('f4ba', 'foy', None)]
+        for varname, unit, person in writes:
+            value = rng.uniform(0, 1000, index[unit]['nb']).round()
+            self.table.set_value(varname, value, index[unit], person)
+            self.reference.set_value(varname, value, index[unit], person)
+
+        for varname in set(varname for varname, unit, person in writes) | set(['wprm', 'idfoy', 'quifam']):
+            value, expected = self.table.get_value(varname), self.reference.get_value(varname)
+            self.assertEqual(value.dtype, expected.dtype)
+            self.assertTrue(np.array_equal(value, expected), varname)
+            for unit in ('ind', 'foy', 'fam', 'men'):
+                value, expected = self.table.get_value(varname, index[unit]), self.reference.get_value(varname, index[unit])
+                self.assertTrue(np.array_equal(value, expected), (varname, unit))
+            persons = [0, 1, 2]
+            value = self.table.get_value(varname, index['foy'], persons)
+            expected = self.reference.get_value(varname, index['foy'], persons)
+            for person in persons:
+                self.assertTrue(np.array_equal(value[person], expected[person]), (varname, person))
+
+    def test_read_only(self):
+        index = self.table.index['ind']
+        for value in (self.table.get_value('sali'), self.table.get_value('sali', index)):
+            self.assertRaises(ValueError, value.__setitem__, 0, 1)
+        value = self.table.get_value('sali', copy = True)
+        value[:] = -1
+        self.assertTrue(np.array_equal(self.table.get_value('sali'), self.reference.get_value('sali')))
+
+    def test_table(self):
+        frame = self.table.table
+        self.assertEqual(sorted(frame.columns), sorted(self.table.col_names))
+        for varname in self.table.col_names:
+            self.assertTrue(np.array_equal(frame[varname].values, self.reference.frame[varname].values), varname)
+        self.assertIs(self.table.table, frame)
+
+        # a new frame once a column is set
+        index = self.table.index['foy']
+        self.table.set_value('sali', np.ones(index['nb']), index)
+        self.assertIsNot(self.table.table, frame)
+        self.assertTrue(np.array_equal(self.table.table['sali'].values, self.table.get_value('sali')))
+
+class CompactTest(unittest.TestCase):
+    '''
+    The integer columns stored in a narrower dtype are read and written in the 
+    dtype of the column, with the values of the survey
+    '''
+    def test_compact(self):
+        values = np.array([0, 3, 120, 2], dtype = np.float32)
+        self.assertEqual(compact(IntCol(), values).dtype, np.int8)
+        self.assertEqual(compact(AgesCol(), values).dtype, np.int16)
+        self.assertEqual(compact(IntCol(), values*100).dtype, np.int16)
+        # int32 takes as much room as float32
+        for col, var in [(IntCol(), values*1e6), (IntCol(), values + .5), (FloatCol(), values)]:
+            self.assertIs(compact(col, var), var)
+
+    def test_round_trip(self):
+        frame = synthetic_survey(300, seed = 3)
+        table = DataTable(InputTable)
+        table.populate_from_frame(frame)
+        compacted = [name for name in frame.columns 
+                     if table._columns[name].dtype.itemsize < np.dtype(table.description.get_col(name)._dtype).itemsize]
+        self.assertIn('age', compacted)
+        self.assertIn('quifoy', compacted)
+        index = table.index
+        for name in compacted:
+            col = table.description.get_col(name)
+            expected = np.array(frame[name].values, dtype = col._dtype)
+            value = table.get_value(name)
+            self.assertEqual(value.dtype, col._dtype)
+            self.assertTrue(np.array_equal(value, expected), name)
+            for unit in ('foy', 'men'):
+                value = table.get_value(name, index[unit], [0, 1])
+                for person in (0, 1):
+                    self.assertEqual(value[person].dtype, col._dtype)
+                    idx = index[unit][person]
+                    self.assertTrue(np.array_equal(value[person][idx['idxUnit']], expected[idx['idxIndi']]), (name, unit))
+
+        # a written column gets back the dtype of the column, out of range values included
+        col = table.description.get_col('age')
+        ages = table.get_value('age')
+        idx = index['foy'][0]
+        value = np.zeros(index['foy']['nb'])
+        value[idx['idxUnit']] = 40000
+        table.set_value('age', value, index['foy'])
+        self.assertEqual(table._columns['age'].dtype, col._dtype)
+        expected = ages.copy()
+        expected[idx['idxIndi']] = 40000
+        self.assertTrue(np.array_equal(table.get_value('age'), expected))
+
+class ScenarioTest(unittest.TestCase):
+    '''
+    The table of a scenario filled by block gives the columns and the index of 
+    the former table built by concat and set_value
+    '''
+    DATESIM = date(2010, 1, 1)
+
+    def get_scenarios(self):
+        single = Scenario()
+        couple = Scenario()
+        couple.addIndiv(1, date(1976, 1, 1), 'conj', 'part')
+        couple.addIndiv(2, date(2005, 1, 1), 'pac', 'enf')
+        couple.addIndiv(3, date(2008, 5, 1), 'pac', 'enf')
+        couple.indiv[1]['sali'] = 15000
+        couple.declar[0]['f7uf'] = 300
+        couple.menage[0]['loyer'] = 750
+        unmarried = Scenario()
+        unmarried.addIndiv(1, date(1980, 7, 1), 'vous', 'part')
+        unmarried.addIndiv(2, date(2004, 1, 1), 'pac', 'enf')
+        unmarried.indiv[1]['choi'] = 8000
+        return [single, couple, unmarried]
+
+    def test_scenario(self):
+        for scenario in self.get_scenarios():
+            table = DataTable(InputTable, scenario = scenario, datesim = self.DATESIM)
+            reference = reference_scenario(scenario, self.DATESIM)
+            self.assertEqual(table._nrows, reference._nrows)
+            for varname in reference.col_names:
+                value, expected = table.get_value(varname), reference.get_value(varname)
+                self.assertEqual(value.dtype, expected.dtype, varname)
+                self.assertTrue(np.array_equal(value, expected), varname)
+            for unit in INDEX:
+                self.assertEqual(table.index[unit]['nb'], reference.index[unit]['nb'])
+                persons = [person for person in reference.index[unit] if isinstance(person, int)]
+                for varname in ('age', 'sali', 'choi', 'f7uf', 'loyer', 'idmen'):
+                    value = table.get_value(varname, table.index[unit], persons)
+                    expected = reference.get_value(varname, reference.index[unit], persons)
+                    for person in persons:
+                        self.assertTrue(np.array_equal(value[person], expected[person]), (unit, varname, person))
+
+class IndexTest(unittest.TestCase):
+    def test_index(self):
+        frame = synthetic_survey(500, seed = 3)
+        # individuals not sorted by unit
+        frame = frame.take(np.random.RandomState(0).permutation(len(frame)))
+        table = DataTable(InputTable)
+        table.populate_from_frame(frame)
+        expected = reference_index(table, INDEX)
+        for unit in ['noi'] + INDEX:
+            if unit != 'noi':
+                self.assertEqual(table.index[unit]['nb'], expected[unit]['nb'])
+            for person, idx in expected[unit].iteritems():
+                if person == 'nb':
+                    continue
+                for key in ('idxIndi', 'idxUnit'):
+                    self.assertTrue(np.array_equal(table.index[unit][person][key], np.atleast_1d(idx[key])), 
+                                    (unit, person, key))
+
+class AggregateTest(unittest.TestCase):
+    '''
+    The segment reductions give the values of the sums over the roles and of 
+    a loop over the members of each unit
+    '''
+    def setUp(self):
+        self.table = DataTable(InputTable)
+        self.table.populate_from_frame(synthetic_survey(500, seed = 4))
+
+    def test_sum(self):
+        for unit in INDEX:
+            index = self.table.index[unit]
+            persons = [person for full, person in self.table.description.get_col('qui' + unit).enum]
+            for varname in ('sali', 'choi'):
+                expected = self.table.get_value(varname, index, persons, sum_ = True)
+                self.assertTrue(np.allclose(self.table.aggregate(varname, unit), expected), (unit, varname))
+            expected = self.table.get_value('sali', index, [0, 1], sum_ = True)
+            self.assertTrue(np.allclose(self.table.aggregate('sali', unit, roles = [0, 1]), expected))
+
+    def test_reductions(self):
+        age = self.table.get_value('age')
+        # the value of the units without members
+        dflt = self.table.description.get_col('age')._default
+        for unit in INDEX:
+            index = self.table.index[unit]
+            role = self.table.get_value('qui' + unit)
+            for roles in (None, [2, 3, 4]):
+                members = [[] for k in range(index['nb'])]
+                for row, pos in enumerate(index['unitPos']):
+                    if roles is None or role[row] in roles:
+                        members[pos].append(age[row])
+                expected = {'max': [max(values) if values else dflt for values in members],
+                            'min': [min(values) if values else dflt for values in members],
+                            'count': [sum(1 for value in values if value != 0) for values in members],
+                            'any': [any(value != 0 for value in values) for values in members]}
+                for how, values in expected.iteritems():
+                    value = self.table.aggregate('age', unit, how, roles)
+                    self.assertTrue(np.array_equal(value, values), (unit, how, roles))
+
+if __name__ == '__main__':
+    unittest.main()
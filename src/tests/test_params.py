@@ -0,0 +1,144 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+
+
+from __future__ import division
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+from xml.dom import minidom
+from core.utils import Bareme
+import parametres.paramData as paramData
+from parametres.paramData import (XmlReader, Tree2Object, Node, CodeNode, BaremeNode, 
+                                  get_compiled_file, fingerprint, COMPILED_EXT)
+from tests.common import PARAM_FILE
+
+def _values_at(element, datesim):
+    for val in element.getElementsByTagName("VALUE"):
+        deb = datetime.strptime(val.getAttribute('deb'), "%Y-%m-%d").date()
+        fin = datetime.strptime(val.getAttribute('fin'), "%Y-%m-%d").date()
+        if deb <= datesim <= fin:
+            return float(val.getAttribute('valeur'))
+    return None
+
+def _read_nodes(nodes, parent, datesim):
+    for element in nodes:
+        if element.nodeType is element.TEXT_NODE:
+            continue
+        code = element.getAttribute('code')
+        desc = element.getAttribute('description')
+        if element.tagName == "BAREME":
+            bareme = Bareme(code)
+            for tranche in element.getElementsByTagName("TRANCHE"):
+                seuil = _values_at(tranche.getElementsByTagName("SEUIL")[0], datesim)
+                assiette = tranche.getElementsByTagName("ASSIETTE")
+                assiette = _values_at(assiette[0], datesim) if assiette else 1
+                taux = _values_at(tranche.getElementsByTagName("TAUX")[0], datesim)
+                if not seuil is None and not taux is None:
+                    bareme.addTranche(seuil, taux*assiette)
+            bareme.marToMoy()
+            BaremeNode(code, desc, bareme, parent)
+        elif element.tagName == "CODE":
+            val = _values_at(element, datesim)
+            if not val is None:
+                CodeNode(code, desc, val, parent, element.getAttribute('format'))
+        else:
+            _read_nodes(element.childNodes, Node(code, desc, parent), datesim)
+
+def reference_tree(param_file, datesim):
+    '''
+    The tree of parameters at datesim read from the xml with minidom, as 
+    XmlReader did before the parameters were compiled
+    '''
+    root = Node('root')
+    _read_nodes(minidom.parse(param_file).childNodes, root, datesim)
+    return root.child(0)
+
+def describe(node):
+    return (node.code, node.description, node.typeInfo, node.valueFormat, 
+            tuple(describe(child) for child in node._children))
+
+class XmlReaderTest(unittest.TestCase):
+    DATES = [date(2002, 1, 1), date(2008, 6, 1), date(2010, 1, 1)]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.compiled_dir = paramData.COMPILED_DIR
+        paramData.COMPILED_DIR = os.path.join(self.tmp, 'compiled')
+        paramData._compiled_params.clear()
+
+    def tearDown(self):
+        paramData.COMPILED_DIR = self.compiled_dir
+        paramData._compiled_params.clear()
+        shutil.rmtree(self.tmp)
+
+    def check(self, param_file, datesim):
+        expected = reference_tree(param_file, datesim)
+        reader = XmlReader(param_file, datesim)
+        self.assertEqual(describe(reader.tree), describe(expected))
+        self.assertEqual(fingerprint(reader.param), fingerprint(Tree2Object(expected)))
+        self.assertEqual(fingerprint(Tree2Object(reader.tree, defaut = True)), fingerprint(Tree2Object(expected, defaut = True)))
+
+    def test_compiled(self):
+        for datesim in self.DATES:
+            # compiled from the xml, then from memory
+            self.check(PARAM_FILE, datesim)
+        compiled_file = get_compiled_file(PARAM_FILE)
+        self.assertTrue(os.path.exists(compiled_file))
+        self.assertEqual(os.path.dirname(compiled_file), paramData.COMPILED_DIR)
+        self.assertFalse(os.path.exists(PARAM_FILE + COMPILED_EXT))
+        # from the compiled file
+        paramData._compiled_params.clear()
+        for datesim in self.DATES:
+            self.check(PARAM_FILE, datesim)
+
+    def test_not_writeable(self):
+        # the cache directory cannot be created under a file
+        paramData.COMPILED_DIR = os.path.join(self.tmp, 'file', 'compiled')
+        open(os.path.join(self.tmp, 'file'), 'w').close()
+        self.check(PARAM_FILE, self.DATES[-1])
+
+    def test_invalid_date(self):
+        # a wrong date only fails the dates where its node is read
+        param_file = os.path.join(self.tmp, 'param.xml')
+        with open(param_file, 'w') as f:
+            f.write('''<NODE code="root" datesim="2010-01-01">
+  <NODE code="fam">
+    <CODE code="bmaf" description="">
+      <VALUE valeur="10" deb="2009-01-01" fin="2010-12-31"/>
+      <VALUE valeur="9" deb="2008-13-01" fin="2008-12-31"/>
+    </CODE>
+  </NODE>
+</NODE>''')
+        reader = XmlReader(param_file)
+        self.assertEqual(reader._date, date(2010, 1, 1))
+        self.assertEqual(reader.param.fam.bmaf, 10)
+        self.assertRaises(Exception, XmlReader, param_file, date(2008, 6, 1))
+
+if __name__ == '__main__':
+    unittest.main()
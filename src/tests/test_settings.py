@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from core.settings import UserConfigParser, DEFAULTS
+
+class UserConfigParserTest(unittest.TestCase):
+    '''
+    The options missing from the configuration file are read as their default 
+    value, converted as the options of the file
+    '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'main.cfg')
+        with open(self.fname, 'w') as f:
+            f.write('[simulation]\nnmen = 11\n\n[calibration]\nup = 2.5\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_missing_options(self):
+        config = UserConfigParser(DEFAULTS, self.fname)
+        self.assertEqual(config.get('simulation', 'nmen'), 11)
+        self.assertEqual(config.get('calibration', 'up'), 2.5)
+        self.assertEqual(config.get('simulation', 'datesim'), date(2010, 1, 1))
+        self.assertEqual(config.get('simulation', 'maxrev'), 50000)
+        self.assertIs(config.get('simulation', 'profile'), False)
+        self.assertEqual(config.get('calibration', 'invlo'), 3.0)
+        self.assertEqual(config.get('calibration', 'method'), 'logit')
+
+    def test_defaults(self):
+        # without configuration file, every option is read as stored
+        config = UserConfigParser(DEFAULTS, os.path.join(self.tmp, 'none.cfg'))
+        self.assertEqual(config.get('simulation', 'datesim'), date(2010, 1, 1))
+        config.set('simulation', 'datesim', '2008-01-01')
+        self.assertEqual(config.get('simulation', 'datesim'), date(2008, 1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
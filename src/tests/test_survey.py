@@ -0,0 +1,147 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+"""
+openFisca, Logiciel libre de simulation du système socio-fiscal français
+Copyright © 2011 Clément Schaff, Mahdi Ben Jelloul
+
+This file is part of openFisca.
+
+    openFisca is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openFisca is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with openFisca.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+
+
+
+from __future__ import division
+import os
+import shutil
+import unittest
+from datetime import date
+import numpy as np
+import pandas
+from core.settings import CONF
+from core.datatable import DataTable, SystemSf, SURVEY_CACHE_EXT, INDEX
+from core.simulation import Simulation
+from france.data import InputTable
+from france.model import ModelFrance
+from openFiscaBench import synthetic_survey
+from tests.common import SurveyTestCase, PARAM_FILE, DATESIM, copy_file, get_param, assert_same_columns
+
+class SurveyCacheTest(SurveyTestCase):
+    def setUp(self):
+        self.cache = self.survey_file + SURVEY_CACHE_EXT
+        if os.path.isdir(self.cache):
+            shutil.rmtree(self.cache)
+
+    def test_cache(self):
+        from_csv = DataTable(InputTable, survey_data = self.survey_file)
+        self.assertTrue(os.path.isdir(self.cache))
+        from_cache = DataTable(InputTable, survey_data = self.survey_file)
+
+        self.assertEqual(from_cache._nrows, from_csv._nrows)
+        assert_same_columns(self, from_cache, from_csv, from_csv.col_names)
+        for unit in INDEX:
+            index, expected = from_cache.index[unit], from_csv.index[unit]
+            self.assertEqual(index['nb'], expected['nb'])
+            self.assertTrue(np.array_equal(index['unitPos'], expected['unitPos']))
+            for person in expected:
+                if isinstance(person, int):
+                    for key in ('idxIndi', 'idxUnit'):
+                        self.assertTrue(np.array_equal(index[person][key], expected[person][key]))
+
+        # set_value does not write to the cache
+        index = from_cache.index['ind']
+        from_cache.set_value('sali', np.zeros(index['nb']), index)
+        again = DataTable(InputTable, survey_data = self.survey_file)
+        self.assertTrue(np.array_equal(again.get_value('sali'), from_csv.get_value('sali')))
+
+    def test_stale(self):
+        fname = os.path.join(self.tmp, 'stale.csv')
+        shutil.copyfile(self.survey_file, fname)
+        DataTable(InputTable, survey_data = fname)
+        # a new survey in the same file is read from the csv
+        frame = synthetic_survey(self.NIND, seed = 2)
+        frame.to_csv(fname, index = False)
+        table = DataTable(InputTable, survey_data = fname)
+        self.assertEqual(table._nrows, len(frame))
+        self.assertTrue(np.allclose(table.get_value('sali'), frame['sali'].values))
+
+class StreamSurveyTest(SurveyTestCase):
+    '''
+    The survey read by chunks gives the aggregates and the values of the 
+    survey calculated at once
+    '''
+    REFORM = copy_file('reformes', 'Allocations familiales imposables.ofp')
+
+    def check(self, reform_file):
+        varnames = ['revdisp', 'af', 'sali']
+        streamed = Simulation(ModelFrance, InputTable, PARAM_FILE, datesim = DATESIM, reform_file = reform_file)
+        output = os.path.join(self.tmp, 'stream.csv')
+        aggregates = streamed.stream_survey(self.survey_file, varnames, output, ['so'], chunksize = 200)
+
+        simulation = Simulation(ModelFrance, InputTable, PARAM_FILE, datesim = DATESIM, reform_file = reform_file)
+        simulation.load_survey(self.survey_file)
+        simulation.compute()
+        idx = simulation.inputs.index['men']
+        weight = simulation.inputs.get_value('wprm', idx)
+        so = simulation.inputs.get_value('so', idx)
+        runs = [(aggregates, simulation.outputs)]
+        if reform_file is not None:
+            runs.append((streamed.aggregates_default, simulation.outputs_default))
+            self.assertFalse(np.allclose(aggregates.sums['revdisp'], streamed.aggregates_default.sums['revdisp']))
+        for running, outputs in runs:
+            for varname in varnames:
+                table = outputs if varname in outputs.col_names else simulation.inputs
+                value = table.aggregate(varname, 'men')
+                self.assertTrue(np.allclose(running.sums[varname], np.dot(weight, value)), varname)
+                groups = running.get_groups('so')
+                for cat in groups.index:
+                    self.assertTrue(np.allclose(groups[varname][cat], np.dot(weight[so == cat], value[so == cat])))
+
+        frame = pandas.read_csv(output)
+        self.assertTrue(np.allclose(frame['revdisp'].values, simulation.outputs.get_value('revdisp')))
+        self.assertTrue(np.allclose(frame['sali'].values, simulation.inputs.get_value('sali')))
+
+    def test_stream(self):
+        self.check(None)
+
+    def test_stream_reform(self):
+        self.check(self.REFORM)
+
+class SimulationDateTest(SurveyTestCase):
+    '''
+    A simulation at another date than the one of the configuration reads and 
+    calculates its tables at its own date, and leaves the configuration as is
+    '''
+    DATESIM = date(2009, 1, 1)
+
+    def test_datesim(self):
+        datesim = CONF.get('simulation', 'datesim')
+        simulation = Simulation(ModelFrance, InputTable, PARAM_FILE, datesim = self.DATESIM)
+        simulation.load_survey(self.survey_file)
+        outputs = simulation.compute(['revdisp', 'af'])
+        self.assertEqual(CONF.get('simulation', 'datesim'), datesim)
+        self.assertEqual(simulation.inputs.datesim, self.DATESIM)
+        self.assertEqual(outputs.datesim, self.DATESIM)
+
+        param = get_param(self.DATESIM)
+        system = SystemSf(ModelFrance, param, param, datesim = self.DATESIM)
+        system.set_inputs(DataTable(InputTable, survey_data = self.survey_file, datesim = self.DATESIM))
+        system.calculate(['revdisp', 'af'])
+        assert_same_columns(self, outputs, system, ['revdisp', 'af'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,6 +28,7 @@ import numpy as np
 from pandas import DataFrame
 from core.qthelpers import MyComboBox
 from core.columns import EnumCol
+from core.aggregates import AggregateCube, get_matrix, weighted_sums, weighted_counts
 
 class DataFrameDock(QDockWidget):
     def __init__(self, parent = None):
@@ -83,6 +84,7 @@ class AggregateOutputWidget(QDockWidget):
         self.parent = parent
         self.varlist = ['irpp', 'ppe', 'af', 'cf', 'ars', 'aeeh', 'asf', 'aspa', 'aah', 'caah', 'rsa', 'aefa', 'api', 'logt']
         self.data = DataFrame() # Pandas DataFrame
+        self.cube = None # AggregateCube of data, built once per simulation
 
     def dist_by_changed(self):    
         widget = self.distribution_combo.box
@@ -93,6 +95,8 @@ class AggregateOutputWidget(QDockWidget):
             self.update_output(self.data)
     
     def set_data(self, output_data):
+        if output_data is not self.data:
+            self.cube = None
         self.data = output_data
         self.wght = self.data['wprm']
                  
@@ -144,6 +148,9 @@ class AggregateOutputWidget(QDockWidget):
         
         if description is not None:  
             self.set_distribution_choices(description)
+
+        if self.cube is None:
+            self.cube = AggregateCube(self.data, set(self.var2enum) & set(self.data.columns))
             
         if not hasattr(self, 'distribution_by_var'):
             self.distribution_by_var = 'typmen15'
@@ -151,14 +158,8 @@ class AggregateOutputWidget(QDockWidget):
         by_var = self.distribution_by_var
         
 
-        V = []
-        M = []
-        B = []
-        for var in self.varlist:
-            montant, benef = self.get_aggregate(var)
-            V.append(var)
-            M.append(montant)
-            B.append(benef)
+        V = list(self.varlist)
+        M, B = self.get_aggregates(V)
         
         items = [(u'Mesure', V), 
                  (u"Dépense\n(millions d'€)", M), 
@@ -182,29 +183,31 @@ class AggregateOutputWidget(QDockWidget):
     def calculated(self):
         self.emit(SIGNAL('calculated()'))
                 
+    def get_aggregates(self, varlist):
+        '''
+        returns the lists of aggregate spending (millions) and of nb of beneficiaries 
+        (thousands) of varlist, each computed in one matrix product
+        '''
+        values = get_matrix(self.data, varlist)
+        wght = np.asarray(self.wght, dtype = float)
+        montants = weighted_sums(values, wght)
+        beneficiaires = weighted_counts(values, wght)
+        return ([int(round(montant/10**6)) for montant in montants], 
+                [int(round(benef/10**3)) for benef in beneficiaires])
+
     def get_aggregate(self, var):
         '''
         returns aggregate spending, nb of beneficiaries
         '''
-        montants = self.data[var]
-        beneficiaires = self.data[var].values != 0
-        return int(round(sum(montants*self.wght)/10**6)), int(round(sum(beneficiaires*self.wght)/10**3))
+        montants, beneficiaires = self.get_aggregates([var])
+        return montants[0], beneficiaires[0]
     
     def group_by(self, varlist, category):
-        keep = [category, 'wprm']
-        temp = []
-        for var in varlist:
-            self.data['__' + var] = self.wght*self.data[var]
-            temp.append('__'+var)
-            keep.append('__'+var)
-        grouped = self.data[keep].groupby(category, as_index = False)
-        aggr = grouped.aggregate(np.sum)
-        total = self.data[keep].sum()
-
-        for varname in temp:
-            aggr[varname] = aggr[varname]/aggr['wprm']
-            total[varname] = total[varname]/total['wprm']
-        
+        '''
+        Returns the weighted means of varlist by category, looked up in the cube
+        '''
+        aggr = self.cube.get_means(category, varlist)
+        aggr.columns = [category, 'wprm'] + ['__' + var for var in varlist]
         return aggr
 
     def clear(self):
@@ -212,4 +215,5 @@ class AggregateOutputWidget(QDockWidget):
         self.distribution_view.clear()
         self.data = None
         self.wght = None
+        self.cube = None
             
@@ -36,7 +36,7 @@ from core.qthelpers import MyComboBox, MySpinBox, MyDoubleSpinBox, DataFrameView
 from widgets.matplotlibwidget import MatplotlibWidget
 from Config import CONF
 from core.columns import EnumCol, BoolCol, AgesCol, DateCol, BoolPresta
-from core.calmar import calmar
+from core.calmar import Calmar, check_margins
 
 MODCOLS = [EnumCol, BoolCol, BoolPresta, AgesCol, DateCol]
 
@@ -51,6 +51,8 @@ class CalibrationWidget(QDialog):
 
         self.param = {}
         self.inputs = None
+        # calibration engine keeping the values of the margins variables and the last solution
+        self.calmar = None
         self.frame = None
         self.input_margins_df = None
         self.output_margins_df   = None
@@ -183,8 +185,9 @@ class CalibrationWidget(QDialog):
         self.unit = 'men'
         self.weights = 1*self.inputs.get_value("wprm", inputs.index[self.unit])
         self.weights_init = self.inputs.get_value("wprm_init", inputs.index[self.unit])
+        self.calmar = None
         
-        self.ini_totalpop = sum(self.weights_init)
+        self.ini_totalpop = self.weights_init.sum()
         label_str = u"Population initiale totale :" + str(int(round(self.ini_totalpop))) + u" ménages"
         self.ini_totalpop_label.setText(label_str)
 
@@ -360,13 +363,11 @@ class CalibrationWidget(QDialog):
 
         varcol = self.get_col(varname)
         idx = self.inputs.index[self.unit]
-        enum = self.inputs.description.get_col('qui'+self.unit).enum
-        people = [x[1] for x in enum]
 
         if self.inputs.description.has_col(varname):
             value = self.inputs.get_value(varname, index = idx)
         elif self.outputs.description.has_col(varname):
-            value = self.outputs.get_value(varname, index = idx, opt = people, sum_ = True)
+            value = self.outputs.aggregate(varname, self.unit)
 
         label = varcol.label
         # TODO: rewrite this using pivot table
@@ -476,32 +477,40 @@ class CalibrationWidget(QDialog):
         return p
 
 
-    def build_calmar_data(self, marges, weights_in):
-        data = {weights_in: self.weights_init}
-        for var in marges:
-            if self.inputs.description.has_col(var):
-                data[var] = self.inputs.get_value(var, self.inputs.index[self.unit])
-            else:
-                if self.outputs:
-                    if self.outputs.description.has_col(var):
-                        idx = self.outputs.index[self.unit]
-                        enum = self.inputs.description.get_col('qui'+self.unit).enum
-                        people = [x[1] for x in enum]
-                        data[var] = self.outputs.get_value(var, index=idx, opt=people, sum_=True)        
-        return data
+    def get_calmar_value(self, var):
+        '''
+        Returns the value of the margin variable var for each unit
+        '''
+        if self.inputs.description.has_col(var):
+            return self.inputs.get_value(var, self.inputs.index[self.unit])
+        elif self.outputs and self.outputs.description.has_col(var):
+            return self.outputs.aggregate(var, self.unit)
+        raise Exception('%s was not find in inputs nor in outputs' % var)
 
-    
-    def update_weights(self, marges, param = {}, weights_in='wprm_init'):
+    def update_weights(self, marges, param = {}):
         '''
-        Lauches calmar, stores new weights and returns adjusted margins
+        Lauches calmar, stores new weights and returns adjusted margins.
+        The calibration engine is kept between two calls: only the variables new
+        to the margins are read, and the solution starts from the previous one.
         '''
-        data = self.build_calmar_data(marges, weights_in)
         try:
-            val_pondfin, lambdasol, marge_new = calmar(data, marges, param = param, pondini=weights_in)
+            if self.calmar is None:
+                self.calmar = Calmar(self.weights_init, param)
+            else:
+                self.calmar.set_param(param)
+            for var, val in marges.iteritems():
+                categorical = isinstance(val, dict)
+                if var != 'totalpop' and not self.calmar.has_variable(var, categorical):
+                    self.calmar.add_variable(var, self.get_calmar_value(var), categorical)
+
+            totalpop = marges.get('totalpop', self.weights_init.sum())
+            marge_new = check_margins(marges, totalpop, param.get('use_proportions', False))
+            self.weights = self.calmar.solve(marge_new, totalpop)
         except Exception, e:
             raise Exception("Calmar returned error '%s'" % e)
 
-        self.weights = val_pondfin
+        if not self.calmar.converged:
+            print "calmar: stopped after ", self.calmar.iterations, "iterations"
         return marge_new    
     
     def calibrate(self):
@@ -509,7 +518,6 @@ class CalibrationWidget(QDialog):
         Calibrate accoding to margins found in frame
         '''
         df = self.frame
-        inputs = self.inputs
         margins = {}
         df = df.reset_index(drop=True)
         df = df.set_index(['var','mod'], inplace = True)        
@@ -534,22 +542,13 @@ class CalibrationWidget(QDialog):
         
         w = self.weights
         for var in margins.keys():
-            if inputs.description.has_col(var):
-                value = inputs.get_value(var, inputs.index[self.unit])
-            else:
-                idx = self.outputs.index[self.unit]
-                enum = self.outputs._inputs.description.get_col('qui'+self.unit).enum
-                people = [x[1] for x in enum]
-                value = self.outputs.get_value(var, index=idx, opt=people, sum_=True)
-                
             if isinstance(margins[var], dict):
-                items = [('marge', w  ),('mod', value)]
-                updated_margins = DataFrame.from_items(items).groupby('mod', sort= True).sum()                
+                updated_margins = self.calmar.get_margins(var, w)
                 for mod in margins[var].keys():
                     df.set_value((var,mod), u"cible ajustée", adjusted_margins[var][mod])
-                    df.set_value((var,mod), u"marge", updated_margins['marge'][mod])
+                    df.set_value((var,mod), u"marge", updated_margins[mod])
             else:
-                updated_margin = (w*value).sum()
+                updated_margin = self.calmar.get_margins(var, w)
                 df.set_value((var,0), u"cible ajustée", adjusted_margins[var])
                 df.set_value((var,0), u"marge", updated_margin)
         
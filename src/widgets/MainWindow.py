@@ -22,6 +22,7 @@ This file is part of openFisca.
 """
 
 import platform
+import os
 from PyQt4.QtCore import (SIGNAL, SLOT, Qt, QSettings, QVariant, QSize, QPoint, 
                           PYQT_VERSION_STR, QT_VERSION_STR, QLocale)
 from PyQt4.QtGui import (QMainWindow, QWidget, QGridLayout, QMessageBox, QKeySequence,
@@ -38,6 +39,8 @@ from widgets.ExploreData import ExploreDataWidget
 from france.data import InputTable
 from france.model import ModelFrance
 from core.datatable import DataTable, SystemSf
+from core.parallel import calculate_in_shards
+from core.simulation import ScenarioSession
 from core.utils import gen_output_data, gen_aggregate_output, Scenario
 from core.qthelpers import create_action, add_actions, get_icon
 import gc
@@ -83,6 +86,7 @@ class MainWindow(QMainWindow):
             # be useful some day...
         
         self.scenario = Scenario()
+        self.session = ScenarioSession(ModelFrance, InputTable)
         # Preferences
         self.general_prefs = [SimConfigPage, PathConfigPage, CalConfigPage]
         self.oldXAXIS = 'sal'
@@ -315,18 +319,20 @@ class MainWindow(QMainWindow):
         P_default = self._parametres.getParam(defaut = True)    
         P_courant = self._parametres.getParam(defaut = False)
         
-        input_table = DataTable(InputTable, scenario = self.scenario)
-
-        population_courant = SystemSf(ModelFrance, P_courant, P_default)
-        population_courant.set_inputs(input_table)
-        data_courant = gen_output_data(population_courant)
+        # only the prestations affected by the edits since the last computation, 
+        # or by the reform, are calculated again
+        self.session.set_scenario(self.scenario)
 
         if self.reforme:
-            population_default = SystemSf(ModelFrance, P_default, P_default)
-            population_default.set_inputs(input_table)
+            population_default = self.session.get_system('default', P_default, P_default)
             data_default = gen_output_data(population_default)
+
+            population_courant = self.session.get_system('courant', P_courant, P_default, baseline = 'default')
+            data_courant = gen_output_data(population_courant)
             data_courant.difference(data_default)
         else:
+            population_courant = self.session.get_system('courant', P_courant, P_default)
+            data_courant = gen_output_data(population_courant)
             data_default = data_courant
         self._table.updateTable(data_courant, reforme = self.reforme, mode = self.mode, dataDefault = data_default)
         self._graph.updateGraph(data_courant, reforme = self.reforme, mode = self.mode, dataDefault = data_default)
@@ -343,7 +349,10 @@ class MainWindow(QMainWindow):
         output_table = SystemSf(ModelFrance, P_courant, P_default)
         output_table.set_inputs(input_table)
         
-        output_table.calculate()
+        # forking the GUI process is opt-in, the survey is calculated in this process by default
+        calculate_in_shards(output_table, processes = CONF.get('simulation', 'processes'))
+        if output_table.profiler is not None:
+            output_table.profiler.save(os.path.join(CONF.get('paths', 'output_dir'), 'openfisca_profile'))
         
         return output_table
     